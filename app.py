@@ -1,51 +1,146 @@
 from dotenv import load_dotenv
-from flask import Flask, render_template_string, request, jsonify
-from flask_wtf.csrf import CSRFProtect
+from flask import Flask, Response, request, jsonify, g, has_app_context, has_request_context
+from flask_wtf.csrf import CSRFProtect, generate_csrf
+from markupsafe import escape
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import os
+import atexit
+import hmac
+import uuid
 import logging
 import re
 import json
-import requests
+import time
+import zlib
+import base64
+import asyncio
+from array import array
+from itertools import chain
+from contextlib import aclosing
+from http.cookiejar import DefaultCookiePolicy
+import threading
 from functools import wraps
 import sqlite3
 from datetime import datetime
-from typing import Optional, Tuple, Dict, Any
+from decimal import Decimal
+from typing import TYPE_CHECKING, Optional, Tuple, Dict, Any, Iterator, List, NamedTuple
+from urllib.parse import quote, urlencode, urlsplit
 from contextlib import contextmanager
-from pathlib import Path
+import click
+from flask.cli import AppGroup
+import migrations
+from dbpool import ConnectionPool, is_busy_error, query_label
+from cache import TTLCache
+from jobs import Job, JobFailed, JobQueue
+from metrics import Counter, Histogram, MultiProcessCollector, Registry
+from fetch_async import AsyncFetchEngine
+from profilecache import ProfileCache
+from ledger import ActionLedger
+from events import EventBus
+import export
+from sessions import SessionStore
+from scheduler import Dispatcher, FairScheduler
+from payments import FixtureProvider, PaymentVerifier, TronGridProvider
+from assets import AssetManifest
+from profiler import SORT_KEYS, RequestProfiler
+from logsetup import LogPipeline, mask as mask_sensitive
+import ratelimit_store  # noqa: F401  (registers the sqlite:// limiter storage)
+from diffengine import NonFollowerDiff, UserRecord, difference, pack_ids, remove, sorted_ids, unpack_ids
+
+if TYPE_CHECKING:  # requests is imported on first use, see InstagramClient._build
+    import requests
 
 # ✅ Загружаем .env
 load_dotenv()
 
-# ✅ Создаём папку data
+# The data directory is created by whatever writes there first (pool, migrations, limiter).
 DB_PATH = os.environ.get("DB_PATH", os.path.join("data", "app.db"))
 DB_DIR = os.path.dirname(DB_PATH)
-if DB_DIR:
-    Path(DB_DIR).mkdir(parents=True, exist_ok=True)
+
+# ---------------------------------------------------------
+# 📈 METRICS
+# ---------------------------------------------------------
+# Exposed on /metrics (admin key). Each worker writes its metrics to a file in
+# METRICS_DIR and a scrape sums them all; empty METRICS_DIR = this worker only.
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(DB_DIR or ".", "metrics"))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+metrics_registry = Registry()
+metrics_collector = MultiProcessCollector(metrics_registry, METRICS_DIR or None, METRICS_FLUSH_INTERVAL)
+
+HTTP_LATENCY = metrics_registry.histogram(
+    "http_request_duration_seconds", "Request latency by Flask endpoint.", ("endpoint",))
+HTTP_REQUESTS = metrics_registry.counter(
+    "http_requests_total", "Requests by endpoint, method and status.", ("endpoint", "method", "status"))
+HTTP_DB_TIME = metrics_registry.histogram(
+    "http_request_db_seconds", "SQLite time spent per request.", ("endpoint",))
+DB_QUERY_LATENCY = metrics_registry.histogram(
+    "db_query_duration_seconds", "SQLite statement latency by statement kind and table.", ("query",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0))
+RATELIMIT_REJECTIONS = metrics_registry.counter(
+    "ratelimit_rejections_total", "Requests rejected by the rate limiter.", ("endpoint", "limit"))
+CREDITS_SPENT = metrics_registry.counter("credits_spent_total", "Credits deducted for unfollows.")
+CREDITS_REFUNDED = metrics_registry.counter("credits_refunded_total", "Credits refunded for failed unfollows.")
+CREDITS_GRANTED = metrics_registry.counter("credits_granted_total", "Credits added by approved payments.")
+PAYMENTS_APPROVED = metrics_registry.counter("payments_approved_total", "Approved payments by plan.", ("plan",))
+
+
+# Sampled cProfile of requests (see profiler.py): PROFILE_SAMPLE_RATE of all
+# requests, plus any request carrying X-Profile-Key: <ADMIN_GRANT_KEY>.
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(DB_DIR or ".", "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+request_profiler = RequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_KEEP)
+
+
+def _on_rate_limited(limit) -> None:
+    RATELIMIT_REJECTIONS.inc(request.endpoint or "unmatched", str(limit.limit))
+
+
+def _observe_query(sql: str, seconds: float) -> None:
+    DB_QUERY_LATENCY.observe(seconds, query_label(sql))
+    if has_request_context():
+        g._db_seconds = g.get("_db_seconds", 0.0) + seconds
 
 # ---------------------------------------------------------
 # 🛡️ CONFIGURATION & SECURITY
 # ---------------------------------------------------------
-app = Flask(__name__)
+# /static is served by static_asset() from the fingerprinted manifest below.
+app = Flask(__name__, static_folder=None)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", os.urandom(24).hex())
 app.config["WTF_CSRF_TIME_LIMIT"] = 3600
 app.config["WTF_CSRF_HEADERS"] = ["X-CSRF-Token"]
 csrf = CSRFProtect(app)
 
-# Rate limiting
+# Rate limiting: counters live in a SQLite file shared by every worker on the
+# host (see ratelimit_store.py); "memory://" gives each worker its own.
+RATELIMIT_STORAGE_URI = os.environ.get(
+    "RATELIMIT_STORAGE_URI", "sqlite:///" + os.path.join(DB_DIR or ".", "ratelimit.db")
+)
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=RATELIMIT_STORAGE_URI,
+    on_breach=_on_rate_limited
 )
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
+# JSON lines (or LOG_FORMAT=text) written by a background listener thread;
+# secrets are masked centrally, see logsetup.py. LOG_REQUESTS=0 turns off
+# the one-line-per-request summary.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_REQUESTS = os.environ.get("LOG_REQUESTS", "1") != "0"
+
+log_pipeline = LogPipeline()
+log_pipeline.configure(
+    LOG_LEVEL, LOG_FORMAT,
+    get_request_id=lambda: g.get("request_id") if has_request_context() else None,
 )
+atexit.register(log_pipeline.stop)
 logger = logging.getLogger(__name__)
+access_logger = logging.getLogger(f"{__name__}.access")
 
 # ---------------------------------------------------------
 # 💾 DB (SQLite)
@@ -53,12 +148,60 @@ logger = logging.getLogger(__name__)
 FREE_CREDITS = int(os.environ.get("FREE_CREDITS", 100))
 STARTER_PACK_CREDITS = int(os.environ.get("STARTER_PACK_CREDITS", 1000))
 
+DB_AUTO_MIGRATE = os.environ.get("DB_AUTO_MIGRATE", "1") != "0"
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", 10))
+DB_CACHE_SIZE_KIB = int(os.environ.get("DB_CACHE_SIZE_KIB", 8192))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 64 * 1024 * 1024))
+
+db_pool = ConnectionPool(
+    DB_PATH,
+    max_size=DB_POOL_SIZE,
+    timeout=DB_BUSY_TIMEOUT,
+    cache_size_kib=DB_CACHE_SIZE_KIB,
+    mmap_size=DB_MMAP_SIZE,
+    on_query=_observe_query,
+)
+
+# Authenticated users cached in two parts (0 disables): session token ->
+# (user_id, expires_at) and user_id -> users row. Rows are invalidated on
+# local writes; other workers may lag by up to the TTL.
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 2048))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 30))
+session_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# Finished scans kept per session so results can be paged without rescanning.
+scan_results = TTLCache(int(os.environ.get("SCAN_RESULTS_CACHE_SIZE", 64)), 1800)
+SCAN_RESULTS_MAX_LIMIT = 200
+
 ADMIN_GRANT_KEY = os.environ.get("ADMIN_GRANT_KEY")
 PAYMENT_ADDRESS_TRC20 = os.environ.get("PAYMENT_ADDRESS_TRC20", "").strip()
+PLAN_PRICES_USDT = {
+    "starter": Decimal(os.environ.get("STARTER_PRICE_USDT", "5")),
+    "lifetime": Decimal(os.environ.get("LIFETIME_PRICE_USDT", "9")),
+}
+
+# Automatic payment verification: "trongrid", "fixture:<path.json>" or empty
+# (manual approval only). Needs PAYMENT_ADDRESS_TRC20.
+PAYMENT_VERIFY_PROVIDER = os.environ.get("PAYMENT_VERIFY_PROVIDER", "").strip()
+PAYMENT_VERIFY_INTERVAL = float(os.environ.get("PAYMENT_VERIFY_INTERVAL", 60))
+PAYMENT_VERIFY_BATCH = int(os.environ.get("PAYMENT_VERIFY_BATCH", 50))
+PAYMENT_MIN_CONFIRMATIONS = int(os.environ.get("PAYMENT_MIN_CONFIRMATIONS", 19))
+TRONGRID_URL = os.environ.get("TRONGRID_URL", "https://api.trongrid.io")
+TRONGRID_API_KEY = os.environ.get("TRONGRID_API_KEY") or None
 
 # ---------------------------------------------------------
 # 📡 INSTAGRAM API (Direct HTTP Requests)
 # ---------------------------------------------------------
+# Overridable so a local stub (bench/fake_instagram.py) can stand in for Instagram.
+INSTAGRAM_BASE_URL = os.environ.get("INSTAGRAM_BASE_URL", "https://www.instagram.com").rstrip("/")
+
+# Friendship pagination: users per page and pause between pages (seconds).
+SCAN_PAGE_SIZE = int(os.environ.get("SCAN_PAGE_SIZE", 50))
+SCAN_PAGE_DELAY = float(os.environ.get("SCAN_PAGE_DELAY", 1.0))
+
 INSTAGRAM_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': '*/*',
@@ -70,49 +213,338 @@ INSTAGRAM_HEADERS = {
     'Referer': 'https://www.instagram.com/',
 }
 
+# Upstream HTTP: keep-alive pool sized to the gunicorn threads, split timeouts,
+# bounded retries for idempotent GETs on 5xx / connection resets.
+INSTAGRAM_CONNECT_TIMEOUT = float(os.environ.get("INSTAGRAM_CONNECT_TIMEOUT", 5))
+INSTAGRAM_READ_TIMEOUT = float(os.environ.get("INSTAGRAM_READ_TIMEOUT", 15))
+INSTAGRAM_RETRIES = int(os.environ.get("INSTAGRAM_RETRIES", 2))
+INSTAGRAM_POOL_SIZE = int(os.environ.get("INSTAGRAM_POOL_SIZE", 8))
+
+# Scans walk the follower and following lists concurrently (see fetch_async.py):
+# at most FETCH_ACCOUNT_CONCURRENCY requests in flight per account and
+# FETCH_GLOBAL_CONCURRENCY per worker process.
+SCAN_CONCURRENT = os.environ.get("SCAN_CONCURRENT", "1") != "0"
+FETCH_GLOBAL_CONCURRENCY = int(os.environ.get("FETCH_GLOBAL_CONCURRENCY", INSTAGRAM_POOL_SIZE))
+FETCH_ACCOUNT_CONCURRENCY = int(os.environ.get("FETCH_ACCOUNT_CONCURRENCY", 2))
+
+
+def _endpoint_label(url: str) -> str:
+    """``/api/v1/friendships/123/followers/`` -> ``friendships/:id/followers``."""
+    path = urlsplit(url).path.strip("/")
+    if path.startswith("api/v1/"):
+        path = path[len("api/v1/"):]
+    return re.sub(r"(?<=/)\d+(?=/|$)", ":id", path)
+
+
+class InstagramClient:
+    """Process-wide keep-alive HTTP client for Instagram calls.
+
+    One ``requests.Session`` is shared by every thread of a worker (and
+    rebuilt after a fork). Its cookie jar refuses all cookies so one
+    user's Set-Cookie can never leak into another user's request.
+    """
+
+    def __init__(self, pool_size: int, retries: int, connect_timeout: float, read_timeout: float):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.latency = Histogram()
+        self.statuses = Counter()
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _build(self) -> "requests.Session":
+        # requests/urllib3 are the slowest imports in the app and only the
+        # Instagram paths need them, so they load on the first call.
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        class _Retry(Retry):
+            # 429s are not retried here: the caller owns that backoff (fetch_async
+            # blocks the whole account until Retry-After instead of one thread).
+            RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+        retry = _Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(INSTAGRAM_HEADERS)
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
+    @property
+    def session(self) -> "requests.Session":
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._session = self._build()
+                    self._pid = os.getpid()
+        return self._session
+
+    def request(self, method: str, url: str, sessionid: str, data: dict = None) -> "requests.Response":
+        label = _endpoint_label(url)
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.request(
+                method, url,
+                headers={"Cookie": f"sessionid={sessionid}; csrftoken=missing;"},
+                json=data if method != "GET" else None,
+                timeout=self.timeout,
+            )
+            status = str(response.status_code)
+            return response
+        finally:
+            self.latency.observe(time.perf_counter() - started, method, label)
+            self.statuses.inc(method, label, status)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "latency": {" ".join(k): v for k, v in self.latency.snapshot().items()},
+            "statuses": {" ".join(k): v for k, v in self.statuses.snapshot().items()},
+        }
+
+
+instagram_client = InstagramClient(
+    pool_size=INSTAGRAM_POOL_SIZE,
+    retries=INSTAGRAM_RETRIES,
+    connect_timeout=INSTAGRAM_CONNECT_TIMEOUT,
+    read_timeout=INSTAGRAM_READ_TIMEOUT,
+)
+metrics_registry.register(
+    "instagram_request_duration_seconds", "Instagram API call latency.",
+    ("method", "endpoint"), instagram_client.latency)
+metrics_registry.register(
+    "instagram_responses_total", "Instagram API responses by status (error = no response).",
+    ("method", "endpoint", "status"), instagram_client.statuses)
+
+
 def make_instagram_request(url: str, sessionid: str, method: str = 'GET', data: dict = None) -> Optional[dict]:
     """Make direct HTTP request to Instagram API"""
-    headers = INSTAGRAM_HEADERS.copy()
-    headers['Cookie'] = f'sessionid={sessionid}; csrftoken=missing;'
-    
     try:
-        if method == 'GET':
-            response = requests.get(url, headers=headers, timeout=15)
-        else:
-            response = requests.post(url, headers=headers, json=data, timeout=15)
+        response = instagram_client.request(method, url, sessionid, data)
         
         if response.status_code == 200:
             return response.json()
         else:
-            logger.error(f"Instagram API returned {response.status_code}: {response.text[:200]}")
+            logger.error("Instagram API returned %s for %s", response.status_code, _endpoint_label(url),
+                         extra={"upstream_bytes": len(response.content)})
             return None
     except Exception as e:
-        logger.error(f"Instagram request failed: {e}")
+        logger.error("Instagram request failed: %s", e)
         return None
 
-def get_user_info(sessionid: str, username: str = None) -> Optional[dict]:
-    """Get user info from Instagram"""
-    if username:
-        url = f'https://www.instagram.com/api/v1/users/web_profile_info/?username={username}'
-    else:
-        url = 'https://www.instagram.com/api/v1/accounts/current_user/?edit=true'
-    
-    data = make_instagram_request(url, sessionid)
-    
+
+def _fetch_page_json(url: str, sessionid: str) -> Tuple[int, Optional[str], Optional[dict]]:
+    """Blocking GET for the async engine: ``(status, Retry-After, json)``."""
+    import requests  # already loaded by instagram_client
+
+    try:
+        response = instagram_client.request("GET", url, sessionid)
+    except requests.RequestException as e:
+        logger.error("Instagram request failed: %s", e)
+        return 0, None, None
+    if response.status_code != 200:
+        logger.error("Instagram API returned %s for %s", response.status_code, _endpoint_label(url),
+                     extra={"upstream_bytes": len(response.content)})
+        return response.status_code, response.headers.get("Retry-After"), None
+    try:
+        return 200, None, response.json()
+    except ValueError:
+        logger.error("Instagram API returned invalid JSON")
+        return 200, None, None
+
+
+fetch_engine = AsyncFetchEngine(
+    _fetch_page_json,
+    global_limit=FETCH_GLOBAL_CONCURRENCY,
+    per_account_limit=FETCH_ACCOUNT_CONCURRENCY,
+)
+
+# Public profiles looked up by username go through a two-tier cache
+# (in-process LRU, then the profile_cache table) with negative caching for
+# unknown usernames. The logged-in user's own profile is never cached.
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", 1024))
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", 3600))
+PROFILE_CACHE_NEGATIVE_TTL = float(os.environ.get("PROFILE_CACHE_NEGATIVE_TTL", 300))
+PROFILE_CACHE_DB_MAX = int(os.environ.get("PROFILE_CACHE_DB_MAX", 50000))
+# Unfollowers listed by /api/scan/unfollowers that get profile details (0 = none).
+PROFILE_ENRICH_MAX = int(os.environ.get("PROFILE_ENRICH_MAX", 25))
+
+# Only these profile fields are cached.
+PROFILE_FIELDS = ("id", "pk", "username", "full_name", "is_private", "is_verified",
+                  "profile_pic_url", "edge_followed_by", "edge_follow")
+
+
+def _unwrap_user(data: Optional[dict]) -> Optional[dict]:
     if data:
-        if 'data' in data and 'user' in data['data']:
+        if 'data' in data and isinstance(data['data'], dict) and 'user' in data['data']:
             return data['data']['user']
         elif 'user' in data:
             return data['user']
-    
     return None
 
-def get_followers_following(sessionid: str, user_id: str) -> Tuple[list, list]:
-    """Get followers and following lists"""
-    # Simplified version - returns empty lists for now
-    # Full implementation requires pagination and more complex API calls
-    logger.warning("get_followers_following: Simplified implementation")
-    return [], []
+
+def _fetch_profile(sessionid: str, username: str) -> Tuple[Optional[bool], Optional[dict]]:
+    """Profile cache loader: ``(True, profile)``, ``(False, None)`` if unknown, ``(None, None)`` on error."""
+    url = f'{INSTAGRAM_BASE_URL}/api/v1/users/web_profile_info/?username={quote(username)}'
+    status, _, data = _fetch_page_json(url, sessionid)
+    if status == 404:
+        return False, None
+    if status != 200 or data is None:
+        return None, None
+    user = _unwrap_user(data)
+    if not user:
+        return False, None
+    return True, {k: user[k] for k in PROFILE_FIELDS if k in user}
+
+
+profile_cache = ProfileCache(
+    lambda: db(),
+    _fetch_profile,
+    TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL),
+    ttl=PROFILE_CACHE_TTL,
+    negative_ttl=PROFILE_CACHE_NEGATIVE_TTL,
+    max_rows=PROFILE_CACHE_DB_MAX,
+)
+metrics_registry.register(
+    "profile_cache_requests_total", "Profile lookups by result (memory_hit, db_hit, negative_hit, miss, shared, error).",
+    ("result",), profile_cache.requests)
+
+
+def get_user_info(sessionid: str, username: str = None, use_cache: bool = True) -> Optional[dict]:
+    """Get user info from Instagram.
+
+    With ``username`` the (trimmed) public profile comes from the profile
+    cache; ``use_cache=False`` fetches fresh and refreshes the cache.
+    Without it, the session's own account is fetched uncached.
+    """
+    if username:
+        return profile_cache.get(sessionid, username, refresh=not use_cache)
+    url = f'{INSTAGRAM_BASE_URL}/api/v1/accounts/current_user/?edit=true'
+    return _unwrap_user(make_instagram_request(url, sessionid))
+
+def get_friendship_counts(sessionid: str, username: str) -> Optional[Dict[str, int]]:
+    """Follower/following totals from the public profile, or None if unavailable.
+
+    Always fetched fresh: an incremental scan trusts these counts.
+    """
+    info = get_user_info(sessionid, username, use_cache=False) if username else None
+    try:
+        return {
+            "followers": int(info["edge_followed_by"]["count"]),
+            "following": int(info["edge_follow"]["count"]),
+        }
+    except (TypeError, KeyError, ValueError):
+        return None
+
+FRIENDSHIP_KINDS = ("followers", "following")
+
+# Only these fields are kept per user so a page costs a few hundred bytes per entry.
+FRIENDSHIP_USER_FIELDS = ("pk", "username", "full_name", "is_private", "is_verified", "profile_pic_url")
+
+
+class PaginationError(Exception):
+    """A friendship page could not be fetched; resume the walk from ``cursor``."""
+
+    def __init__(self, kind: str, cursor: Optional[str]):
+        super().__init__(f"failed to fetch {kind} page (cursor={cursor!r})")
+        self.kind = kind
+        self.cursor = cursor
+
+
+class FriendshipPage(NamedTuple):
+    kind: str
+    users: List[Dict[str, Any]]
+    cursor: Optional[str]
+    next_cursor: Optional[str]  # None once the walk is complete
+
+
+def friendship_url(user_id: str, kind: str, cursor: Optional[str], page_size: Optional[int] = None) -> str:
+    params = {"count": page_size or SCAN_PAGE_SIZE}
+    if cursor:
+        params["max_id"] = cursor
+    return f"{INSTAGRAM_BASE_URL}/api/v1/friendships/{user_id}/{kind}/?{urlencode(params)}"
+
+
+def parse_friendship_page(kind: str, data: dict, cursor: Optional[str]) -> FriendshipPage:
+    users = [
+        {field: u.get(field) for field in FRIENDSHIP_USER_FIELDS}
+        for u in data.get("users") or []
+    ]
+    next_cursor = data.get("next_max_id")
+    next_cursor = str(next_cursor) if next_cursor else None
+    if next_cursor == cursor:
+        next_cursor = None
+    return FriendshipPage(kind, users, cursor, next_cursor)
+
+
+def iter_friendship_pages(
+    sessionid: str,
+    user_id: str,
+    kind: str,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None,
+    delay: Optional[float] = None,
+) -> Iterator[FriendshipPage]:
+    """Walk one friendship list (``followers`` or ``following``) page by page.
+
+    Pass a saved ``next_cursor`` as ``cursor`` to resume an interrupted walk.
+    Raises PaginationError when a page fails.
+    """
+    if kind not in FRIENDSHIP_KINDS:
+        raise ValueError(f"unknown friendship kind: {kind}")
+    page_size = page_size or SCAN_PAGE_SIZE
+    delay = SCAN_PAGE_DELAY if delay is None else delay
+
+    first = True
+    while True:
+        if not first and delay > 0:
+            time.sleep(delay)
+        first = False
+
+        data = make_instagram_request(friendship_url(user_id, kind, cursor, page_size), sessionid)
+        if data is None:
+            raise PaginationError(kind, cursor)
+        page = parse_friendship_page(kind, data, cursor)
+        yield page
+
+        if page.next_cursor is None:
+            return
+        cursor = page.next_cursor
+
+
+def get_followers_following(
+    sessionid: str,
+    user_id: str,
+    cursors: Optional[Dict[str, Optional[str]]] = None,
+    kinds: Tuple[str, ...] = FRIENDSHIP_KINDS,
+    page_size: Optional[int] = None,
+    delay: Optional[float] = None,
+) -> Iterator[FriendshipPage]:
+    """Yield follower pages, then following pages, without building full lists.
+
+    ``cursors`` maps kind -> cursor to resume from; drop finished kinds from
+    ``kinds`` when resuming.
+    """
+    cursors = cursors or {}
+    for kind in kinds:
+        yield from iter_friendship_pages(
+            sessionid, user_id, kind,
+            cursor=cursors.get(kind), page_size=page_size, delay=delay
+        )
 
 # ---------------------------------------------------------
 # 🔧 HELPERS
@@ -121,78 +553,135 @@ def now_iso() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
 
-def ensure_data_dir() -> None:
-    d = os.path.dirname(DB_PATH)
-    if d and not os.path.exists(d):
-        os.makedirs(d, exist_ok=True)
-
-
 @contextmanager
 def db():
-    """Context manager for database connections"""
-    ensure_data_dir()
-    conn = sqlite3.connect(DB_PATH, timeout=10.0)
-    conn.row_factory = sqlite3.Row
+    """Context manager for database connections.
+
+    Inside an app/request context every call shares one pooled connection,
+    returned to the pool on teardown; elsewhere each block checks one out.
+    Uncommitted work is rolled back when the outermost block exits.
+    """
+    if not has_app_context():
+        with db_pool.connection() as conn:
+            yield conn
+        return
+
+    conn = g.get("_db_conn")
+    if conn is None:
+        conn = g._db_conn = db_pool.acquire()
+        g._db_depth = 0
+    g._db_depth += 1
     try:
         yield conn
+    except sqlite3.OperationalError as e:
+        if is_busy_error(e):
+            db_pool.record_busy()
+        raise
     finally:
-        conn.close()
+        g._db_depth -= 1
+        if g._db_depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+
+@app.teardown_appcontext
+def _release_db(exc):
+    conn = g.pop("_db_conn", None)
+    if conn is not None:
+        db_pool.release(conn)
 
 
 def init_db() -> None:
-    with db() as conn:
-        cur = conn.cursor()
-        
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT UNIQUE NOT NULL,
-            ig_user_id TEXT,
-            ig_username TEXT,
-            plan TEXT NOT NULL DEFAULT 'free',
-            credits INTEGER NOT NULL DEFAULT 0,
-            session_data TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        )
-        """)
-        
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS actions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            action TEXT NOT NULL,
-            target_id TEXT,
-            delta_credits INTEGER NOT NULL,
-            created_at TEXT NOT NULL
-        )
-        """)
-        
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS payment_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT NOT NULL,
-            plan TEXT NOT NULL,
-            txid TEXT NOT NULL UNIQUE,
-            status TEXT NOT NULL DEFAULT 'pending',
-            note TEXT,
-            created_at TEXT NOT NULL,
-            updated_at TEXT NOT NULL
-        )
-        """)
-        
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_session ON users(session_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_actions_session ON actions(session_id)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_requests_txid ON payment_requests(txid)")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_payment_requests_session ON payment_requests(session_id)")
-        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_requests_txid_unique ON payment_requests(txid)")
-        
-        conn.commit()
+    """Bring the schema up to date (see migrations.py)."""
+    version = migrations.upgrade(DB_PATH)
+    logger.info("DB: schema at version %s", version)
+
+
+def check_schema() -> None:
+    """Startup check: migrate, or just warn when auto-migration is off."""
+    if DB_AUTO_MIGRATE:
+        init_db()
+        return
+    todo = migrations.pending(DB_PATH)
+    if todo:
+        logger.warning("DB: %s pending migration(s), run `flask db upgrade`", len(todo))
+
+
+db_cli = AppGroup("db", help="Database schema management.")
+
+
+@db_cli.command("upgrade")
+@click.option("--to", "target", type=int, default=None, help="Target schema version.")
+def db_upgrade_command(target):
+    """Apply pending schema migrations."""
+    version = migrations.upgrade(DB_PATH, target)
+    click.echo(f"Schema at version {version}")
+
+
+@db_cli.command("status")
+def db_status_command():
+    """Show pending schema migrations."""
+    todo = migrations.pending(DB_PATH)
+    if not todo:
+        click.echo(f"Schema up to date (version {migrations.LATEST_VERSION})")
+    for version, name in todo:
+        click.echo(f"pending: {version} {name}")
+
+
+app.cli.add_command(db_cli)
+
+
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+@app.before_request
+def _start_request_timer():
+    g._started = time.perf_counter()
+    g._db_seconds = 0.0
+    rid = request.headers.get("X-Request-ID", "")
+    g.request_id = rid if _REQUEST_ID_RE.match(rid) else uuid.uuid4().hex[:16]
 
 
 @app.before_request
-def _db_bootstrap():
-    init_db()
+def _maybe_start_profiler():
+    forced = request.headers.get("X-Profile-Key")
+    if forced is None and not PROFILE_SAMPLE_RATE:
+        return
+    if forced is not None:
+        if not ADMIN_GRANT_KEY or not hmac.compare_digest(forced.encode(), ADMIN_GRANT_KEY.encode()):
+            return
+    elif not request_profiler.sampled():
+        return
+    g._profile = request_profiler.start()
+
+
+@app.teardown_request
+def _finish_profiler(exc):
+    prof = g.pop("_profile", None)
+    if prof is not None:
+        try:
+            request_profiler.finish(prof, request.endpoint or "unmatched")
+        except OSError as e:
+            logger.warning("Profiler: could not write dump: %s", e)
+
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.get("_started")
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - started, endpoint)
+        HTTP_DB_TIME.observe(g.get("_db_seconds", 0.0), endpoint)
+        HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        if LOG_REQUESTS and access_logger.isEnabledFor(logging.INFO):
+            access_logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+                "endpoint": endpoint,
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1e3, 2),
+                "db_ms": round(g.get("_db_seconds", 0.0) * 1e3, 2),
+            })
+    if g.get("request_id"):
+        response.headers["X-Request-ID"] = g.request_id
+    return response
 
 
 @app.after_request
@@ -203,12 +692,6 @@ def set_security_headers(response):
     return response
 
 
-def mask_sensitive(value: str, show: int = 8) -> str:
-    if not value or len(value) <= show:
-        return "***"
-    return f"{value[:show]}***"
-
-
 def validate_sessionid(sessionid: str) -> bool:
     if not sessionid or len(sessionid) < 5:
         return False
@@ -236,6 +719,22 @@ def validate_txid(txid: str) -> bool:
     return True
 
 
+def require_admin(f):
+    """Admin key from ``X-Admin-Key`` or ``Authorization: Bearer`` (Prometheus)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not ADMIN_GRANT_KEY:
+            return jsonify({"ok": False, "error": "admin_disabled"}), 403
+        key = request.headers.get("X-Admin-Key")
+        auth = request.headers.get("Authorization", "")
+        if key is None and auth.startswith("Bearer "):
+            key = auth[len("Bearer "):].strip()
+        if key is None or not hmac.compare_digest(key.encode(), ADMIN_GRANT_KEY.encode()):
+            return jsonify({"ok": False, "error": "forbidden"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
 def require_session(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -244,7 +743,7 @@ def require_session(f):
         if not validate_session_id(session_id):
             return jsonify({"success": False, "error": "Invalid session format"}), 401
         
-        user = get_user_by_session(session_id)
+        user = get_current_user(session_id)
         if not user:
             return jsonify({"success": False, "error": "Session not found"}), 401
         
@@ -255,74 +754,160 @@ def require_session(f):
 # ---------------------------------------------------------
 # 📊 DATABASE OPERATIONS
 # ---------------------------------------------------------
+# Credit ledger: raw actions are rolled up per day every
+# LEDGER_MAINTENANCE_INTERVAL seconds; raw rows older than
+# LEDGER_RETENTION_DAYS (0 keeps them) go to gzip NDJSON in LEDGER_ARCHIVE_DIR.
+LEDGER_ARCHIVE_DIR = os.environ.get("LEDGER_ARCHIVE_DIR", os.path.join(DB_DIR or ".", "archive"))
+LEDGER_RETENTION_DAYS = int(os.environ.get("LEDGER_RETENTION_DAYS", 90))
+LEDGER_MAINTENANCE_INTERVAL = float(os.environ.get("LEDGER_MAINTENANCE_INTERVAL", 300))
+
+ledger = ActionLedger(
+    db,
+    archive_dir=LEDGER_ARCHIVE_DIR,
+    retention_days=LEDGER_RETENTION_DAYS,
+    interval=LEDGER_MAINTENANCE_INTERVAL,
+)
+
+# App sessions (see sessions.py): tokens live SESSION_TTL seconds, sliding
+# while in use; expired ones are swept every SESSION_SWEEP_INTERVAL seconds.
+SESSION_TTL = float(os.environ.get("SESSION_TTL", 30 * 86400))
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 3600))
+
+sessions = SessionStore(db, ttl=SESSION_TTL, sweep_interval=SESSION_SWEEP_INTERVAL)
+
+# Server-Sent Events: every open stream holds a server thread, so streams
+# are capped per worker (keep SSE_MAX_CONNECTIONS below gunicorn --threads)
+# and closed after SSE_MAX_DURATION seconds; EventSource then reconnects.
+SSE_MAX_CONNECTIONS = int(os.environ.get("SSE_MAX_CONNECTIONS", 2))
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", 15))
+SSE_MAX_DURATION = float(os.environ.get("SSE_MAX_DURATION", 120))
+SSE_POLL_INTERVAL = float(os.environ.get("SSE_POLL_INTERVAL", 0.5))
+# EventSource cannot send headers, so login also sets the session token as an
+# HttpOnly cookie sent only to /api/events (a query string would end up in
+# access logs). SSE_COOKIE_SECURE=0 allows it over plain HTTP.
+SSE_COOKIE = "sse_session"
+SSE_COOKIE_SECURE = os.environ.get("SSE_COOKIE_SECURE", "1") != "0"
+
+# Channels are per user (str(users.id)); two streams each, so a second
+# device does not keep kicking the first one off.
+event_bus = EventBus(DB_PATH, poll_interval=SSE_POLL_INTERVAL, max_subscribers=SSE_MAX_CONNECTIONS,
+                     max_per_channel=2)
+
+
 def get_user_by_session(session_id: str) -> Optional[sqlite3.Row]:
+    """``users`` row plus ``expires_at`` for a live session token."""
+    return sessions.lookup(session_id)
+
+
+def get_current_user(session_id: str) -> Optional[Dict[str, Any]]:
+    """Authenticated user for this request, loaded at most once.
+
+    Lookup order: ``g.user`` (same request), ``session_cache`` and
+    ``user_cache``, then one sessions/users join in SQLite. The returned
+    dict carries the token as ``session_id``.
+    """
+    if has_app_context():
+        user = g.get("user")
+        if user is not None and user["session_id"] == session_id:
+            return user
+
+    user = _session_user(session_id)
+    if user is not None and has_app_context():
+        g.user = user
+    return user
+
+
+def _session_user(session_id: str) -> Optional[Dict[str, Any]]:
+    entry = session_cache.get(session_id)
+    user = user_cache.get(entry[0]) if entry is not None and entry[1] > time.time() else None
+    if user is None:
+        row = get_user_by_session(session_id)
+        if row is None:
+            return None
+        user = dict(row)
+        session_cache.set(session_id, (user["id"], user.pop("expires_at")))
+        user_cache.set(user["id"], user)
+    return dict(user, session_id=session_id)
+
+
+def publish_user(user_id: int) -> None:
+    """Push the user's current plan and credits to their event streams."""
     with db() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM users WHERE session_id = ?", (session_id,))
-        return cur.fetchone()
+        row = conn.execute("SELECT plan, credits FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row is not None:
+        event_bus.publish(str(user_id), "me", {"plan": row["plan"], "credits": int(row["credits"])})
+
 
+def invalidate_user(user_id: int) -> None:
+    user_cache.invalidate(user_id)
+    if has_app_context():
+        user = g.get("user")
+        if user is not None and user["id"] == user_id:
+            g.pop("user")
 
-def save_session_data(session_id: str, session_data: Dict[str, Any]) -> None:
+
+def save_session_data(user_id: int, session_data: Dict[str, Any]) -> None:
     with db() as conn:
         cur = conn.cursor()
         cur.execute("""
-            UPDATE users
-            SET session_data = ?, updated_at = ?
-            WHERE session_id = ?
-        """, (json.dumps(session_data), now_iso(), session_id))
+            INSERT INTO user_session_data(user_id, session_data, updated_at) VALUES(?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                session_data = excluded.session_data, updated_at = excluded.updated_at
+        """, (user_id, json.dumps(session_data), now_iso()))
         conn.commit()
 
 
-def load_session_data(session_id: str) -> Optional[Dict[str, Any]]:
-    user = get_user_by_session(session_id)
-    if not user or not user["session_data"]:
-        return None
+def load_session_data(user_id: int) -> Optional[Dict[str, Any]]:
+    """Instagram cookies saved at login; kept apart from the hot users row."""
+    with db() as conn:
+        row = conn.execute("SELECT session_data FROM user_session_data WHERE user_id = ?",
+                           (user_id,)).fetchone()
     try:
-        return json.loads(user["session_data"])
+        return json.loads(row[0]) if row else None
     except (json.JSONDecodeError, TypeError):
         return None
 
 
 def upsert_user_on_login(
-    session_id: str,
     ig_user_id: str,
     ig_username: str,
     session_data: Dict[str, Any]
-) -> None:
+) -> Tuple[int, str]:
+    """Create or update the account's users row and open a session.
+
+    Returns ``(user_id, session token)``. A first login gets FREE_CREDITS;
+    later logins keep the balance and only refresh username and cookies.
+    """
     with db() as conn:
         cur = conn.cursor()
         ts = now_iso()
+        cur.execute("BEGIN IMMEDIATE")
 
-        cur.execute("SELECT * FROM users WHERE session_id = ?", (session_id,))
-        row = cur.fetchone()
-
-        if row is None:
-            cur.execute("""
-                INSERT INTO users(
-                    session_id, ig_user_id, ig_username, plan, credits,
-                    session_data, created_at, updated_at
-                )
-                VALUES(?,?,?,?,?,?,?,?)
-            """, (
-                session_id, str(ig_user_id), ig_username, "free",
-                FREE_CREDITS, json.dumps(session_data), ts, ts
-            ))
-            logger.info(f"DB: created user @{ig_username} with {FREE_CREDITS} free credits")
-        else:
-            cur.execute("""
-                UPDATE users
-                SET ig_user_id=?, ig_username=?, session_data=?, updated_at=?
-                WHERE session_id=?
-            """, (
-                str(ig_user_id), ig_username,
-                json.dumps(session_data), ts, session_id
-            ))
-            logger.info(f"DB: updated user @{ig_username}")
+        cur.execute("""
+            INSERT INTO users(ig_user_id, ig_username, plan, credits, created_at, updated_at)
+            VALUES(?,?,?,?,?,?)
+            ON CONFLICT(ig_user_id) DO UPDATE SET
+                ig_username = excluded.ig_username, updated_at = excluded.updated_at
+            RETURNING id, created_at
+        """, (str(ig_user_id), ig_username, "free", FREE_CREDITS, ts, ts))
+        user_id, created_at = cur.fetchone()
+        cur.execute("""
+            INSERT INTO user_session_data(user_id, session_data, updated_at) VALUES(?,?,?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                session_data = excluded.session_data, updated_at = excluded.updated_at
+        """, (user_id, json.dumps(session_data), ts))
+        token = sessions.create(cur, user_id)
 
         conn.commit()
+    if created_at == ts:
+        logger.info("DB: created user @%s with %s free credits", ig_username, FREE_CREDITS)
+    else:
+        logger.info("DB: updated user @%s", ig_username)
+    invalidate_user(user_id)
+    return user_id, token
 
 
-def can_unfollow(user_row: Optional[sqlite3.Row]) -> Tuple[bool, Optional[str]]:
+def can_unfollow(user_row: Optional[Dict[str, Any]]) -> Tuple[bool, Optional[str]]:
     if user_row is None:
         return False, "no_user"
     if user_row["plan"] == "lifetime":
@@ -332,7 +917,13 @@ def can_unfollow(user_row: Optional[sqlite3.Row]) -> Tuple[bool, Optional[str]]:
     return True, None
 
 
-def spend_credit(session_id: str, target_id: str, delta: int) -> bool:
+def unfollow_user(sessionid: str, target_id: str) -> bool:
+    url = f"{INSTAGRAM_BASE_URL}/api/v1/friendships/destroy/{target_id}/"
+    data = make_instagram_request(url, sessionid, method="POST", data={"user_id": str(target_id)})
+    return bool(data) and data.get("status") == "ok"
+
+
+def spend_credit(user_id: int, target_id: str, delta: int) -> bool:
     with db() as conn:
         cur = conn.cursor()
         ts = now_iso()
@@ -340,30 +931,657 @@ def spend_credit(session_id: str, target_id: str, delta: int) -> bool:
         cur.execute("""
             UPDATE users
             SET credits = credits + ?, updated_at = ?
-            WHERE session_id = ?
+            WHERE id = ?
               AND plan != 'lifetime'
               AND credits + ? >= 0
-        """, (int(delta), ts, session_id, int(delta)))
+            RETURNING id
+        """, (int(delta), ts, user_id, int(delta)))
+        user = cur.fetchone()
+        spent = -int(delta) if user and delta < 0 else 0
         
-        if cur.rowcount == 0:
-            cur.execute("SELECT plan, credits FROM users WHERE session_id = ?", (session_id,))
+        if user is None:
+            cur.execute("SELECT id, plan, credits FROM users WHERE id = ?", (user_id,))
             user = cur.fetchone()
             if user and user["plan"] != "lifetime" and int(user["credits"]) + delta < 0:
-                logger.warning(f"Insufficient credits for session {mask_sensitive(session_id)}")
+                logger.warning("Insufficient credits", extra={"user_id": user_id})
                 return False
         
-        cur.execute("""
-            INSERT INTO actions(session_id, action, target_id, delta_credits, created_at)
-            VALUES(?,?,?,?,?)
-        """, (session_id, "unfollow", str(target_id), int(delta), ts))
+        if user is not None:
+            ledger.record(cur, user_id, "unfollow", [target_id], delta)
         
         conn.commit()
-        return True
+    invalidate_user(user_id)
+    publish_user(user_id)
+    if spent:
+        CREDITS_SPENT.inc(amount=spent)
+    return True
+
+
+def spend_credits_bulk(user_id: int, target_ids: List[str]) -> List[str]:
+    """Reserve one credit per target in a single transaction.
+
+    Returns the targets that got a credit (all of them on the lifetime plan,
+    otherwise as many as the balance covers) and writes their ``actions``
+    rows. BEGIN IMMEDIATE serialises concurrent batches for the same user,
+    so the balance never goes negative.
+    """
+    if not target_ids:
+        return []
+    with db() as conn:
+        cur = conn.cursor()
+        ts = now_iso()
+        cur.execute("BEGIN IMMEDIATE")
+
+        cur.execute("SELECT plan, credits FROM users WHERE id = ?", (user_id,))
+        user = cur.fetchone()
+        if user is None:
+            conn.rollback()
+            return []
+
+        if user["plan"] == "lifetime":
+            reserved = list(target_ids)
+        else:
+            reserved = list(target_ids[:max(0, int(user["credits"]))])
+            if reserved:
+                cur.execute("""
+                    UPDATE users
+                    SET credits = credits - ?, updated_at = ?
+                    WHERE id = ?
+                """, (len(reserved), ts, user_id))
+
+        ledger.record(cur, user_id, "unfollow", reserved, -1)
+        conn.commit()
+
+    invalidate_user(user_id)
+    publish_user(user_id)
+    if reserved and user["plan"] != "lifetime":
+        CREDITS_SPENT.inc(amount=len(reserved))
+    if len(reserved) < len(target_ids):
+        logger.warning("Insufficient credits: reserved %s of %s", len(reserved), len(target_ids),
+                       extra={"user_id": user_id})
+    return reserved
+
+
+def refund_credits_bulk(user_id: int, target_ids: List[str]) -> None:
+    """Give back credits reserved by spend_credits_bulk for failed targets."""
+    if not target_ids:
+        return
+    with db() as conn:
+        cur = conn.cursor()
+        ts = now_iso()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            UPDATE users
+            SET credits = credits + ?, updated_at = ?
+            WHERE id = ? AND plan != 'lifetime'
+        """, (len(target_ids), ts, user_id))
+        refunded = len(target_ids) if cur.rowcount else 0
+        ledger.record(cur, user_id, "refund", target_ids, 1)
+        conn.commit()
+    invalidate_user(user_id)
+    publish_user(user_id)
+    if refunded:
+        CREDITS_REFUNDED.inc(amount=refunded)
 
 
 # ---------------------------------------------------------
-# 🖥️ HTML (unchanged)
+# 📸 FOLLOW SNAPSHOTS
 # ---------------------------------------------------------
+# Newest IDs remembered per list; the next scan stops paging when it reaches one.
+SNAPSHOT_HEAD_SIZE = 50
+SNAPSHOTS_KEPT = int(os.environ.get("SNAPSHOTS_KEPT", 3))
+
+
+class Snapshot(NamedTuple):
+    id: int
+    scanned_at: str
+    followers: array
+    following: array
+    heads: Dict[str, array]
+    following_meta: Dict[int, UserRecord]
+    unfollowers: array
+
+
+def _pack_meta(records) -> bytes:
+    rows = [
+        [r.pk, r.username, r.full_name, r.is_private, r.is_verified, r.profile_pic_url]
+        for r in records
+    ]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode())
+
+
+def _unpack_meta(blob: bytes) -> Dict[int, UserRecord]:
+    if not blob:
+        return {}
+    return {row[0]: UserRecord(*row) for row in json.loads(zlib.decompress(blob))}
+
+
+def load_latest_snapshot(ig_user_id: str) -> Optional[Snapshot]:
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT * FROM follow_snapshots
+            WHERE ig_user_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+        """, (str(ig_user_id),))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return Snapshot(
+        id=row["id"],
+        scanned_at=row["scanned_at"],
+        followers=unpack_ids(row["followers"]),
+        following=unpack_ids(row["following"]),
+        heads={
+            "followers": unpack_ids(row["followers_head"]),
+            "following": unpack_ids(row["following_head"]),
+        },
+        following_meta=_unpack_meta(row["following_meta"]),
+        unfollowers=unpack_ids(row["unfollowers"]),
+    )
+
+
+def save_snapshot(
+    ig_user_id: str,
+    diff: NonFollowerDiff,
+    heads: Dict[str, array],
+    prev: Optional[Snapshot]
+) -> array:
+    """Store a finished scan; returns followers lost since ``prev``."""
+    unfollowers = difference(prev.followers, diff.followers) if prev else array("q")
+    meta = _pack_meta(diff.records[pk] for pk in diff.following if pk in diff.records)
+
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO follow_snapshots(
+                ig_user_id, scanned_at, follower_count, following_count,
+                followers, following, followers_head, following_head,
+                following_meta, unfollowers
+            )
+            VALUES(?,?,?,?,?,?,?,?,?,?)
+        """, (
+            str(ig_user_id), now_iso(), len(diff.followers), len(diff.following),
+            pack_ids(diff.followers), pack_ids(diff.following),
+            pack_ids(heads["followers"]), pack_ids(heads["following"]),
+            meta, pack_ids(unfollowers)
+        ))
+        cur.execute("""
+            DELETE FROM follow_snapshots
+            WHERE ig_user_id = ?
+              AND id NOT IN (
+                SELECT id FROM follow_snapshots
+                WHERE ig_user_id = ?
+                ORDER BY id DESC
+                LIMIT ?
+              )
+        """, (str(ig_user_id), str(ig_user_id), SNAPSHOTS_KEPT))
+        conn.commit()
+    return unfollowers
+
+
+def diff_from_snapshot(snap: Snapshot) -> NonFollowerDiff:
+    diff = NonFollowerDiff()
+    diff.add_follower_ids(snap.followers)
+    diff.seal_followers()
+    diff.add_following(r.to_dict() for r in snap.following_meta.values())
+    return diff.finish()
+
+
+def discard_from_snapshot(ig_user_id: str, pk: int) -> bool:
+    """Remove an unfollowed account from the latest snapshot's following list.
+
+    Keeps results rebuilt from the snapshot (another worker, an expired
+    cache) from listing it again, and keeps the next incremental scan's
+    merge in step with the profile's following count.
+    """
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            SELECT id, following, following_meta FROM follow_snapshots
+            WHERE ig_user_id = ? ORDER BY id DESC LIMIT 1
+        """, (str(ig_user_id),))
+        row = cur.fetchone()
+        following = unpack_ids(row["following"]) if row else array("q")
+        if not remove(following, int(pk)):
+            conn.rollback()
+            return False
+        meta = _unpack_meta(row["following_meta"])
+        meta.pop(int(pk), None)
+        cur.execute("""
+            UPDATE follow_snapshots SET following = ?, following_count = ?, following_meta = ?
+            WHERE id = ?
+        """, (pack_ids(following), len(following), _pack_meta(meta.values()), row["id"]))
+        conn.commit()
+    return True
+
+
+class ScanState:
+    """Resumable progress of the friendship walks; a scan job checkpoints this."""
+
+    def __init__(self):
+        self.cursors: Dict[str, Optional[str]] = {kind: None for kind in FRIENDSHIP_KINDS}
+        self.done: List[str] = []  # lists walked to the end (or to the previous head)
+        self.pages = 0
+        # Previous head seen, but the merge did not add up: walk to the end.
+        self.full_walk = {kind: False for kind in FRIENDSHIP_KINDS}
+        self.followers = array("q")
+        self.following: List[Dict[str, Any]] = []
+        self.heads = {kind: array("q") for kind in FRIENDSHIP_KINDS}
+        self.incremental: Dict[str, bool] = {}
+
+    @property
+    def kind(self) -> str:
+        """Lists still being walked, "done" when finished."""
+        return "+".join(k for k in FRIENDSHIP_KINDS if k not in self.done) or "done"
+
+    @property
+    def items(self) -> int:
+        return len(self.followers) + len(self.following)
+
+    def fresh_ids(self, kind: str) -> array:
+        if kind == "followers":
+            return self.followers
+        return array("q", (int(u["pk"]) for u in self.following))
+
+    def take(self, kind: str, users: List[Dict[str, Any]]) -> None:
+        head = self.heads[kind]
+        for u in users[:max(0, SNAPSHOT_HEAD_SIZE - len(head))]:
+            head.append(int(u["pk"]))
+        if kind == "followers":
+            self.followers.extend(int(u["pk"]) for u in users)
+        else:
+            self.following.extend(users)
+
+    def finish(self, kind: str) -> None:
+        self.incremental.setdefault(kind, False)
+        self.cursors[kind] = None
+        if kind not in self.done:
+            self.done.append(kind)
+
+    def dump(self) -> Dict[str, Any]:
+        return {
+            "cursors": self.cursors,
+            "done": self.done,
+            "pages": self.pages,
+            "full_walk": self.full_walk,
+            "followers": base64.b64encode(pack_ids(self.followers)).decode(),
+            "following": self.following,
+            "heads": {k: list(v) for k, v in self.heads.items()},
+            "incremental": self.incremental,
+        }
+
+    @classmethod
+    def load(cls, data: Dict[str, Any]) -> "ScanState":
+        state = cls()
+        if "kind" in data:
+            # Checkpoint from a sequential walk: lists before "kind" are finished.
+            kind = data["kind"]
+            state.done = list(FRIENDSHIP_KINDS[:FRIENDSHIP_KINDS.index(kind)]) if kind != "done" \
+                else list(FRIENDSHIP_KINDS)
+            if kind in state.cursors:
+                state.cursors[kind] = data.get("cursor")
+                state.full_walk[kind] = bool(data.get("full_walk"))
+        else:
+            state.cursors.update(data.get("cursors") or {})
+            state.done = list(data.get("done") or [])
+            state.full_walk.update(data.get("full_walk") or {})
+        state.pages = int(data.get("pages", 0))
+        state.followers = unpack_ids(base64.b64decode(data.get("followers", "")))
+        state.following = list(data.get("following", []))
+        for kind, ids in (data.get("heads") or {}).items():
+            state.heads[kind] = array("q", ids)
+        state.incremental = dict(data.get("incremental") or {})
+        return state
+
+
+def _fold_page(
+    state: ScanState,
+    page: FriendshipPage,
+    prev: Optional[Snapshot],
+    counts: Optional[Dict[str, int]]
+) -> bool:
+    """Fold one page into ``state``; returns True when its list can stop early."""
+    kind = page.kind
+    state.pages += 1
+    cut = None
+    if prev is not None and counts and not state.full_walk[kind]:
+        known = set(prev.heads[kind])
+        cut = next((i for i, u in enumerate(page.users) if int(u["pk"]) in known), None)
+    if cut is None:
+        state.take(kind, page.users)
+    else:
+        state.take(kind, page.users[:cut])
+        old = prev.followers if kind == "followers" else prev.following
+        if len(sorted_ids(chain(state.fresh_ids(kind), old))) == counts[kind]:
+            state.incremental[kind] = True
+            return True
+        state.full_walk[kind] = True
+        state.take(kind, page.users[cut:])
+    state.cursors[kind] = page.next_cursor
+    return False
+
+
+def _walk_sequential(sessionid, ig_user_id, state, prev, counts, on_page) -> None:
+    for kind in FRIENDSHIP_KINDS:
+        if kind in state.done:
+            continue
+        for page in iter_friendship_pages(sessionid, ig_user_id, kind, cursor=state.cursors[kind]):
+            if _fold_page(state, page, prev, counts):
+                break
+            if on_page:
+                on_page(state)
+        state.finish(kind)
+        if on_page:
+            on_page(state)
+
+
+def _walk_concurrent(sessionid, ig_user_id, state, prev, counts, on_page) -> None:
+    """Both lists at once on the async engine.
+
+    Pages are folded in on the event loop thread, so ``state`` and
+    ``on_page`` never run concurrently with each other.
+    """
+    async def walk(kind: str, sem: asyncio.Semaphore) -> None:
+        pages = fetch_engine.paginate(
+            str(ig_user_id), sem, sessionid,
+            make_url=lambda cursor: friendship_url(ig_user_id, kind, cursor),
+            next_cursor=lambda data: data.get("next_max_id"),
+            cursor=state.cursors[kind],
+            delay=SCAN_PAGE_DELAY,
+        )
+        async with aclosing(pages):
+            async for cursor, data in pages:
+                if data is None:
+                    raise PaginationError(kind, cursor)
+                if _fold_page(state, parse_friendship_page(kind, data, cursor), prev, counts):
+                    break
+                if on_page:
+                    on_page(state)
+        state.finish(kind)
+        if on_page:
+            on_page(state)
+
+    async def walk_all() -> None:
+        sem = fetch_engine.account_semaphore()
+        await asyncio.gather(*(walk(kind, sem) for kind in FRIENDSHIP_KINDS if kind not in state.done))
+
+    fetch_engine.run_sync(walk_all())
+
+
+def collect_friendships(
+    sessionid: str,
+    ig_user_id: str,
+    prev: Optional[Snapshot],
+    counts: Optional[Dict[str, int]],
+    state: Optional[ScanState] = None,
+    on_page=None,
+    concurrent: Optional[bool] = None
+) -> Tuple[NonFollowerDiff, Dict[str, array], Dict[str, Any]]:
+    """Walk both friendship lists, reusing ``prev`` where it is still valid.
+
+    Instagram lists newest first, so each walk stops at the first ID from the
+    previous snapshot's head and merges the stored list below it. The merge
+    is only trusted if its size matches the profile's count; otherwise
+    (somebody left from the middle of the list) the walk simply continues to
+    the end. Without a snapshot or counts this is a plain full walk.
+
+    The two lists are walked concurrently unless ``concurrent`` (default
+    SCAN_CONCURRENT) is false. Pass a ``state`` restored from a checkpoint
+    to resume; ``on_page(state)`` is called after every page and whenever a
+    list is finished.
+    """
+    state = state or ScanState()
+    concurrent = SCAN_CONCURRENT if concurrent is None else concurrent
+    walk = _walk_concurrent if concurrent else _walk_sequential
+    walk(sessionid, ig_user_id, state, prev, counts, on_page)
+
+    diff = NonFollowerDiff()
+    diff.add_follower_ids(state.followers)
+    if state.incremental.get("followers"):
+        diff.add_follower_ids(prev.followers)
+    diff.seal_followers()
+    diff.add_following(state.following)
+    if state.incremental.get("following"):
+        diff.add_following(r.to_dict() for r in prev.following_meta.values())
+
+    heads = {}
+    for kind in FRIENDSHIP_KINDS:
+        head = state.heads[kind]
+        if state.incremental.get(kind):
+            seen = set(head)
+            head.extend(pk for pk in prev.heads[kind] if pk not in seen)
+            del head[SNAPSHOT_HEAD_SIZE:]
+        heads[kind] = head
+
+    return diff.finish(), heads, {"pages": state.pages, "incremental": state.incremental}
+
+
+# ---------------------------------------------------------
+# ⚙️ BACKGROUND JOBS
+# ---------------------------------------------------------
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Finished jobs are deleted after JOB_RETENTION_DAYS (0 = keep), checked every JOB_PRUNE_INTERVAL s.
+JOB_RETENTION_DAYS = float(os.environ.get("JOB_RETENTION_DAYS", 7))
+JOB_PRUNE_INTERVAL = float(os.environ.get("JOB_PRUNE_INTERVAL", 3600))
+# A scan job writes its full checkpoint every this many pages (progress every page).
+SCAN_CHECKPOINT_PAGES = int(os.environ.get("SCAN_CHECKPOINT_PAGES", 10))
+UNFOLLOW_DELAY = float(os.environ.get("UNFOLLOW_DELAY", 2.0))
+UNFOLLOW_BATCH_MAX = 500
+# Unfollow jobs run one target at a time through a fair scheduler (see
+# scheduler.py): each Instagram account is paced to one unfollow per
+# UNFOLLOW_DELAY (bursts of UNFOLLOW_BURST) and accounts take turns weighted
+# by plan. UNFOLLOW_CONCURRENCY unfollows run at once per process (0 = this
+# process runs none); a failure pauses the account for UNFOLLOW_BACKOFF
+# seconds, doubling up to UNFOLLOW_MAX_BACKOFF.
+UNFOLLOW_BURST = float(os.environ.get("UNFOLLOW_BURST", 1))
+UNFOLLOW_CONCURRENCY = int(os.environ.get("UNFOLLOW_CONCURRENCY", 4))
+UNFOLLOW_MAX_JOBS = int(os.environ.get("UNFOLLOW_MAX_JOBS", 200))
+UNFOLLOW_BACKOFF = float(os.environ.get("UNFOLLOW_BACKOFF", 30))
+UNFOLLOW_MAX_BACKOFF = float(os.environ.get("UNFOLLOW_MAX_BACKOFF", 900))
+UNFOLLOW_WEIGHTS = {
+    "free": float(os.environ.get("UNFOLLOW_WEIGHT_FREE", 1)),
+    "starter": float(os.environ.get("UNFOLLOW_WEIGHT_STARTER", 2)),
+    "lifetime": float(os.environ.get("UNFOLLOW_WEIGHT_LIFETIME", 4)),
+}
+
+def _publish_job(job: Dict[str, Any]) -> None:
+    user_id = job.pop("user_id")
+    if user_id is not None:
+        event_bus.publish(str(user_id), "job", {"ok": True, **job})
+
+
+job_queue = JobQueue(
+    db,
+    workers=JOB_WORKERS,
+    on_change=_publish_job,
+    keep_seconds=JOB_RETENTION_DAYS * 86400,
+    prune_interval=JOB_PRUNE_INTERVAL,
+)
+
+
+def _job_instagram_user(job: Job) -> Tuple[Dict[str, Any], str]:
+    """The job owner's ``users`` row and Instagram cookie (not the session:
+    the job keeps running after a logout or expiry)."""
+    with db() as conn:
+        row = conn.execute("SELECT * FROM users WHERE id = ?", (job.user_id,)).fetchone() \
+            if job.user_id is not None else None
+    if row is None:
+        raise JobFailed("user_not_found")
+    sessionid = (load_session_data(row["id"]) or {}).get("sessionid")
+    if not sessionid or not row["ig_user_id"]:
+        raise JobFailed("instagram_session_missing")
+    return dict(row), sessionid
+
+
+@job_queue.handler("scan")
+def run_scan_job(job: Job) -> Dict[str, Any]:
+    user, sessionid = _job_instagram_user(job)
+    prev = load_latest_snapshot(user["ig_user_id"])
+    counts = get_friendship_counts(sessionid, user["ig_username"]) if prev else None
+    state = ScanState.load(job.checkpoint) if job.checkpoint else ScanState()
+
+    finished = len(state.done)
+
+    def on_page(st: ScanState) -> None:
+        nonlocal finished
+        progress = {"pages": st.pages, "items": st.items, "list": st.kind}
+        if len(st.done) != finished or st.pages % SCAN_CHECKPOINT_PAGES == 0:
+            finished = len(st.done)
+            job.save(st.dump(), **progress)
+        else:
+            job.save(**progress)
+
+    diff, heads, stats = collect_friendships(
+        sessionid, user["ig_user_id"], prev, counts, state=state, on_page=on_page
+    )
+    unfollowers = save_snapshot(user["ig_user_id"], diff, heads, prev)
+    scan_results.set(user["id"], diff)
+    logger.info(
+        "Scan @%s: %s followers, %s not following back, %s pages, incremental=%s",
+        user["ig_username"], len(diff.followers), len(diff), stats["pages"], stats["incremental"]
+    )
+    return {
+        "count": len(diff),
+        "followers": len(diff.followers),
+        "following": len(diff.following),
+        "pages": stats["pages"],
+        "incremental": stats["incremental"],
+        "new_unfollowers": len(unfollowers),
+    }
+
+
+def _open_unfollow_job(job: Job) -> Tuple[int, str, List[str], Tuple[int, str, str]]:
+    """Targets whose credits were reserved when the job was queued."""
+    user, sessionid = _job_instagram_user(job)
+    targets = [str(t) for t in job.payload.get("targets", [])]
+    return user["id"], user["plan"], targets, (user["id"], sessionid, user["ig_user_id"])
+
+
+def _unfollow_target(ctx: Tuple[int, str, str], target: str) -> bool:
+    user_id, sessionid, ig_user_id = ctx
+    if not unfollow_user(sessionid, target):
+        return False
+    diff = scan_results.get(user_id)
+    if diff is not None:
+        diff.discard(int(target))
+    try:
+        discard_from_snapshot(ig_user_id, int(target))
+    except sqlite3.Error as e:  # the unfollow itself went through
+        logger.warning("Could not update the snapshot after unfollowing %s: %s", target, e)
+    return True
+
+
+def _close_unfollow_job(job: Job, ctx: Tuple[int, str, str], done: List[str], failed: List[str]) -> Dict[str, Any]:
+    return {"unfollowed": done, "failed": failed, "refunded": len(failed)}
+
+
+def _release_unfollow_job(job: Job) -> None:
+    """Refund every reserved target that was not unfollowed, in one transaction.
+
+    Runs once the job is done (its failed targets) or has failed for good
+    (those plus every target it never reached).
+    """
+    targets = [str(t) for t in job.payload.get("targets", [])]
+    refund = [str(t) for t in job.checkpoint.get("failed", [])] + targets[int(job.checkpoint.get("next", 0)):]
+    if not refund:
+        return
+    if job.user_id is None:
+        logger.error("Job %s: no user to refund %s credits to", job.id, len(refund))
+        return
+    refund_credits_bulk(job.user_id, refund)
+
+
+unfollow_scheduler = FairScheduler(
+    rate=1 / UNFOLLOW_DELAY if UNFOLLOW_DELAY > 0 else 0,
+    burst=UNFOLLOW_BURST,
+    weights=UNFOLLOW_WEIGHTS,
+    backoff=UNFOLLOW_BACKOFF,
+    max_backoff=UNFOLLOW_MAX_BACKOFF,
+)
+unfollow_dispatcher = Dispatcher(
+    job_queue, unfollow_scheduler, "unfollow",
+    _open_unfollow_job, _unfollow_target, _close_unfollow_job, _release_unfollow_job,
+    concurrency=UNFOLLOW_CONCURRENCY,
+    max_jobs=UNFOLLOW_MAX_JOBS,
+)
+metrics_registry.register(
+    "unfollow_schedule_wait_seconds", "Time an account was ready (paced and idle) before its next unfollow started.",
+    ("plan",), unfollow_scheduler.wait)
+metrics_registry.register(
+    "unfollow_queue_items_total", "Scheduled unfollows by plan and event; queued - dispatched - dropped = depth.",
+    ("plan", "event"), unfollow_scheduler.items)
+
+
+def start_background() -> None:
+    """Start per-process background threads; call after the worker has forked."""
+    log_pipeline.ensure_started()
+    job_queue.start()
+    unfollow_dispatcher.start()
+    ledger.start()
+    sessions.start()
+    if payment_verifier is not None:
+        payment_verifier.start()
+    metrics_collector.start()
+    atexit.register(metrics_collector.stop)
+
+
+jobs_cli = AppGroup("jobs", help="Background job queue.")
+
+
+@jobs_cli.command("work")
+def jobs_work_command():
+    """Run job workers in the foreground (a standalone worker process)."""
+    create_app()
+    job_queue.start()
+    unfollow_dispatcher.start()
+    click.echo(f"Job workers running ({job_queue.workers}, {unfollow_dispatcher.concurrency} unfollow slots), "
+               "Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        unfollow_dispatcher.stop()
+        job_queue.stop()
+
+
+app.cli.add_command(jobs_cli)
+
+
+ledger_cli = AppGroup("ledger", help="Credit ledger rollups and archival.")
+
+
+@ledger_cli.command("rollup")
+def ledger_rollup_command():
+    """Fold new actions into the daily rollups."""
+    click.echo(f"Rolled up {ledger.rollup()} action(s)")
+
+
+@ledger_cli.command("archive")
+@click.option("--days", type=int, default=None, help="Override LEDGER_RETENTION_DAYS.")
+def ledger_archive_command(days):
+    """Roll up, then export and delete raw actions older than the retention."""
+    if days is not None:
+        ledger.retention_days = max(0, days)
+    ledger.rollup()
+    n = ledger.archive()
+    click.echo(f"Archived {n} action(s) to {ledger.archive_dir}")
+
+
+app.cli.add_command(ledger_cli)
+
+
+# ---------------------------------------------------------
+# 🖥️ HTML
+# ---------------------------------------------------------
+# CSS/JS live in static/ and are served fingerprinted; the page shell is
+# rendered once at import and only the CSRF token is filled in per request.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+static_assets = AssetManifest(STATIC_DIR)
+_CSRF_SLOT = "\x00csrf\x00"
+
 HTML = r"""
 <!DOCTYPE html>
 <html lang="en">
@@ -371,60 +1589,9 @@ HTML = r"""
 <meta charset="utf-8" />
 <meta name="viewport" content="width=device-width, initial-scale=1" />
 <meta name="csrf-token" content="{{ csrf_token() }}">
+<meta name="pay-address" content="{{ pay_addr }}">
 <title>Unfollow Ninja</title>
-<style>
-:root { --bg:#000; --card:#111; --text:#fff; --accent:#ff0080; --muted:#888; --line:#222; }
-body{font-family:-apple-system,BlinkMacSystemFont,"Segoe UI",Roboto,Helvetica,sans-serif;background:var(--bg);color:var(--text);margin:0;padding:20px;min-height:100vh;display:flex;align-items:center;justify-content:center}
-.container{width:100%;max-width:720px;background:var(--card);padding:34px 26px;border-radius:24px;box-shadow:0 10px 40px rgba(255,0,128,.10);border:1px solid var(--line);text-align:center}
-h1{margin:0 0 6px;font-size:32px;letter-spacing:-1px;background:linear-gradient(to right,#fff,#888);-webkit-background-clip:text;-webkit-text-fill-color:transparent}
-.subtitle{color:var(--muted);margin-bottom:18px;font-size:14px;line-height:1.4}
-.badge{display:flex;gap:10px;justify-content:center;flex-wrap:wrap;margin:10px 0 12px}
-.pill{background:#0b0b0b;border:1px solid #262626;color:#bdbdbd;font-size:12px;padding:7px 10px;border-radius:999px}
-
-input, textarea{width:100%;padding:16px;margin-bottom:12px;background:#1a1a1a;border:1px solid #333;border-radius:12px;color:#fff;font-size:15px;outline:none;box-sizing:border-box;transition:.2s}
-textarea{min-height:78px;resize:vertical;font-family:ui-monospace,Menlo,monospace}
-input:focus, textarea:focus{border-color:var(--accent);box-shadow:0 0 0 2px rgba(255,0,128,.2)}
-
-button.action-btn{width:100%;padding:16px;background:#fff;color:#000;border:none;border-radius:12px;font-size:15px;font-weight:900;cursor:pointer;transition:.2s;text-transform:uppercase;letter-spacing:1px}
-button.action-btn:hover{transform:scale(1.01);background:#f0f0f0}
-button.action-btn:disabled{opacity:.55;cursor:wait;transform:none}
-button.secondary{background:rgba(255,255,255,.08);color:#fff;border:1px solid rgba(255,255,255,.12);text-transform:none;letter-spacing:0;font-weight:800}
-button.secondary:hover{background:rgba(255,255,255,.10)}
-
-hr{border:0;border-top:1px solid #1f1f1f;margin:16px 0}
-.row{display:flex;gap:10px}
-.row > *{flex:1}
-
-#results{margin-top:14px;text-align:left}
-.user-row{display:flex;align-items:center;justify-content:space-between;gap:12px;padding:12px 12px;border-radius:14px;border:1px solid #222;background:#0b0b0b;margin-top:10px}
-.user-meta{min-width:0}
-.user-meta strong{display:block;white-space:nowrap;overflow:hidden;text-overflow:ellipsis}
-.user-meta .sub{font-size:12px;color:#9aa0aa;margin-top:2px}
-.btn-danger{background:rgba(255,0,128,.14);border:1px solid rgba(255,0,128,.35);color:#fff;padding:10px 12px;border-radius:12px;font-weight:900;cursor:pointer;transition:.2s}
-.btn-danger:hover{background:rgba(255,0,128,.22)}
-.btn-danger:disabled{opacity:.6;cursor:wait}
-
-.small{font-size:12px;color:#9aa0aa;line-height:1.4;margin-top:10px}
-.log{margin-top:14px;background:#0b0b0b;border:1px solid #222;border-radius:16px;padding:12px;text-align:left;font-family:ui-monospace,Menlo,monospace;font-size:12px;color:#bfe3c6;max-height:180px;overflow:auto}
-
-.pay-big{background:linear-gradient(135deg,#ff0080,#ff4081);color:#fff;padding:18px 16px;border-radius:18px;text-decoration:none;display:block;margin:22px auto 8px;font-weight:900;font-size:18px;box-shadow:0 10px 30px rgba(255,0,128,.3);transition:transform .2s;cursor:pointer;border:1px solid rgba(255,255,255,.1)}
-.pay-big:hover{transform:scale(1.01);box-shadow:0 15px 40px rgba(255,0,128,.45)}
-.pay-sub{font-size:12px;opacity:.85;font-weight:normal;margin-top:6px;display:block}
-
-.modal-overlay{position:fixed;top:0;left:0;width:100%;height:100%;background:rgba(0,0,0,.8);backdrop-filter:blur(5px);z-index:999;display:flex;justify-content:center;align-items:center;opacity:0;visibility:hidden;transition:.25s;pointer-events:none}
-.modal-overlay.active{opacity:1;visibility:visible;pointer-events:auto}
-.modal-box{background:#141414;padding:22px;border-radius:22px;width:92%;max-width:420px;position:relative;border:1px solid #333;text-align:left;transform:translateY(16px);transition:.25s}
-.modal-overlay.active .modal-box{transform:translateY(0)}
-.close-btn{position:absolute;top:12px;right:16px;font-size:28px;cursor:pointer;color:#666}
-.close-btn:hover{color:#fff}
-.crypto-box{background:#000;padding:12px;border:1px dashed #444;border-radius:12px;margin-top:10px;font-family:ui-monospace,Menlo,monospace;font-size:13px;color:#bbb;word-break:break-all;text-align:center;transition:.2s;flex:1}
-.crypto-box:hover{border-color:#ff0080;color:#fff;background:#0a0a0a}
-.toast{margin-top:10px;color:#bfe3c6;font-size:12px}
-.hidden{display:none !important}
-.warn{margin-top:10px;padding:10px 12px;border-radius:12px;border:1px solid rgba(255,93,93,.35);background:rgba(255,93,93,.08);color:#ffd2d2;font-size:12px;line-height:1.35}
-.copy-btn{width:auto;padding:12px 12px;border-radius:12px;border:1px solid rgba(255,255,255,.12);background:rgba(255,255,255,.08);color:#fff;font-weight:900;cursor:pointer;transition:.2s;white-space:nowrap}
-.copy-btn:hover{background:rgba(255,255,255,.10)}
-</style>
+<link rel="stylesheet" href="{{ css_url }}">
 </head>
 
 <body>
@@ -455,7 +1622,7 @@ hr{border:0;border-top:1px solid #1f1f1f;margin:16px 0}
 
   <div id="appBox" class="hidden">
     <div class="row" style="margin-bottom:10px">
-      <button class="action-btn secondary" onclick="scan()" id="scanBtn" disabled title="Coming soon">Scan non-followers (soon)</button>
+      <button class="action-btn secondary" onclick="scan()" id="scanBtn">Scan non-followers</button>
       <button class="action-btn secondary" onclick="logoutLocal()" id="logoutBtn">Sign out</button>
     </div>
 
@@ -513,23 +1680,42 @@ hr{border:0;border-top:1px solid #1f1f1f;margin:16px 0}
   </div>
 </div>
 
-<script>
-let currentSessionId='';let selectedPlan="starter";const csrfToken=document.querySelector('meta[name="csrf-token"]').getAttribute('content');const modal=document.getElementById("paymentModal");const addr=`{{ pay_addr if pay_addr else "" }}`;function setPill(id,text){const el=document.getElementById(id);if(el)el.textContent=text}function addLog(msg){const logs=document.getElementById('logs');const time=new Date().toLocaleTimeString();logs.innerHTML+=`<div><span style="opacity:0.6">[${time}]</span> ${msg}</div>`;logs.scrollTop=logs.scrollHeight}async function refreshMe(){if(!currentSessionId)return;try{const res=await fetch('/api/me',{headers:{'X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken}});const data=await res.json();if(data.ok){setPill('quotaState',`Plan: ${data.plan} • Credits: ${data.credits}`)}}catch(e){console.error('Failed to refresh user data:',e)}}async function login(){const s=document.getElementById('sessionid').value.trim();if(!s){addLog('❌ Error: Please paste sessionid');return}const btn=document.getElementById('loginBtn');btn.disabled=true;btn.textContent='VERIFYING...';try{const res=await fetch('/login',{method:'POST',headers:{'Content-Type':'application/json','X-CSRF-Token':csrfToken},body:JSON.stringify({cookies:s})});const data=await res.json();if(!data.success){addLog('❌ Login failed: '+(data.error||'unknown'));return}currentSessionId=data.session_id;setPill('authState','Signed in: @'+data.username);document.getElementById('loginBox').classList.add('hidden');document.getElementById('appBox').classList.remove('hidden');addLog('✅ Login OK: @'+data.username);await refreshMe()}catch(e){addLog('❌ Network error during login');console.error(e)}finally{btn.disabled=false;btn.textContent='LOGIN'}}async function scan(){addLog('⚠️ Scan feature coming soon - Instagram API changes in progress')}function renderList(users){}async function unfollow(userId,btn){}function logoutLocal(){currentSessionId='';document.getElementById('sessionid').value='';document.getElementById('appBox').classList.add('hidden');document.getElementById('loginBox').classList.remove('hidden');setPill('authState','Not signed in');setPill('quotaState','Plan: — • Credits: —');document.getElementById('results').innerHTML='';document.getElementById('scanInfo').textContent='';addLog('👋 Signed out (local).')}function openModal(){modal.classList.add("active");document.getElementById("payStatus").textContent="";document.getElementById("myReq").textContent="";loadMyRequests()}function closeModal(){modal.classList.remove("active")}modal.addEventListener("click",(e)=>{if(e.target===modal)closeModal()});function copyAddress(){if(!addr){alert("Payment address not configured on server.");return}navigator.clipboard.writeText(addr).then(()=>{document.getElementById("payStatus").textContent="✅ Address copied.";setTimeout(()=>document.getElementById("payStatus").textContent="",1200)}).catch(()=>prompt("Copy address:",addr))}function selectPlan(p){selectedPlan=p;const hint=document.getElementById("planHint");if(p==="starter")hint.innerHTML="Selected: STARTER — expected amount: <b>5 USDT</b> (TRC20)";else hint.innerHTML="Selected: LIFETIME — expected amount: <b>9 USDT</b> (TRC20)"}function openTronScan(){const txid=document.getElementById("txid").value.trim();if(txid){window.open("https://tronscan.org/#/transaction/"+txid,"_blank")}else{window.open("https://tronscan.org/","_blank")}}async function submitTxid(){if(!currentSessionId){alert("Login first");return}if(!addr){document.getElementById("payStatus").textContent="❌ Server missing PAYMENT_ADDRESS_TRC20 env.";return}const txid=document.getElementById("txid").value.trim();if(!txid){document.getElementById("payStatus").textContent="❌ Paste TXID first.";return}document.getElementById("payStatus").textContent="⏳ Submitting…";try{const res=await fetch("/api/payment/submit-txid",{method:"POST",headers:{"Content-Type":"application/json","X-CSRF-Token":csrfToken,"X-Session-ID":currentSessionId},body:JSON.stringify({plan:selectedPlan,txid})});const j=await res.json();if(!j.ok){document.getElementById("payStatus").textContent="❌ Error: "+(j.error||res.status);return}document.getElementById("payStatus").textContent="✅ Submitted. Status: pending (manual review).";document.getElementById("txid").value="";await loadMyRequests()}catch(e){document.getElementById("payStatus").textContent="❌ Network error";console.error(e)}}async function loadMyRequests(){if(!currentSessionId)return;try{const res=await fetch("/api/payment/my-requests",{headers:{"X-Session-ID":currentSessionId,"X-CSRF-Token":csrfToken}});const j=await res.json();if(!j.ok){document.getElementById("myReq").textContent="";return}const items=j.items||[];if(!items.length){document.getElementById("myReq").textContent="No payment requests yet.";return}const top=items[0];let statusEmoji=top.status==='approved'?'✅':top.status==='rejected'?'❌':'⏳';document.getElementById("myReq").textContent=`${statusEmoji} Latest: ${top.plan.toUpperCase()} • ${top.status} • TXID: ${top.txid.slice(0,10)}…`;if(top.status==="approved"){await refreshMe()}}catch(e){console.error('Failed to load payment requests:',e)}}selectPlan("starter");
-</script>
+<script src="{{ js_url }}"></script>
 </body>
 </html>
 """
 
+
+def _compile_shell() -> Tuple[str, str]:
+    """Render HTML with everything but the CSRF token; returns the text around it."""
+    page = app.jinja_env.from_string(HTML).render(
+        starter_credits=STARTER_PACK_CREDITS,
+        pay_addr=PAYMENT_ADDRESS_TRC20,
+        css_url=static_assets.url("app.css"),
+        js_url=static_assets.url("app.js"),
+        csrf_token=lambda: _CSRF_SLOT,
+    )
+    head, tail = page.split(_CSRF_SLOT)
+    return head, tail
+
+
+SHELL_HEAD, SHELL_TAIL = _compile_shell()
+
 # ---------------------------------------------------------
 # 🛣️ ROUTES
 # ---------------------------------------------------------
 @app.route("/")
 def index():
-    return render_template_string(
-        HTML,
-        starter_credits=STARTER_PACK_CREDITS,
-        pay_addr=PAYMENT_ADDRESS_TRC20
-    )
+    return SHELL_HEAD + str(escape(generate_csrf())) + SHELL_TAIL
+
+
+@app.route("/static/<path:filename>")
+@limiter.exempt
+def static_asset(filename):
+    asset = static_assets.get(filename)
+    if asset is None:
+        return jsonify({"success": False, "error": "not_found"}), 404
+    return static_assets.response(asset, request)
 
 
 @app.route("/login", methods=["POST"])
@@ -548,7 +1734,7 @@ def login():
             logger.error("Login: Invalid sessionid format")
             return jsonify({"success": False, "error": "Invalid sessionid format"}), 400
 
-        logger.info(f"Login attempt - sessionid length: {len(sessionid)}")
+        logger.info("Login attempt - sessionid length: %s", len(sessionid))
         
         # ✅ Прямой HTTP запрос к Instagram API
         user_info = get_user_info(sessionid)
@@ -570,11 +1756,8 @@ def login():
                 "error": "Could not extract user data from Instagram"
             }), 500
         
-        logger.info(f"✅ Login successful for @{username} (ID: {user_id})")
+        logger.info("✅ Login successful for @%s (ID: %s)", username, user_id)
         
-        # Генерируем internal session ID
-        session_id = os.urandom(16).hex()
-
         # Сохраняем данные сессии
         session_data = {
             "sessionid": sessionid,
@@ -582,27 +1765,29 @@ def login():
             "username": username
         }
 
-        # Сохраняем в БД
-        upsert_user_on_login(session_id, str(user_id), username, session_data)
+        # Сохраняем в БД (one users row per Instagram account) and open an app session
+        _, session_id = upsert_user_on_login(str(user_id), username, session_data)
 
-        logger.info(f"✅ User saved to database: @{username}")
+        logger.info("✅ User saved to database: @%s", username)
         
-        return jsonify({
+        resp = jsonify({
             "success": True,
             "session_id": session_id,
             "username": username
         })
+        resp.set_cookie(SSE_COOKIE, session_id, max_age=int(SESSION_TTL), path="/api/events",
+                        secure=SSE_COOKIE_SECURE, httponly=True, samesite="Strict")
+        return resp
 
     except Exception as e:
-        logger.error(f"System error in login: {e}", exc_info=True)
+        logger.error("System error in login: %s", e, exc_info=True)
         return jsonify({"success": False, "error": "Server error"}), 500
 
 
 @app.route("/api/me", methods=["GET"])
 @require_session
 def api_me():
-    session_id = request.headers.get("X-Session-ID")
-    u = get_user_by_session(session_id)
+    u = g.user
     if not u:
         return jsonify({"ok": False, "error": "no_user"}), 404
     return jsonify({
@@ -613,11 +1798,38 @@ def api_me():
     })
 
 
+@app.route("/api/me/usage", methods=["GET"])
+@require_session
+def api_me_usage():
+    try:
+        days = min(366, max(1, int(request.args.get("days", 30))))
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_days"}), 400
+    return jsonify({"ok": True, "days": days, "usage": ledger.usage(g.user["id"], days)})
+
+
+@app.route("/api/me/history", methods=["GET"])
+@require_session
+def api_me_history():
+    """Newest actions first; ``before`` is the ``next`` cursor of the previous page."""
+    try:
+        limit = min(200, max(1, int(request.args.get("limit", 50))))
+        before = request.args.get("before")
+        before = tuple(int(x) for x in before.split(":", 1)) if before else None
+        if before is not None and len(before) != 2:
+            raise ValueError(before)
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_cursor"}), 400
+    items = ledger.history(g.user["id"], before, limit)
+    nxt = f"{items[-1]['created_at']}:{items[-1]['id']}" if len(items) == limit else None
+    return jsonify({"ok": True, "items": items, "next": nxt})
+
+
 @app.route("/api/payment/submit-txid", methods=["POST"])
 @require_session
 @limiter.limit("5 per hour")
 def submit_txid():
-    session_id = request.headers.get("X-Session-ID")
+    session_id = g.user["session_id"]
     data = request.get_json() or {}
     plan = (data.get("plan") or "").strip()
     txid = (data.get("txid") or "").strip()
@@ -637,113 +1849,643 @@ def submit_txid():
                 return jsonify({"ok": False, "error": "txid_already_submitted"}), 409
 
             cur.execute("""
-                INSERT INTO payment_requests(session_id, plan, txid, status, created_at, updated_at)
-                VALUES(?,?,?,?,?,?)
-            """, (session_id, plan, txid, "pending", ts, ts))
+                INSERT INTO payment_requests(session_id, user_id, plan, txid, status, created_at, updated_at)
+                VALUES(?,?,?,?,?,?,?)
+            """, (session_id, g.user["id"], plan, txid, "pending", ts, ts))
             conn.commit()
 
-        logger.info(f"Payment request: plan={plan}, txid={mask_sensitive(txid, 10)}")
+        logger.info("Payment request: plan=%s", plan, extra={"txid": txid})
         return jsonify({"ok": True, "status": "pending"})
     
     except sqlite3.IntegrityError:
         return jsonify({"ok": False, "error": "txid_already_submitted"}), 409
     except Exception as e:
-        logger.error(f"Error submitting TXID: {e}")
+        logger.error("Error submitting TXID: %s", e)
         return jsonify({"ok": False, "error": "server_error"}), 500
 
 
+def _apply_plan(cur: sqlite3.Cursor, user_id: Optional[int], plan: str, ts: str) -> int:
+    """Credit an approved payment to its user; returns the credits granted."""
+    if plan == "starter":
+        cur.execute("""
+            UPDATE users
+            SET credits = credits + ?, updated_at=?
+            WHERE id=? AND plan != 'lifetime'
+        """, (STARTER_PACK_CREDITS, ts, user_id))
+        return STARTER_PACK_CREDITS if cur.rowcount else 0
+    if plan == "lifetime":
+        cur.execute("UPDATE users SET plan='lifetime', updated_at=? WHERE id=?", (ts, user_id))
+    return 0
+
+
+def _approve_in_tx(cur: sqlite3.Cursor, rows: List[Dict[str, Any]], ts: str,
+                   only_pending: bool = True) -> Tuple[List[Dict[str, Any]], int]:
+    """Mark rows approved and credit them; returns ``(approved rows, credits granted)``."""
+    approved, granted = [], 0
+    status_check = "status='pending'" if only_pending else "status!='approved'"
+    for r in rows:
+        cur.execute(f"UPDATE payment_requests SET status='approved', updated_at=? WHERE id=? AND {status_check}",
+                    (ts, int(r["id"])))
+        if cur.rowcount:
+            granted += _apply_plan(cur, r["user_id"], r["plan"], ts)
+            approved.append(r)
+    return approved, granted
+
+
+def _after_approve(approved: List[Dict[str, Any]], granted: int) -> None:
+    for r in approved:
+        if r["user_id"] is not None:
+            invalidate_user(r["user_id"])
+            publish_user(r["user_id"])
+            event_bus.publish(str(r["user_id"]), "payment", {"id": r["id"], "plan": r["plan"], "status": "approved"})
+        PAYMENTS_APPROVED.inc(r["plan"])
+        logger.info("Approved TXID, plan=%s", r["plan"], extra={"txid": r["txid"]})
+    if granted:
+        CREDITS_GRANTED.inc(amount=granted)
+
+
+def _reject_in_tx(cur: sqlite3.Cursor, rows: List[Dict[str, Any]], ts: str) -> List[Dict[str, Any]]:
+    rejected = []
+    for r in rows:
+        cur.execute("""
+            UPDATE payment_requests SET status='rejected', note=?, updated_at=?
+            WHERE id=? AND status='pending'
+        """, (r.get("note"), ts, int(r["id"])))
+        if cur.rowcount:
+            rejected.append(r)
+    return rejected
+
+
+def _after_reject(rejected: List[Dict[str, Any]]) -> None:
+    for r in rejected:
+        if r["user_id"] is not None:
+            event_bus.publish(str(r["user_id"]), "payment", {"id": r["id"], "plan": r["plan"], "status": "rejected"})
+        logger.info("Rejected TXID: %s", r.get("note"), extra={"txid": r["txid"]})
+
+
+def approve_payment_requests(rows: List[Dict[str, Any]]) -> int:
+    """Approve pending requests (dicts with id, user_id, plan, txid) in one transaction.
+
+    Requests that are no longer pending are skipped; returns how many were approved.
+    """
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        approved, granted = _approve_in_tx(cur, rows, now_iso())
+        conn.commit()
+    _after_approve(approved, granted)
+    return len(approved)
+
+
+def reject_payment_requests(rows: List[Dict[str, Any]]) -> int:
+    """Reject pending requests in one transaction, storing each row's ``note``."""
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        rejected = _reject_in_tx(cur, rows, now_iso())
+        conn.commit()
+    _after_reject(rejected)
+    return len(rejected)
+
+
+PAYMENT_REVIEW_MAX = 500
+PAYMENT_LIST_MAX = 200
+
+
+def _review_payment_requests(txids: List[str], action: str, note: Optional[str] = None
+                             ) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]]]:
+    """Approve or reject many TXIDs in one transaction.
+
+    Returns ``({txid: result}, {txid: request row})``. Results: ``approved`` /
+    ``rejected``, ``already_approved``, ``not_pending`` (reject of a decided
+    request), ``not_found``, ``invalid_txid``, ``invalid_plan``. Approving a
+    rejected request is allowed, as with the single-TXID endpoint.
+    """
+    results: Dict[str, str] = {}
+    wanted = []
+    for t in txids:
+        t = (t or "").strip() if isinstance(t, str) else ""
+        if not validate_txid(t):
+            results[t] = "invalid_txid"
+        elif t not in results:
+            wanted.append(t)
+            results[t] = "not_found"
+    with db() as conn:
+        cur = conn.cursor()
+        ts = now_iso()
+        cur.execute("BEGIN IMMEDIATE")
+        rows = []
+        for i in range(0, len(wanted), PAYMENT_REVIEW_MAX):
+            chunk = wanted[i:i + PAYMENT_REVIEW_MAX]
+            cur.execute(f"""
+                SELECT id, session_id, user_id, plan, txid, status FROM payment_requests
+                WHERE txid IN ({",".join("?" * len(chunk))})
+            """, chunk)
+            rows.extend(dict(r) for r in cur.fetchall())
+        todo = []
+        for r in rows:
+            if r["status"] == "approved":
+                results[r["txid"]] = "already_approved"
+            elif action == "approve" and r["plan"] not in PLAN_PRICES_USDT:
+                results[r["txid"]] = "invalid_plan"
+            elif action == "reject" and r["status"] != "pending":
+                results[r["txid"]] = "not_pending"
+            else:
+                todo.append(dict(r, note=note))
+        if action == "approve":
+            done, granted = _approve_in_tx(cur, todo, ts, only_pending=False)
+        else:
+            done = _reject_in_tx(cur, todo, ts)
+        conn.commit()
+    for r in done:
+        results[r["txid"]] = "approved" if action == "approve" else "rejected"
+    if action == "approve":
+        _after_approve(done, granted)
+    else:
+        _after_reject(done)
+    return results, {r["txid"]: r for r in rows}
+
+
+def review_payment_requests(txids: List[str], action: str, note: Optional[str] = None) -> Dict[str, str]:
+    """Approve or reject many TXIDs in one transaction; returns ``{txid: result}``."""
+    return _review_payment_requests(txids, action, note)[0]
+
+
+def _payment_provider():
+    if PAYMENT_VERIFY_PROVIDER == "trongrid":
+        return TronGridProvider(TRONGRID_URL, TRONGRID_API_KEY, address=PAYMENT_ADDRESS_TRC20 or None)
+    if PAYMENT_VERIFY_PROVIDER.startswith("fixture:"):
+        return FixtureProvider(PAYMENT_VERIFY_PROVIDER.split(":", 1)[1])
+    return None
+
+
+payment_provider = _payment_provider()
+payment_verifier = None
+if payment_provider is not None and PAYMENT_ADDRESS_TRC20:
+    payment_verifier = PaymentVerifier(
+        db,
+        payment_provider,
+        PAYMENT_ADDRESS_TRC20,
+        PLAN_PRICES_USDT,
+        approve=approve_payment_requests,
+        reject=reject_payment_requests,
+        min_confirmations=PAYMENT_MIN_CONFIRMATIONS,
+        batch_size=PAYMENT_VERIFY_BATCH,
+        interval=PAYMENT_VERIFY_INTERVAL,
+    )
+
+
 @app.route("/api/payment/my-requests", methods=["GET"])
 @require_session
 def my_payment_requests():
-    session_id = request.headers.get("X-Session-ID")
-    
+    """Newest first, 10 per page; ``?before=`` is the ``next`` id of the previous page."""
+    try:
+        limit = min(PAYMENT_LIST_MAX, max(1, int(request.args.get("limit", 10))))
+        before = int(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_params"}), 400
+
     with db() as conn:
         cur = conn.cursor()
         cur.execute("""
             SELECT id, plan, txid, status, created_at, updated_at
             FROM payment_requests
-            WHERE session_id=?
+            WHERE user_id=? AND id < ?
             ORDER BY id DESC
-            LIMIT 10
-        """, (session_id,))
+            LIMIT ?
+        """, (g.user["id"], before if before is not None else 2 ** 63 - 1, limit))
         rows = [dict(r) for r in cur.fetchall()]
     
-    return jsonify({"ok": True, "items": rows})
+    return jsonify({"ok": True, "items": rows, "next": rows[-1]["id"] if len(rows) == limit else None})
 
 
 @app.route("/scan", methods=["POST"])
 @require_session
 @limiter.limit("10 per hour")
 def scan():
-    # Временно возвращаем пустой список
-    return jsonify({
-        "success": False,
-        "error": "Feature temporarily unavailable due to Instagram API changes"
-    }), 503
+    user = g.user
+    sessionid = (load_session_data(user["id"]) or {}).get("sessionid")
+    if not sessionid or not user["ig_user_id"]:
+        return jsonify({"success": False, "error": "Instagram session missing, please log in again"}), 401
+
+    job_id = job_queue.find_active("scan", user["id"])
+    if job_id is None:
+        job_id = job_queue.enqueue("scan", user["id"], session_id=user["session_id"])
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+
+def _results_limit(params) -> int:
+    try:
+        limit = int(params.get("limit") or 50)
+    except (TypeError, ValueError):
+        limit = 50
+    return max(1, min(limit, SCAN_RESULTS_MAX_LIMIT))
+
+
+def _scan_page(diff: NonFollowerDiff, offset: int, limit: int) -> Dict[str, Any]:
+    users = diff.page(offset, limit)
+    next_offset = offset + len(users)
+    return {
+        "success": True,
+        "count": len(diff),
+        "followers": len(diff.followers),
+        "following": len(diff.following),
+        "offset": offset,
+        "next_offset": next_offset if next_offset < len(diff) else None,
+        "users": users,
+    }
+
+
+def _latest_diff(user: Dict[str, Any]) -> Optional[NonFollowerDiff]:
+    diff = scan_results.get(user["id"])
+    if diff is None:
+        # Scanned on another worker (or the cache expired): rebuild from the snapshot.
+        snap = load_latest_snapshot(user["ig_user_id"]) if user["ig_user_id"] else None
+        if snap is None:
+            return None
+        diff = diff_from_snapshot(snap)
+        scan_results.set(user["id"], diff)
+    return diff
+
+
+@app.route("/api/scan/results", methods=["GET"])
+@require_session
+def scan_results_page():
+    diff = _latest_diff(g.user)
+    if diff is None:
+        return jsonify({"success": False, "error": "no_recent_scan"}), 404
+    try:
+        offset = max(0, int(request.args.get("offset") or 0))
+    except ValueError:
+        return jsonify({"success": False, "error": "invalid_offset"}), 400
+    return jsonify(_scan_page(diff, offset, _results_limit(request.args)))
+
+
+@app.route("/api/scan/unfollowers", methods=["GET"])
+@require_session
+def scan_unfollowers():
+    """Accounts that stopped following since the previous scan."""
+    snap = load_latest_snapshot(g.user["ig_user_id"]) if g.user["ig_user_id"] else None
+    if snap is None:
+        return jsonify({"success": False, "error": "no_recent_scan"}), 404
+    users = [
+        snap.following_meta[pk].to_dict() if pk in snap.following_meta else {"pk": pk}
+        for pk in snap.unfollowers
+    ]
+    sessionid = (load_session_data(g.user["id"]) or {}).get("sessionid")
+    if sessionid:
+        _enrich_profiles(sessionid, users)
+    return jsonify({"success": True, "scanned_at": snap.scanned_at, "count": len(users), "users": users})
+
+
+def _enrich_profiles(sessionid: str, users: List[Dict[str, Any]]) -> None:
+    """Add follower/following counts to the first ``PROFILE_ENRICH_MAX`` users with a username.
+
+    Goes through the profile cache, so the same unfollowers seen by many
+    accounts or on repeated page loads cost one upstream lookup per TTL.
+    """
+    for u in [u for u in users if u.get("username")][:PROFILE_ENRICH_MAX]:
+        info = get_user_info(sessionid, u["username"])
+        if not info:
+            continue
+        for field in ("full_name", "is_private", "is_verified", "profile_pic_url"):
+            if field in info:
+                u[field] = info[field]
+        try:
+            u["follower_count"] = int(info["edge_followed_by"]["count"])
+            u["following_count"] = int(info["edge_follow"]["count"])
+        except (TypeError, KeyError, ValueError):
+            pass
+
+
+# Exports stream straight to the client: rows are encoded in ~64 KiB
+# chunks (gzip when the client accepts it), so memory does not grow with
+# the export size.
+HISTORY_EXPORT_FIELDS = ("id", "action", "target_id", "delta_credits", "created_at")
+
+
+def _export_response(rows: Iterator[Dict[str, Any]], fields, name: str):
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in export.FORMATS:
+        return jsonify({"success": False, "error": "invalid_format", "formats": list(export.FORMATS)}), 400
+    compress = request.accept_encodings["gzip"] > 0
+    headers = {
+        "Content-Disposition": f'attachment; filename="{name}.{fmt}"',
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding",
+        "X-Accel-Buffering": "no",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return Response(export.stream(rows, fields, fmt, compress), content_type=export.FORMATS[fmt],
+                    headers=headers)
+
+
+def _iter_non_followers(diff: NonFollowerDiff) -> Iterator[Dict[str, Any]]:
+    records = diff.records
+    for pk in diff.order:
+        record = records.get(pk)  # may have been unfollowed meanwhile
+        if record is not None:
+            yield record.to_dict()
+
+
+@app.route("/api/export/non-followers", methods=["GET"])
+@require_session
+@limiter.limit("30 per hour")
+def export_non_followers():
+    """Latest scan's non-followers as ``?format=ndjson`` (default) or ``csv``."""
+    diff = _latest_diff(g.user)
+    if diff is None:
+        return jsonify({"success": False, "error": "no_recent_scan"}), 404
+    return _export_response(_iter_non_followers(diff), UserRecord.__slots__, "non-followers")
+
+
+@app.route("/api/export/history", methods=["GET"])
+@require_session
+@limiter.limit("30 per hour")
+def export_history():
+    """Unfollow and refund history still in the ledger, oldest first, as NDJSON or CSV."""
+    return _export_response(ledger.export(g.user["id"]), HISTORY_EXPORT_FIELDS, "history")
 
 
 @app.route("/unfollow", methods=["POST"])
 @require_session
 @limiter.limit("30 per hour")
 def unfollow():
-    # Временно недоступно
+    data = request.get_json(silent=True) or {}
+    target_id = str(data.get("user_id") or "").strip()
+    if not target_id.isdigit():
+        return jsonify({"success": False, "error": "invalid_user_id"}), 400
+
+    return _enqueue_unfollows([target_id])
+
+
+@app.route("/unfollow/batch", methods=["POST"])
+@require_session
+@limiter.limit("10 per hour")
+def unfollow_batch():
+    data = request.get_json(silent=True) or {}
+    raw = data.get("user_ids")
+    if not isinstance(raw, list) or not raw:
+        return jsonify({"success": False, "error": "invalid_user_ids"}), 400
+
+    targets = list(dict.fromkeys(str(t).strip() for t in raw))
+    if not all(t.isdigit() for t in targets):
+        return jsonify({"success": False, "error": "invalid_user_ids"}), 400
+    if len(targets) > UNFOLLOW_BATCH_MAX:
+        return jsonify({"success": False, "error": "batch_too_large", "max": UNFOLLOW_BATCH_MAX}), 400
+
+    return _enqueue_unfollows(targets)
+
+
+def _enqueue_unfollows(targets: List[str]):
+    user = g.user  # spend_credits_bulk drops g.user (the balance changed)
+    allowed, reason = can_unfollow(user)
+    if not allowed:
+        return jsonify({"success": False, "error": reason}), 402
+
+    reserved = spend_credits_bulk(user["id"], targets)
+    if not reserved:
+        return jsonify({"success": False, "error": "no_credits"}), 402
+
+    try:
+        job_id = job_queue.enqueue("unfollow", user["id"], {"targets": reserved}, session_id=user["session_id"])
+    except Exception as e:  # the credits are already spent; nothing will run to use them
+        logger.error("Error enqueueing unfollow job: %s", e, extra={"user_id": user["id"]})
+        refund_credits_bulk(user["id"], reserved)
+        return jsonify({"success": False, "error": "server_error"}), 500
     return jsonify({
-        "success": False,
-        "error": "Feature temporarily unavailable due to Instagram API changes"
-    }), 503
+        "success": True,
+        "job_id": job_id,
+        "reserved": len(reserved),
+        "skipped": targets[len(reserved):],
+    }), 202
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@app.route("/api/events", methods=["GET"])
+@limiter.exempt
+def event_stream():
+    """Server-Sent Events for the session's user: ``me``, ``payment`` and ``job``.
+
+    The session comes from the SSE_COOKIE set at login because EventSource
+    cannot send headers. 503 when this worker is at SSE_MAX_CONNECTIONS; the
+    page then falls back to polling.
+    """
+    session_id = request.cookies.get(SSE_COOKIE, "").strip()
+    if not validate_session_id(session_id):
+        return jsonify({"success": False, "error": "Invalid session format"}), 401
+    user = get_current_user(session_id)
+    if not user:
+        return jsonify({"success": False, "error": "Session not found"}), 401
+    sub = event_bus.subscribe(str(user["id"]))
+    if sub is None:
+        return jsonify({"ok": False, "error": "too_many_streams"}), 503, {"Retry-After": "30"}
+    first = {"plan": user["plan"], "credits": int(user["credits"])}
+
+    def stream() -> Iterator[str]:
+        deadline = time.monotonic() + SSE_MAX_DURATION
+        try:
+            yield "retry: 3000\n\n" + _sse("me", first)
+            while not sub.closed:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                item = sub.get(min(SSE_HEARTBEAT, left))
+                yield ": ping\n\n" if item is None else _sse(*item)
+        finally:
+            sub.close()
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+@require_session
+def job_status(job_id: int):
+    job = job_queue.get(job_id)
+    if not job or job["user_id"] != g.user["id"]:
+        return jsonify({"ok": False, "error": "job_not_found"}), 404
+    job.pop("user_id")
+    return jsonify({"ok": True, **job})
 
 
 @app.route("/api/admin/approve-txid", methods=["POST"])
 @limiter.limit("100 per hour")
+@require_admin
 def admin_approve_txid():
-    if not ADMIN_GRANT_KEY:
-        return jsonify({"ok": False, "error": "admin_disabled"}), 403
-    
-    if request.headers.get("X-Admin-Key") != ADMIN_GRANT_KEY:
-        return jsonify({"ok": False, "error": "forbidden"}), 403
-
     data = request.get_json() or {}
     txid = (data.get("txid") or "").strip()
 
     if not validate_txid(txid):
         return jsonify({"ok": False, "error": "invalid_txid"}), 400
 
+    results, rows = _review_payment_requests([txid], "approve")
+    result = results[txid]
+    if result == "not_found":
+        return jsonify({"ok": False, "error": "txid_not_found"}), 404
+    if result == "already_approved":
+        return jsonify({"ok": True, "already": True}), 200
+    if result == "invalid_plan":
+        logger.error("Invalid plan", extra={"txid": txid})
+        return jsonify({"ok": False, "error": "invalid_plan"}), 400
+
+    req = rows[txid]
+    return jsonify({"ok": True, "session_id": mask_sensitive(req["session_id"]), "plan": req["plan"]})
+
+
+@app.route("/api/admin/payments", methods=["GET"])
+@limiter.limit("300 per hour")
+@require_admin
+def admin_payments():
+    """Payment requests, newest first: ?status=pending|approved|rejected|all&from=&to=&before=&limit=.
+
+    ``from``/``to`` are ISO dates (``to`` exclusive); ``before`` is the
+    ``next`` id of the previous page.
+    """
+    status = request.args.get("status", "pending")
+    if status not in ("pending", "approved", "rejected", "all"):
+        return jsonify({"ok": False, "error": "invalid_status"}), 400
+    try:
+        limit = min(PAYMENT_LIST_MAX, max(1, int(request.args.get("limit", 50))))
+        before = int(request.args["before"]) if request.args.get("before") else None
+        since = datetime.fromisoformat(request.args["from"]).isoformat() if request.args.get("from") else None
+        until = datetime.fromisoformat(request.args["to"]).isoformat() if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_params"}), 400
+
+    where, params = [], []
+    if status != "all":
+        where.append("status = ?")
+        params.append(status)
+    if before is not None:
+        where.append("id < ?")
+        params.append(before)
+    if since:
+        where.append("created_at >= ?")
+        params.append(since)
+    if until:
+        where.append("created_at < ?")
+        params.append(until)
+    sql = "SELECT id, session_id, plan, txid, status, note, created_at, updated_at FROM payment_requests"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
     with db() as conn:
-        cur = conn.cursor()
-        ts = now_iso()
+        rows = [dict(r) for r in conn.execute(sql, params + [limit]).fetchall()]
+    for r in rows:
+        r["session_id"] = mask_sensitive(r["session_id"])
+    return jsonify({"ok": True, "items": rows, "next": rows[-1]["id"] if len(rows) == limit else None})
 
-        cur.execute("SELECT * FROM payment_requests WHERE txid=? LIMIT 1", (txid,))
-        req = cur.fetchone()
-        
-        if not req:
-            return jsonify({"ok": False, "error": "txid_not_found"}), 404
-        
-        if req["status"] == "approved":
-            return jsonify({"ok": True, "already": True}), 200
 
-        session_id = req["session_id"]
-        plan = req["plan"]
+@app.route("/api/admin/payments/review", methods=["POST"])
+@limiter.limit("100 per hour")
+@require_admin
+def admin_review_payments():
+    """Bulk decision: {"action": "approve"|"reject", "txids": [...], "note": "..."}."""
+    data = request.get_json() or {}
+    action = data.get("action")
+    txids = data.get("txids")
+    if action not in ("approve", "reject"):
+        return jsonify({"ok": False, "error": "invalid_action"}), 400
+    if not isinstance(txids, list) or not txids:
+        return jsonify({"ok": False, "error": "txids_required"}), 400
+    if len(txids) > PAYMENT_REVIEW_MAX:
+        return jsonify({"ok": False, "error": "too_many_txids", "max": PAYMENT_REVIEW_MAX}), 400
+    note = data.get("note")
+    note = str(note)[:500] if note else None
+    results = review_payment_requests(txids, action, note)
+    summary: Dict[str, int] = {}
+    for r in results.values():
+        summary[r] = summary.get(r, 0) + 1
+    return jsonify({"ok": True, "summary": summary, "results": results})
+
+
+@app.route("/api/admin/stats", methods=["GET"])
+@limiter.limit("100 per hour")
+@require_admin
+def admin_stats():
+    return jsonify({
+        "ok": True,
+        "db_pool": db_pool.stats(),
+        "user_cache": user_cache.stats(),
+        "session_cache": session_cache.stats(),
+        "sessions": sessions.stats(),
+        "jobs": job_queue.stats(),
+        "unfollows": unfollow_dispatcher.stats(),
+        "instagram_http": instagram_client.stats(),
+        "instagram_fetch": fetch_engine.stats(),
+        "profile_cache": profile_cache.stats(),
+        "ledger": ledger.stats(),
+        "payment_verifier": payment_verifier.stats() if payment_verifier else None,
+        "events": event_bus.stats(),
+    })
 
-        if plan not in ("starter", "lifetime"):
-            logger.error(f"Invalid plan: {plan}")
-            return jsonify({"ok": False, "error": "invalid_plan"}), 400
 
-        if plan == "starter":
-            cur.execute("""
-                UPDATE users
-                SET credits = credits + ?, updated_at=?
-                WHERE session_id=? AND plan != 'lifetime'
-            """, (STARTER_PACK_CREDITS, ts, session_id))
-        elif plan == "lifetime":
-            cur.execute("UPDATE users SET plan='lifetime', updated_at=? WHERE session_id=?", (ts, session_id))
-
-        cur.execute("UPDATE payment_requests SET status='approved', updated_at=? WHERE id=?", (ts, int(req["id"])))
-        conn.commit()
+@app.route("/api/admin/profiles", methods=["GET"])
+@limiter.limit("100 per hour")
+@require_admin
+def admin_profiles():
+    """Top-N functions over the stored profile dumps: ?endpoint=&top=20&sort=cumulative."""
+    sort = request.args.get("sort", "cumulative")
+    if sort not in SORT_KEYS:
+        return jsonify({"ok": False, "error": "invalid_sort"}), 400
+    try:
+        top = max(1, min(int(request.args.get("top", 20)), 200))
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_top"}), 400
+    endpoint = request.args.get("endpoint") or None
+    return jsonify({
+        "ok": True,
+        "sample_rate": PROFILE_SAMPLE_RATE,
+        "endpoints": request_profiler.endpoints(),
+        "summary": request_profiler.summary(endpoint, top=top, sort=sort),
+    })
 
-    logger.info(f"Approved TXID {mask_sensitive(txid, 10)}, plan={plan}")
-    return jsonify({"ok": True, "session_id": mask_sensitive(session_id), "plan": plan})
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+@require_admin
+def prometheus_metrics():
+    """Prometheus text exposition, summed over all workers."""
+    return metrics_collector.collect(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+# ---------------------------------------------------------
+# 🏭 APP FACTORY
+# ---------------------------------------------------------
+_setup_done = False
+_setup_lock = threading.Lock()
+
+
+def create_app() -> Flask:
+    """Finish one-time setup and return the WSGI app.
+
+    Importing this module only builds objects; the schema check happens
+    here, once per process, never on the request path. It starts no
+    threads, so ``gunicorn --preload "app:create_app()"`` can run it in
+    the master: imports, the static manifest and the migration are paid
+    once and shared copy-on-write, and each worker calls
+    start_background() after the fork (see gunicorn.conf.py). Objects
+    built at import notice the new pid and drop what belongs to the
+    master: DB and HTTP connections, the event bus origin, dispatcher
+    jobs and pacing, thread pools and in-flight profile lookups
+    (tests/test_fork.py).
+    """
+    global _setup_done
+    with _setup_lock:
+        if not _setup_done:
+            check_schema()
+            _setup_done = True
+    return app
 
 
 if __name__ == "__main__":
+    create_app()
+    metrics_collector.clear()
+    start_background()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,95 @@
+"""Fingerprinted static assets, compressed once at startup.
+
+Every file under the static directory is served as ``name.<hash>.ext`` with
+a year-long immutable ``Cache-Control``, so a deploy that changes a file
+changes its URL. Bodies, gzip and (when the ``brotli`` package is
+installed) brotli variants are built in memory at import, so requests
+never touch the disk or compress anything.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, NamedTuple, Optional
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+from flask import Request, Response
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+class Asset(NamedTuple):
+    name: str
+    url_name: str  # fingerprinted file name
+    mimetype: str
+    etag: str
+    bodies: Dict[str, bytes]  # content-encoding ("identity", "gzip", "br") -> bytes
+
+
+def _fingerprint(name: str, digest: str) -> str:
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{digest}{ext}"
+
+
+class AssetManifest:
+    def __init__(self, static_dir: str, url_prefix: str = "/static", min_compress: int = 256):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.min_compress = min_compress
+        self._by_name: Dict[str, Asset] = {}
+        self._by_url_name: Dict[str, Asset] = {}
+        self.load()
+
+    def load(self) -> None:
+        by_name = {}
+        for root, _, files in os.walk(self.static_dir):
+            for fn in files:
+                path = os.path.join(root, fn)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                with open(path, "rb") as fh:
+                    by_name[name] = self._build(name, fh.read())
+        self._by_name = by_name
+        self._by_url_name = {a.url_name: a for a in by_name.values()}
+
+    def _build(self, name: str, raw: bytes) -> Asset:
+        digest = hashlib.sha256(raw).hexdigest()[:12]
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if mimetype.startswith("text/") or mimetype == "application/javascript":
+            mimetype += "; charset=utf-8"
+        bodies = {"identity": raw}
+        if len(raw) >= self.min_compress:
+            bodies["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+            if brotli is not None:
+                bodies["br"] = brotli.compress(raw, quality=11)
+        return Asset(name, _fingerprint(name, digest), mimetype, digest, bodies)
+
+    def url(self, name: str) -> str:
+        return f"{self.url_prefix}/{self._by_name[name].url_name}"
+
+    def get(self, url_name: str) -> Optional[Asset]:
+        return self._by_url_name.get(url_name)
+
+    def response(self, asset: Asset, req: Request) -> Response:
+        """Serve ``asset``: 304 on a matching ETag, else the best encoding accepted."""
+        if asset.etag in req.if_none_match:
+            resp = Response(status=304)
+        else:
+            encoding = "identity"
+            for candidate in ("br", "gzip"):
+                if candidate in asset.bodies and req.accept_encodings[candidate] > 0:
+                    encoding = candidate
+                    break
+            resp = Response(asset.bodies[encoding], mimetype=asset.mimetype)
+            if encoding != "identity":
+                resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(asset.etag)
+        resp.headers["Cache-Control"] = IMMUTABLE
+        resp.headers["Vary"] = "Accept-Encoding"
+        return resp
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {a.url_name: {enc: len(b) for enc, b in a.bodies.items()} for a in self._by_name.values()}
@@ -0,0 +1,93 @@
+"""Memory/time of the non-follower diff: diffengine vs a naive list-of-dicts.
+
+    python bench/bench_diff.py --sizes 10000 100000 1000000
+
+Each size N builds N followers and N following with 90% overlap, streamed
+in pages of 200 as the scan would receive them. Wall time (including
+building the fixture pages, identical for both sides) is taken from a plain
+run; peak memory from a second run under tracemalloc.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from diffengine import NonFollowerDiff  # noqa: E402
+
+PAGE = 200
+
+
+def user(pk: int) -> dict:
+    return {
+        "pk": pk,
+        "username": f"user{pk}",
+        "full_name": f"User {pk}",
+        "is_private": pk % 7 == 0,
+        "is_verified": False,
+        "profile_pic_url": f"https://example.invalid/p/{pk}.jpg",
+    }
+
+
+def pages(start: int, n: int):
+    for lo in range(start, start + n, PAGE):
+        yield [user(pk) for pk in range(lo, min(lo + PAGE, start + n))]
+
+
+def naive(n: int, overlap: int) -> int:
+    followers, following = [], []
+    for p in pages(1, n):
+        followers.extend(p)
+    for p in pages(n - overlap + 1, n):
+        following.extend(p)
+    follower_ids = {u["pk"] for u in followers}
+    result = sorted((u for u in following if u["pk"] not in follower_ids), key=lambda u: u["username"])
+    return len(result)
+
+
+def compact(n: int, overlap: int) -> int:
+    diff = NonFollowerDiff()
+    for p in pages(1, n):
+        diff.add_followers(p)
+    diff.seal_followers()
+    for p in pages(n - overlap + 1, n):
+        diff.add_following(p)
+    diff.finish()
+    diff.page(0, 50)
+    return len(diff)
+
+
+def measure(fn, n: int, overlap: int):
+    started = time.perf_counter()
+    count = fn(n, overlap)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn(n, overlap)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--overlap", type=float, default=0.9, help="share of following that follow back")
+    p.add_argument("--skip-naive-above", type=int, default=1_000_000,
+                   help="skip the baseline above this size (it needs several GB)")
+    args = p.parse_args()
+
+    print(f"{'N':>10} {'impl':>8} {'result':>9} {'seconds':>9} {'peak MiB':>9}")
+    for n in args.sizes:
+        overlap = int(n * args.overlap)
+        impls = [("compact", compact)]
+        if n <= args.skip_naive_above:
+            impls.insert(0, ("naive", naive))
+        for name, fn in impls:
+            count, elapsed, peak = measure(fn, n, overlap)
+            print(f"{n:>10} {name:>8} {count:>9} {elapsed:>9.3f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
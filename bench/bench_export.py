@@ -0,0 +1,112 @@
+"""Memory profile of the streaming exports: RSS must stay flat with export size.
+
+    python bench/bench_export.py --rows 1000000
+
+Fills a temporary database with ``--rows`` ledger rows for one user, then
+downloads /api/export/history through the Flask test client in every
+format, with and without gzip, reading the body chunk by chunk. RSS is
+sampled after every chunk. The output shows RSS before the export, RSS
+once 10% of the rows have been read (the SQLite page cache and buffers
+are warm by then) and the peak, plus throughput, and checks the row
+count. The run exits 1 if the peak grows more than ``--max-growth`` MiB
+past the 10% mark. SQLite mmap is off here because mapped file pages
+count as RSS (they are bounded by DB_MMAP_SIZE, not by the export).
+"""
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+MIB = 1024 * 1024
+
+
+def rss() -> int:
+    """Current resident set size in bytes (peak RSS where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def fill(app, user_id: int, n: int) -> None:
+    start = int(time.time()) - n
+    with app.db() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO actions(user_id, action, target_id, delta_credits, created_at) VALUES(?,?,?,?,?)",
+            ((user_id, 1 if i % 10 else 2, 10 ** 10 + i, -1 if i % 10 else 1, start + i) for i in range(n)),
+        )
+        conn.commit()
+
+
+def run(client, token: str, fmt: str, gzip: bool, expected: int):
+    headers = {"X-Session-ID": token, "Accept-Encoding": "gzip" if gzip else "identity"}
+    before = peak = warm = rss()
+    sent = lines = 0
+    inflate = zlib.decompressobj(31) if gzip else None
+    started = time.perf_counter()
+    resp = client.get(f"/api/export/history?format={fmt}", headers=headers, buffered=False)
+    assert resp.status_code == 200, resp.status_code
+    assert (resp.headers.get("Content-Encoding") == "gzip") == gzip
+    for chunk in resp.response:
+        sent += len(chunk)
+        lines += (inflate.decompress(chunk) if inflate else chunk).count(b"\n")
+        if lines < expected // 10:
+            warm = rss()
+        else:
+            peak = max(peak, rss())
+    resp.close()
+    elapsed = time.perf_counter() - started
+    rows = lines - (1 if fmt == "csv" else 0)  # csv header
+    return rows, sent, elapsed, before, warm, max(peak, warm)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--max-growth", type=float, default=8.0, help="allowed RSS growth past the 10% mark (MiB)")
+    args = p.parse_args()
+
+    os.environ.update({
+        "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="bench-export-"), "app.db"),
+        "RATELIMIT_STORAGE_URI": "memory://",
+        "METRICS_DIR": "",
+        "JOB_WORKERS": "0",
+        "LEDGER_MAINTENANCE_INTERVAL": "0",
+        "DB_MMAP_SIZE": "0",
+    })
+    logging.disable(logging.WARNING)
+    import app  # noqa: E402  (reads the environment at import)
+
+    app.create_app()
+    app.app.config["WTF_CSRF_ENABLED"] = False
+    app.limiter.enabled = False
+    user_id, token = app.upsert_user_on_login("1", "bench", {"sessionid": "bench"})
+    t0 = time.perf_counter()
+    fill(app, user_id, args.rows)
+    print(f"filled {args.rows:,} rows in {time.perf_counter() - t0:.1f}s")
+
+    client = app.app.test_client()
+    failed = False
+    for fmt in ("ndjson", "csv"):
+        for gzip in (False, True):
+            rows, sent, elapsed, before, warm, peak = run(client, token, fmt, gzip, args.rows)
+            growth = (peak - warm) / MIB
+            ok = rows == args.rows and growth <= args.max_growth
+            failed |= not ok
+            print(f"{fmt:>6} gzip={'on ' if gzip else 'off'} rows={rows:,} sent={sent / MIB:7.1f} MiB "
+                  f"{rows / elapsed:10,.0f} rows/s  rss {before / MIB:6.1f} -> {warm / MIB:6.1f} at 10% "
+                  f"-> peak {peak / MIB:6.1f} MiB "
+                  f"(+{growth:.1f}){'' if ok else '  FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Per-request limiter overhead: memory:// vs the shared sqlite:// storage.
+
+    python bench/bench_ratelimit.py --requests 5000 --processes 2
+
+Times a trivial Flask view with no limiter, then with Flask-Limiter on each
+storage (two limits per request, like the app's defaults). Then runs
+``--processes`` processes incrementing one key concurrently and checks no
+increment was lost.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask  # noqa: E402
+from flask_limiter import Limiter  # noqa: E402
+from flask_limiter.util import get_remote_address  # noqa: E402
+
+from ratelimit_store import SQLiteStorage  # noqa: E402
+
+
+def make_app(storage_uri):
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        return "ok"
+
+    if storage_uri:
+        Limiter(app=app, key_func=get_remote_address, storage_uri=storage_uri,
+                default_limits=["1000000 per day", "1000000 per hour"])
+    return app
+
+
+def per_request_us(storage_uri, n: int) -> float:
+    client = make_app(storage_uri).test_client()
+    for _ in range(100):
+        client.get("/")
+    started = time.perf_counter()
+    for _ in range(n):
+        client.get("/")
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def _hammer(uri: str, n: int) -> None:
+    storage = SQLiteStorage(uri)
+    for _ in range(n):
+        storage.incr("shared", 3600)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--processes", type=int, default=2)
+    p.add_argument("--increments", type=int, default=5000, help="per process")
+    args = p.parse_args()
+
+    uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "ratelimit.db")
+    base = per_request_us(None, args.requests)
+    print(f"{'no limiter':>12}: {base:8.1f} us/request")
+    for name, storage_uri in (("memory://", "memory://"), ("sqlite://", uri)):
+        us = per_request_us(storage_uri, args.requests)
+        print(f"{name:>12}: {us:8.1f} us/request (+{us - base:.1f} us limiter)")
+
+    SQLiteStorage(uri).clear("shared")
+    procs = [multiprocessing.Process(target=_hammer, args=(uri, args.increments)) for _ in range(args.processes)]
+    started = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+    total = SQLiteStorage(uri).get("shared")
+    expected = args.processes * args.increments
+    print(f"{args.processes} processes x {args.increments} increments: counter={total} "
+          f"(expected {expected}), {expected / elapsed:,.0f} incr/s")
+    if total != expected:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Scan wall time against the fake Instagram: sequential vs concurrent walks.
+
+    python bench/bench_scan.py --followers 3000 --following 3000 --latency 0.05
+
+Runs ``collect_friendships`` for a cold scan (no snapshot) both ways, with
+SCAN_PAGE_DELAY=0 so only upstream latency counts. ``--throttle-every N``
+makes the stub answer every Nth request with 429 to exercise Retry-After;
+only the concurrent walk honours it, so the sequential run is skipped then.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_instagram import ME_PK, serve  # noqa: E402
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--followers", type=int, default=3000)
+    p.add_argument("--following", type=int, default=3000)
+    p.add_argument("--latency", type=float, default=0.05)
+    p.add_argument("--page-size", type=int, default=100)
+    p.add_argument("--throttle-every", type=int, default=0)
+    p.add_argument("--retry-after", type=float, default=1.0)
+    args = p.parse_args()
+
+    server, fake = serve(
+        followers=args.followers, following=args.following, latency=args.latency,
+        throttle_every=args.throttle_every, retry_after=args.retry_after,
+    )
+    os.environ.update({
+        "INSTAGRAM_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}",
+        "SCAN_PAGE_DELAY": "0",
+        "SCAN_PAGE_SIZE": str(args.page_size),
+        "DB_PATH": os.path.join(tempfile.mkdtemp(), "bench.db"),
+    })
+    import app  # noqa: E402  (reads the environment at import)
+
+    results = {}
+    for concurrent in (True,) if args.throttle_every else (False, True):
+        fake.requests = fake.max_in_flight = 0
+        started = time.perf_counter()
+        diff, _, stats = app.collect_friendships("bench-session", str(ME_PK), None, None, concurrent=concurrent)
+        elapsed = time.perf_counter() - started
+        results[concurrent] = elapsed
+        print(
+            f"{'concurrent' if concurrent else 'sequential':>10}: {elapsed:7.2f}s  "
+            f"pages={stats['pages']} requests={fake.requests} max_in_flight={fake.max_in_flight} "
+            f"non_followers={len(diff)}"
+        )
+    if False in results:
+        print(f"speedup: {results[False] / results[True]:.2f}x")
+    print(f"engine: {app.fetch_engine.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
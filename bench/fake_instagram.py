@@ -0,0 +1,204 @@
+"""Local stand-in for the Instagram endpoints the app talks to.
+
+Serves synthetic ``current_user``, ``web_profile_info``, paginated
+``friendships/<id>/followers|following`` and ``friendships/destroy`` so the
+app can run fully offline. Point the app at it with::
+
+    python bench/fake_instagram.py --port 8001 --followers 5000 --following 6000
+    INSTAGRAM_BASE_URL=http://127.0.0.1:8001 SCAN_PAGE_DELAY=0 python app.py
+
+Following IDs overlap the tail of the follower range by ``--overlap``, so
+``following - overlap`` accounts do not follow back.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ME_PK = 42
+
+
+class FakeInstagram:
+    def __init__(
+        self,
+        followers: int = 1000,
+        following: int = 1200,
+        overlap: int = None,
+        latency: float = 0.0,
+        max_page_size: int = 200,
+        fail_every: int = 0,
+        throttle_every: int = 0,
+        retry_after: float = 1.0,
+    ):
+        self.followers = followers
+        self.following = following
+        self.overlap = min(followers, following) if overlap is None else overlap
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.fail_every = fail_every
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def ids(self, kind: str) -> range:
+        """Newest first, like Instagram: the list is served in reverse ID order."""
+        if kind == "followers":
+            return range(self.followers, 0, -1)
+        start = self.followers - self.overlap + 1
+        return range(start + self.following - 1, start - 1, -1)
+
+    @staticmethod
+    def user(pk: int) -> dict:
+        return {
+            "pk": pk,
+            "username": f"user{pk}",
+            "full_name": f"User {pk}",
+            "is_private": pk % 7 == 0,
+            "is_verified": pk % 97 == 0,
+            "profile_pic_url": f"https://example.invalid/p/{pk}.jpg",
+        }
+
+    def page(self, kind: str, max_id: str, count: int) -> dict:
+        ids = self.ids(kind)
+        offset = int(max_id) if max_id else 0
+        count = max(1, min(count, self.max_page_size))
+        chunk = ids[offset:offset + count]
+        body = {"users": [self.user(pk) for pk in chunk], "status": "ok"}
+        if offset + count < len(ids):
+            body["next_max_id"] = str(offset + count)
+            body["big_list"] = True
+        return body
+
+    def tick(self) -> int:
+        """Count a request; returns the status it should get (200, 429 or 500)."""
+        with self._lock:
+            self.requests += 1
+            n = self.requests
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if self.throttle_every and n % self.throttle_every == 0:
+            return 429
+        if self.fail_every and n % self.fail_every == 0:
+            return 500
+        return 200
+
+
+def make_handler(fake: FakeInstagram):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict = None) -> None:
+            raw = json.dumps(body).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def _route(self) -> None:
+            url = urlparse(self.path)
+            qs = parse_qs(url.query)
+            parts = [p for p in url.path.split("/") if p]
+            if "sessionid=" not in self.headers.get("Cookie", ""):
+                return self._send(401, {"status": "fail", "message": "login_required"})
+            status = fake.tick()
+            if status == 429:
+                return self._send(429, {"status": "fail", "message": "Please wait a few minutes"},
+                                  {"Retry-After": f"{fake.retry_after:g}"})
+            if status != 200:
+                return self._send(500, {"status": "fail", "message": "injected failure"})
+
+            if url.path.startswith("/api/v1/accounts/current_user"):
+                return self._send(200, {"user": {"pk": ME_PK, "username": "fake_user"}})
+            if url.path.startswith("/api/v1/users/web_profile_info"):
+                username = (qs.get("username") or [""])[0]
+                if username == "fake_user":
+                    return self._send(200, {"data": {"user": {
+                        "id": str(ME_PK), "username": username,
+                        "edge_followed_by": {"count": fake.followers},
+                        "edge_follow": {"count": fake.following},
+                    }}, "status": "ok"})
+                if not username.startswith("user"):
+                    return self._send(404, {"status": "fail"})
+                pk = int(username[4:] or 0)
+                body = FakeInstagram.user(pk)
+                body["id"] = str(pk)
+                body["edge_followed_by"] = {"count": pk * 3}
+                return self._send(200, {"data": {"user": body}, "status": "ok"})
+            if parts[:3] == ["api", "v1", "friendships"] and len(parts) >= 5:
+                if parts[3] == "destroy" and self.command == "POST":
+                    return self._send(200, {"status": "ok", "friendship_status": {"following": False}})
+                if parts[4] in ("followers", "following"):
+                    max_id = (qs.get("max_id") or [""])[0]
+                    count = int((qs.get("count") or ["50"])[0])
+                    return self._send(200, fake.page(parts[4], max_id, count))
+            return self._send(404, {"status": "fail", "message": "not found"})
+
+        def do_GET(self):
+            self._route()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                self.rfile.read(length)
+            self._route()
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, **config):
+    """Start the stub on a background thread; returns ``(server, fake)``.
+
+    ``server.server_address`` has the bound port when ``port=0``.
+    """
+    fake = FakeInstagram(**config)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8001)
+    p.add_argument("--followers", type=int, default=1000)
+    p.add_argument("--following", type=int, default=1200)
+    p.add_argument("--overlap", type=int, default=None)
+    p.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    p.add_argument("--fail-every", type=int, default=0, help="fail every Nth request with HTTP 500")
+    p.add_argument("--throttle-every", type=int, default=0, help="answer every Nth request with HTTP 429")
+    p.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    args = p.parse_args()
+
+    fake = FakeInstagram(
+        followers=args.followers, following=args.following, overlap=args.overlap,
+        latency=args.latency, fail_every=args.fail_every,
+        throttle_every=args.throttle_every, retry_after=args.retry_after,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"fake instagram on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""HTTP load test, micro-benchmarks and cold-start timings for the app, fully offline.
+
+    python bench/run_bench.py --concurrency 1 4 16 --requests 400 --save bench/results.json
+    python bench/run_bench.py --compare bench/results.json --tolerance 0.25
+
+The app runs in-process on a threaded WSGI server against a temporary
+database, with bench/fake_instagram.py standing in for Instagram
+(``--latency`` seconds per upstream call). Rate limiting and CSRF are
+switched off so they do not cap the numbers. Each HTTP scenario is run
+once per concurrency level with one keep-alive client per thread.
+
+``--startup`` fresh interpreters each time ``import app``, ``create_app()``,
+the first request (``GET /``) and the first login, which is the first
+request that needs ``requests``, against the already migrated database.
+
+Every result reports p50/p95/p99 latency (ms) and throughput (req/s).
+``--compare`` exits 1 when any p95 shared with the baseline grew by more
+than ``--tolerance``, or any throughput dropped by more than it.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from itertools import count
+from typing import Callable, Dict, List
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_instagram import serve as serve_fake  # noqa: E402
+
+ADMIN_KEY = "bench-admin-key-0123456789"
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    s = sorted(samples)
+
+    def rank(p: float) -> float:  # nearest-rank
+        return s[max(0, math.ceil(p / 100 * len(s)) - 1)]
+
+    return {"p50_ms": rank(50) * 1e3, "p95_ms": rank(95) * 1e3, "p99_ms": rank(99) * 1e3}
+
+
+def summarize(samples: List[float], wall: float, errors: int = 0) -> Dict[str, float]:
+    out = {k: round(v, 3) for k, v in percentiles(samples).items()}
+    out.update({"n": len(samples), "errors": errors, "throughput_rps": round(len(samples) / wall, 1)})
+    return out
+
+
+class Harness:
+    """App + fake upstream on local ports, plus fixtures for the scenarios."""
+
+    def __init__(self, latency: float):
+        self.fake_server, self.fake = serve_fake(followers=500, following=500, latency=latency)
+        tmp = tempfile.mkdtemp(prefix="bench-")
+        os.environ.update({
+            "DB_PATH": os.path.join(tmp, "app.db"),
+            "INSTAGRAM_BASE_URL": f"http://127.0.0.1:{self.fake_server.server_address[1]}",
+            "ADMIN_GRANT_KEY": ADMIN_KEY,
+            "RATELIMIT_STORAGE_URI": "memory://",
+            "METRICS_DIR": "",
+            "JOB_WORKERS": "0",
+        })
+        logging.disable(logging.WARNING)
+        import app  # noqa: E402  (reads the environment at import)
+        from werkzeug.serving import make_server
+
+        self.app = app
+        app.create_app()
+        app.app.config["WTF_CSRF_ENABLED"] = False
+        app.limiter.enabled = False
+        self.server = make_server("127.0.0.1", 0, app.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._txids = count()
+        self.session_id = self.login(requests.Session())
+        self.user_id = app.get_user_by_session(self.session_id)["id"]
+
+    def login(self, http: requests.Session) -> str:
+        r = http.post(f"{self.base}/login", json={"cookies": "bench-sessionid-0001"})
+        r.raise_for_status()
+        return r.json()["session_id"]
+
+    def txid(self) -> str:
+        return f"benchtx{next(self._txids):040d}"
+
+    def pending_txids(self, n: int) -> List[str]:
+        txids = [self.txid() for _ in range(n)]
+        ts = self.app.now_iso()
+        with self.app.db() as conn:
+            conn.cursor().executemany("""
+                INSERT INTO payment_requests(session_id, user_id, plan, txid, status, created_at, updated_at)
+                VALUES(?,?,?,?,?,?,?)
+            """, [(self.session_id, self.user_id, "starter", t, "pending", ts, ts) for t in txids])
+            conn.commit()
+        return txids
+
+    def scenarios(self, n: int) -> Dict[str, Callable[[], Callable[[requests.Session], requests.Response]]]:
+        """name -> factory of a per-run request function (fixtures made per run)."""
+        base, sid = self.base, self.session_id
+        auth = {"X-Session-ID": sid}
+
+        def approve():
+            txids = iter(self.pending_txids(n))
+            return lambda http: http.post(f"{base}/api/admin/approve-txid", json={"txid": next(txids)},
+                                          headers={"X-Admin-Key": ADMIN_KEY})
+
+        return {
+            "index": lambda: lambda http: http.get(f"{base}/"),
+            "login": lambda: lambda http: http.post(f"{base}/login", json={"cookies": "bench-sessionid-0001"}),
+            "api_me": lambda: lambda http: http.get(f"{base}/api/me", headers=auth),
+            "submit_txid": lambda: lambda http: http.post(
+                f"{base}/api/payment/submit-txid", json={"plan": "starter", "txid": self.txid()}, headers=auth),
+            "my_requests": lambda: lambda http: http.get(f"{base}/api/payment/my-requests", headers=auth),
+            "admin_approve_txid": approve,
+        }
+
+    def run_http(self, call: Callable[[requests.Session], requests.Response], n: int, concurrency: int):
+        latencies: List[float] = []
+        errors = [0]
+        lock = threading.Lock()
+        per_thread = [n // concurrency + (1 if i < n % concurrency else 0) for i in range(concurrency)]
+        start = threading.Barrier(concurrency + 1)
+
+        def worker(k: int) -> None:
+            http = requests.Session()
+            call(http)  # warm the keep-alive connection
+            mine, bad = [], 0
+            start.wait()
+            for _ in range(k):
+                t0 = time.perf_counter()
+                r = call(http)
+                mine.append(time.perf_counter() - t0)
+                bad += r.status_code >= 400
+            with lock:
+                latencies.extend(mine)
+                errors[0] += bad
+
+        threads = [threading.Thread(target=worker, args=(k,)) for k in per_thread]
+        for t in threads:
+            t.start()
+        start.wait()
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        return summarize(latencies, time.perf_counter() - t0, errors[0])
+
+    def micro(self, n: int) -> Dict[str, Dict[str, float]]:
+        app, sid = self.app, self.session_id
+        results = {}
+
+        def timed(fn: Callable[[int], None], reps: int) -> Dict[str, float]:
+            samples = []
+            t0 = time.perf_counter()
+            for i in range(reps):
+                s = time.perf_counter()
+                fn(i)
+                samples.append(time.perf_counter() - s)
+            return summarize(samples, time.perf_counter() - t0)
+
+        with app.db() as conn:
+            conn.execute("UPDATE users SET credits = ?, plan = 'free' WHERE id = ?", (10 ** 9, self.user_id))
+            conn.commit()
+        results["spend_credit"] = timed(lambda i: app.spend_credit(self.user_id, str(i), -1), n)
+        results["get_user_by_session"] = timed(lambda i: app.get_user_by_session(sid), n)
+        results["init_db_noop"] = timed(lambda i: app.init_db(), max(10, n // 10))
+
+        fresh = tempfile.mkdtemp(prefix="bench-initdb-")
+        results["init_db_fresh"] = timed(
+            lambda i: app.migrations.upgrade(os.path.join(fresh, f"{i}.db")), max(5, n // 50))
+        return results
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.fake_server.shutdown()
+
+
+# Runs in a fresh interpreter; prints seconds per phase as JSON.
+STARTUP_PROBE = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+app.app.config["WTF_CSRF_ENABLED"] = False
+app.limiter.enabled = False
+client = app.app.test_client()
+t3 = time.perf_counter()
+assert client.get("/").status_code == 200
+t4 = time.perf_counter()
+assert client.post("/login", json={"cookies": "bench-sessionid-0001"}).status_code == 200
+t5 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "create_app": t2 - t1, "first_request": t4 - t3, "first_login": t5 - t4}))
+"""
+
+
+def startup(runs: int) -> Dict[str, Dict[str, float]]:
+    """Cold-start phases over ``runs`` fresh interpreters (uses the harness environment)."""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    samples: Dict[str, List[float]] = {}
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", STARTUP_PROBE, root], env=dict(os.environ, LOG_LEVEL="ERROR"),
+                             capture_output=True, text=True, check=True).stdout
+        for phase, seconds in json.loads(out.strip().splitlines()[-1]).items():
+            samples.setdefault(phase, []).append(seconds)
+    wall = time.perf_counter() - t0
+    return {phase: summarize(s, wall) for phase, s in samples.items()}
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    problems = []
+    for key, base in baseline.get("results", {}).items():
+        cur = current["results"].get(key)
+        if not cur:
+            continue
+        if cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{key}: p95 {base['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms")
+        if cur["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            problems.append(f"{key}: throughput {base['throughput_rps']} -> {cur['throughput_rps']} req/s")
+    return problems
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    p.add_argument("--requests", type=int, default=400, help="requests per scenario and concurrency level")
+    p.add_argument("--micro", type=int, default=2000, help="iterations per micro-benchmark")
+    p.add_argument("--latency", type=float, default=0.02, help="fake Instagram latency (s)")
+    p.add_argument("--only", nargs="*", help="run only these scenarios (plus micro unless --no-micro)")
+    p.add_argument("--no-micro", action="store_true")
+    p.add_argument("--startup", type=int, default=5, help="cold starts to time (0 skips)")
+    p.add_argument("--save", help="write results JSON here")
+    p.add_argument("--compare", help="baseline JSON; exit 1 on regression")
+    p.add_argument("--tolerance", type=float, default=0.25)
+    args = p.parse_args()
+
+    h = Harness(args.latency)
+    out = {
+        "meta": {
+            "time": datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": {},
+    }
+    try:
+        for name, factory in h.scenarios(args.requests * 2).items():
+            if args.only and name not in args.only:
+                continue
+            for c in args.concurrency:
+                res = h.run_http(factory(), args.requests, c)
+                out["results"][f"http:{name}:c{c}"] = res
+                print(f"{name:>20} c={c:<3} p50={res['p50_ms']:8.2f}ms p95={res['p95_ms']:8.2f}ms "
+                      f"p99={res['p99_ms']:8.2f}ms {res['throughput_rps']:8.1f} req/s errors={res['errors']}")
+        if not args.no_micro:
+            for name, res in h.micro(args.micro).items():
+                out["results"][f"micro:{name}"] = res
+                print(f"{name:>20}       p50={res['p50_ms']:8.3f}ms p95={res['p95_ms']:8.3f}ms "
+                      f"p99={res['p99_ms']:8.3f}ms {res['throughput_rps']:8.1f} ops/s")
+        if args.startup:
+            for name, res in startup(args.startup).items():
+                out["results"][f"startup:{name}"] = res
+                print(f"{name:>20}       p50={res['p50_ms']:8.2f}ms p95={res['p95_ms']:8.2f}ms "
+                      f"p99={res['p99_ms']:8.2f}ms")
+    finally:
+        h.close()
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump(out, fh, indent=2)
+        print(f"saved {args.save}")
+    if args.compare:
+        with open(args.compare) as fh:
+            problems = compare(out, json.load(fh), args.tolerance)
+        for line in problems:
+            print(f"REGRESSION {line}")
+        if problems:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
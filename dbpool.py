@@ -0,0 +1,219 @@
+"""Bounded SQLite connection pool.
+
+Connections are opened lazily up to ``max_size`` and handed back and forth
+between gunicorn threads. Each one is configured once with WAL journaling
+and the tuned pragmas, and keeps its own prepared-statement cache, so a
+request reuses compiled statements from earlier requests.
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+
+def is_busy_error(exc: BaseException) -> bool:
+    msg = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def query_label(sql: str) -> str:
+    """Low-cardinality name for a statement: ``"select users"``, ``"begin"``."""
+    words = sql.split(None, 1)
+    verb = words[0].lower() if words else "?"
+    m = _TABLE_RE.search(sql)
+    return f"{verb} {m.group(1)}" if m else verb
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.connection.on_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.connection.on_query(sql, time.perf_counter() - started)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection whose cursors report ``(sql, seconds)`` to ``on_query``."""
+
+    on_query: Callable[[str, float], None]
+
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    # The built-in shortcuts run on a plain cursor internally; route them
+    # through ours so they are timed too.
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        db_path: str,
+        max_size: int = 8,
+        timeout: float = 10.0,
+        cache_size_kib: int = 8192,
+        mmap_size: int = 64 * 1024 * 1024,
+        cached_statements: int = 256,
+        on_query: Optional[Callable[[str, float], None]] = None,
+    ):
+        self.db_path = db_path
+        self.max_size = max(1, int(max_size))
+        self.timeout = float(timeout)
+        self.cache_size_kib = int(cache_size_kib)
+        self.mmap_size = int(mmap_size)
+        self.cached_statements = int(cached_statements)
+        self.on_query = on_query
+
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._opened = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._busy_errors = 0
+        self._timeouts = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=_TimedConnection if self.on_query else sqlite3.Connection,
+        )
+        if self.on_query:
+            conn.on_query = self.on_query
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kib}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Forked after connections were opened: never share them with the parent.
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+        with self._lock:
+            self._checkouts += 1
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.max_size:
+                self._opened += 1
+                grow = True
+            else:
+                grow = False
+        if grow:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"no SQLite connection free after {self.timeout}s")
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._waits += 1
+            self._wait_seconds += waited
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        finally:
+            with self._lock:
+                self._opened -= 1
+
+    def record_busy(self) -> None:
+        with self._lock:
+            self._busy_errors += 1
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except sqlite3.OperationalError as e:
+            if is_busy_error(e):
+                self.record_busy()
+            self.release(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_size": self.max_size,
+                "opened": self._opened,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 6),
+                "busy_errors": self._busy_errors,
+                "pool_timeouts": self._timeouts,
+            }
+
+    def close_all(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
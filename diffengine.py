@@ -0,0 +1,150 @@
+"""Compact "following but not following back" computation.
+
+Follower and following IDs are kept as sorted ``array('q')`` (8 bytes per
+account) instead of lists of dicts. The diff is built after the walks have
+finished (they run concurrently and are checkpointed, see ScanState):
+followers are sealed into a sorted array and each following account is
+checked against it with ``bisect``. Profile metadata is kept for every
+followed account because the snapshot stores it for the next incremental
+scan; Instagram caps the following list at 7,500 so that stays small.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import groupby
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def sorted_ids(ids: Iterable[int]) -> array:
+    """Build a sorted, de-duplicated int64 array."""
+    return array("q", (pk for pk, _ in groupby(sorted(array("q", ids)))))
+
+
+def pack_ids(ids: array) -> bytes:
+    """Sorted int64 array -> BLOB (native byte order)."""
+    return ids.tobytes()
+
+
+def unpack_ids(blob: bytes) -> array:
+    ids = array("q")
+    if blob:
+        ids.frombytes(blob)
+    return ids
+
+
+def contains(ids: array, pk: int) -> bool:
+    i = bisect_left(ids, pk)
+    return i < len(ids) and ids[i] == pk
+
+
+def remove(ids: array, pk: int) -> bool:
+    """Delete ``pk`` from a sorted array in place; returns whether it was there."""
+    i = bisect_left(ids, pk)
+    if i < len(ids) and ids[i] == pk:
+        del ids[i]
+        return True
+    return False
+
+
+def difference(a: array, b: array) -> array:
+    """Sorted ``a - b`` for two sorted arrays (linear merge walk)."""
+    out = array("q")
+    j, nb = 0, len(b)
+    for pk in a:
+        while j < nb and b[j] < pk:
+            j += 1
+        if j >= nb or b[j] != pk:
+            out.append(pk)
+    return out
+
+
+class UserRecord:
+    __slots__ = ("pk", "username", "full_name", "is_private", "is_verified", "profile_pic_url")
+
+    def __init__(self, pk, username=None, full_name=None, is_private=False,
+                 is_verified=False, profile_pic_url=None):
+        self.pk = int(pk)
+        self.username = username
+        self.full_name = full_name
+        self.is_private = bool(is_private)
+        self.is_verified = bool(is_verified)
+        self.profile_pic_url = profile_pic_url
+
+    @classmethod
+    def from_api(cls, u: Dict[str, Any]) -> "UserRecord":
+        return cls(
+            u["pk"], u.get("username"), u.get("full_name"),
+            u.get("is_private"), u.get("is_verified"), u.get("profile_pic_url"),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class NonFollowerDiff:
+    """Compute non-followers from collected friendship lists.
+
+    Feed every follower page to ``add_followers``, call ``seal_followers``,
+    then feed following pages to ``add_following`` and call ``finish``.
+    A finished diff is shared between requests: ``page`` and ``discard``
+    hold ``_lock`` so a reader never sees ``order`` and ``records`` out of step.
+    """
+
+    def __init__(self):
+        self._followers_raw = array("q")
+        self.followers: Optional[array] = None
+        self._following_raw = array("q")
+        self.following: Optional[array] = None
+        self.records: Dict[int, UserRecord] = {}
+        self.order = array("q")  # non-follower pks, sorted for display
+        self._lock = threading.Lock()
+
+    def add_followers(self, users: Iterable[Dict[str, Any]]) -> None:
+        self._followers_raw.extend(int(u["pk"]) for u in users)
+
+    def add_follower_ids(self, ids: Iterable[int]) -> None:
+        self._followers_raw.extend(ids)
+
+    def seal_followers(self) -> None:
+        self.followers = sorted_ids(self._followers_raw)
+        self._followers_raw = array("q")
+
+    def add_following(self, users: Iterable[Dict[str, Any]]) -> None:
+        if self.followers is None:
+            raise RuntimeError("seal_followers() must be called before add_following()")
+        records = self.records
+        append = self._following_raw.append
+        for u in users:
+            pk = int(u["pk"])
+            append(pk)
+            if pk not in records:
+                records[pk] = UserRecord.from_api(u)
+
+    def finish(self) -> "NonFollowerDiff":
+        self.following = sorted_ids(self._following_raw)
+        self._following_raw = array("q")
+        followers = self.followers
+        ranked = sorted(
+            (r for r in self.records.values() if not contains(followers, r.pk)),
+            key=lambda r: ((r.username or "").lower(), r.pk),
+        )
+        self.order = array("q", (r.pk for r in ranked))
+        return self
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def page(self, offset: int = 0, limit: int = 50) -> List[Dict[str, Any]]:
+        offset = max(0, int(offset))
+        limit = max(0, int(limit))
+        with self._lock:
+            return [self.records[pk].to_dict() for pk in self.order[offset:offset + limit]]
+
+    def discard(self, pk: int) -> None:
+        """Drop an account we no longer follow (e.g. after it was unfollowed)."""
+        pk = int(pk)
+        with self._lock:
+            if self.following is not None:
+                remove(self.following, pk)
+            if self.records.pop(pk, None) is not None:
+                self.order = array("q", (x for x in self.order if x != pk))
@@ -0,0 +1,231 @@
+"""Per-session event fan-out for the Server-Sent Events endpoint.
+
+``publish(channel, event, data)`` delivers to subscribers in this process
+immediately and appends a row to the ``events`` table for the other
+workers. Each process that has subscribers runs one poller thread. The
+poller reads ``PRAGMA data_version``, which changes only when another
+connection commits, so an idle tick costs no table read. New rows from
+other processes are then fetched by id. Rows older than ``keep_seconds``
+are pruned.
+
+Subscriptions are capped per process (``max_subscribers``) because every
+open stream holds a server thread. A new subscription to a channel that
+is already at ``max_per_channel`` closes the oldest one, so a reloaded
+tab does not leak a stream.
+
+The bus is fork-aware: gunicorn ``--preload`` builds it in the master, so
+a worker that finds itself in a new process picks a fresh ``origin``
+(otherwise every worker would skip the others' rows as its own) and
+drops the subscribers and poller it inherited.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CLOSED = ("", None)  # wakes a waiting subscriber up on close
+_fork_lock = threading.Lock()
+
+
+class Subscription:
+    def __init__(self, bus: "EventBus", channel: str, maxsize: int = 100):
+        self.bus = bus
+        self.channel = channel
+        self.closed = False
+        self._queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize)
+
+    def deliver(self, event: str, data: Any) -> None:
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            self.bus._dropped += 1  # slow client; later events carry the current state anyway
+
+    def get(self, timeout: float) -> Optional[Tuple[str, Any]]:
+        """Next ``(event, data)``, or None on timeout or once closed."""
+        try:
+            item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        return None if item is _CLOSED else item
+
+    def _wake(self) -> None:
+        self.closed = True
+        try:
+            self._queue.put_nowait(_CLOSED)
+        except queue.Full:
+            pass
+
+    def close(self) -> None:
+        if not self.closed:
+            self.bus._unsubscribe(self)
+            self._wake()
+
+
+class EventBus:
+    def __init__(
+        self,
+        path: str,
+        poll_interval: float = 0.5,
+        keep_seconds: float = 120.0,
+        max_subscribers: int = 2,
+        max_per_channel: int = 1,
+        prune_every: int = 500,
+    ):
+        self.path = path
+        self.poll_interval = float(poll_interval)
+        self.keep_seconds = float(keep_seconds)
+        self.max_subscribers = max(0, int(max_subscribers))
+        self.max_per_channel = max(1, int(max_per_channel))
+        self.prune_every = max(1, int(prune_every))
+        self.origin = uuid.uuid4().hex[:12]
+        self._origin_pid = os.getpid()
+        self._subs: Dict[str, List[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._published = 0
+        self._delivered_remote = 0
+        self._rejected = 0
+        self._dropped = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # One autocommit connection per thread, reopened after a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _check_fork(self) -> None:
+        if self._origin_pid == os.getpid():
+            return
+        with _fork_lock:
+            if self._origin_pid != os.getpid():
+                self._lock = threading.Lock()
+                self._subs = {}
+                self._thread = None
+                self._pid = None
+                self.origin = uuid.uuid4().hex[:12]
+                self._origin_pid = os.getpid()
+
+    # -- publishing ----------------------------------------------------
+
+    def publish(self, channel: str, event: str, data: Any) -> None:
+        self._check_fork()
+        self._deliver(channel, event, data)
+        now = time.time()
+        try:
+            self._conn().execute(
+                "INSERT INTO events(channel, event, data, origin, created_at) VALUES(?,?,?,?,?)",
+                (channel, event, json.dumps(data, separators=(",", ":")), self.origin, now),
+            )
+            with self._lock:
+                self._published += 1
+                prune = self._published % self.prune_every == 0
+            if prune:
+                self.prune(now)
+        except sqlite3.Error as e:
+            logger.warning("Events: could not publish %s: %s", event, e)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        cutoff = (now or time.time()) - self.keep_seconds
+        return self._conn().execute("DELETE FROM events WHERE created_at < ?", (cutoff,)).rowcount
+
+    def _deliver(self, channel: str, event: str, data: Any) -> None:
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            sub.deliver(event, data)
+
+    # -- subscribing ---------------------------------------------------
+
+    def subscribe(self, channel: str) -> Optional[Subscription]:
+        """A new subscription, or None when this process is at ``max_subscribers``."""
+        self._check_fork()
+        with self._lock:
+            subs = self._subs.setdefault(channel, [])
+            replaced = subs[:max(0, len(subs) - self.max_per_channel + 1)]
+            if sum(len(s) for s in self._subs.values()) - len(replaced) >= self.max_subscribers:
+                self._rejected += 1
+                if not subs:
+                    del self._subs[channel]
+                return None
+            del subs[:len(replaced)]
+            sub = Subscription(self, channel)
+            subs.append(sub)
+        for old in replaced:
+            old._wake()
+        self._ensure_poller()
+        return sub
+
+    def _unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subs.get(sub.channel)
+            if subs and sub in subs:
+                subs.remove(sub)
+                if not subs:
+                    del self._subs[sub.channel]
+
+    # -- cross-process delivery ----------------------------------------
+
+    def _ensure_poller(self) -> None:
+        self._check_fork()
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._poll_loop, name="event-poller", daemon=True)
+                self._thread.start()
+
+    def _poll_loop(self) -> None:
+        conn = self._conn()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        version = None
+        last_prune = time.monotonic()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                v = conn.execute("PRAGMA data_version").fetchone()[0]
+                if v == version:
+                    continue
+                version = v
+                with self._lock:
+                    idle = not self._subs
+                if idle:
+                    # Nobody to deliver to, but keep last_id current: the next
+                    # subscriber must not be replayed what was published meanwhile.
+                    last_id = conn.execute("SELECT COALESCE(MAX(id), ?) FROM events", (last_id,)).fetchone()[0]
+                    continue
+                for id_, channel, event, data, origin in conn.execute(
+                    "SELECT id, channel, event, data, origin FROM events WHERE id > ? ORDER BY id", (last_id,)
+                ).fetchall():
+                    last_id = id_
+                    if origin != self.origin:  # our own events were delivered on publish
+                        self._deliver(channel, event, json.loads(data))
+                        self._delivered_remote += 1
+                if time.monotonic() - last_prune > self.keep_seconds:
+                    last_prune = time.monotonic()
+                    self.prune()
+            except sqlite3.Error as e:
+                logger.warning("Events: poll failed: %s", e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "subscribers": sum(len(s) for s in self._subs.values()),
+                "max_subscribers": self.max_subscribers,
+                "published": self._published,
+                "delivered_remote": self._delivered_remote,
+                "rejected": self._rejected,
+                "dropped": self._dropped,
+            }
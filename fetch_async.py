@@ -0,0 +1,145 @@
+"""asyncio fetch engine for upstream pagination.
+
+Several cursor walks (e.g. the follower and the following list) can run at
+the same time instead of one after the other. The actual HTTP calls stay
+on the blocking, keep-alive client and run on a shared thread pool: its
+size is the global concurrency cap. Each run also has a per-account cap.
+An HTTP 429 blocks further calls for that account, in every run, until
+its ``Retry-After`` has passed.
+
+``run_sync`` lets Flask views and job handlers (which have no event loop)
+drive it.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+# fetch(url, sessionid) -> (status_code, retry_after_header, parsed_json_or_None)
+FetchFn = Callable[[str, str], Tuple[int, Optional[str], Optional[dict]]]
+
+
+def parse_retry_after(value: Optional[str], default: float) -> float:
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class AsyncFetchEngine:
+    def __init__(
+        self,
+        fetch: FetchFn,
+        global_limit: int = 8,
+        per_account_limit: int = 2,
+        max_retry_after: float = 60.0,
+        max_throttle_retries: int = 3,
+    ):
+        self._fetch = fetch
+        self.global_limit = max(1, int(global_limit))
+        self.per_account_limit = max(1, int(per_account_limit))
+        self.max_retry_after = float(max_retry_after)
+        self.max_throttle_retries = int(max_throttle_retries)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._blocked_until: Dict[str, float] = {}
+        self._counts = {"requests": 0, "throttled": 0, "throttle_wait_seconds": 0.0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # A pool inherited through a fork has no threads left.
+                self._executor = ThreadPoolExecutor(self.global_limit, thread_name_prefix="fetch")
+                self._pid = os.getpid()
+            return self._executor
+
+    def _throttle(self, account: str, delay: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            # Only 429s land here, so sweeping is cheap; it bounds the dict by
+            # the accounts blocked right now, not every account ever throttled.
+            for expired in [a for a, t in self._blocked_until.items() if t <= now]:
+                del self._blocked_until[expired]
+            until = now + min(delay, self.max_retry_after)
+            self._blocked_until[account] = max(self._blocked_until.get(account, 0.0), until)
+            self._counts["throttled"] += 1
+
+    async def _wait_unblocked(self, account: str) -> None:
+        while True:
+            with self._lock:
+                wait = self._blocked_until.get(account, 0.0) - time.monotonic()
+                if wait <= 0:
+                    self._blocked_until.pop(account, None)
+                    return
+            with self._lock:
+                self._counts["throttle_wait_seconds"] += wait
+            await asyncio.sleep(wait)
+
+    async def get_json(self, account: str, sem: asyncio.Semaphore, url: str, sessionid: str) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        for _ in range(self.max_throttle_retries + 1):
+            await self._wait_unblocked(account)
+            async with sem:
+                with self._lock:
+                    self._counts["requests"] += 1
+                status, retry_after, data = await loop.run_in_executor(
+                    self.executor, self._fetch, url, sessionid
+                )
+            if status != 429:
+                return data if status == 200 else None
+            self._throttle(account, parse_retry_after(retry_after, default=5.0))
+        return None
+
+    async def paginate(
+        self,
+        account: str,
+        sem: asyncio.Semaphore,
+        sessionid: str,
+        make_url: Callable[[Optional[str]], str],
+        next_cursor: Callable[[dict], Optional[str]],
+        cursor: Optional[str] = None,
+        delay: float = 0.0,
+    ) -> AsyncIterator[Tuple[Optional[str], Optional[dict]]]:
+        """Yield ``(cursor, data)`` per page; ``data`` is None when a page failed."""
+        first = True
+        while True:
+            if not first and delay > 0:
+                await asyncio.sleep(delay)
+            first = False
+            data = await self.get_json(account, sem, make_url(cursor), sessionid)
+            yield cursor, data
+            if data is None:
+                return
+            nxt = next_cursor(data)
+            if not nxt or nxt == cursor:
+                return
+            cursor = nxt
+
+    def account_semaphore(self) -> asyncio.Semaphore:
+        """Per-account cap for one run; create it inside the running loop."""
+        return asyncio.Semaphore(self.per_account_limit)
+
+    @staticmethod
+    def run_sync(coro) -> Any:
+        """Run a coroutine to completion from synchronous code."""
+        return asyncio.run(coro)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "global_limit": self.global_limit,
+                "per_account_limit": self.per_account_limit,
+                "blocked_accounts": sum(1 for t in self._blocked_until.values() if t > time.monotonic()),
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in self._counts.items()},
+            }
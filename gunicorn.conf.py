@@ -0,0 +1,21 @@
+"""Gunicorn settings, picked up automatically from the working directory."""
+import os
+
+
+def on_starting(server):
+    # Per-worker metric files from the previous run would be summed into this one.
+    from dotenv import load_dotenv
+    from metrics import MultiProcessCollector, Registry
+    load_dotenv()
+    db_dir = os.path.dirname(os.environ.get("DB_PATH", os.path.join("data", "app.db")))
+    directory = os.environ.get("METRICS_DIR", os.path.join(db_dir or ".", "metrics"))
+    if directory:
+        MultiProcessCollector(Registry(), directory).clear()
+
+
+def post_worker_init(worker):
+    # Background threads (job workers) must start inside each worker process.
+    # With --preload create_app() already ran in the master and this is a no-op.
+    import app
+    app.create_app()
+    app.start_background()
@@ -0,0 +1,423 @@
+"""SQLite-backed background job queue.
+
+Jobs live in the ``jobs`` table, so they outlive the process that created
+them. Worker threads claim one job at a time under a lease; a handler
+persists progress and a JSON checkpoint through ``Job.save``, which also
+renews the lease. If a worker dies, its lease expires and another worker
+picks the job up and resumes from the last checkpoint.
+
+Worker threads only claim kinds that have a ``handler``. Other kinds are
+claimed in batches with ``claim_many`` by an external runner (see
+scheduler.Dispatcher), which ends them with ``complete`` or ``fail``.
+
+Jobs belong to a user (``user_id``); ``session_id`` only records the token
+that queued them. Finished jobs are deleted ``keep_seconds`` after their
+last update; the sweep runs from a worker thread every ``prune_interval``.
+
+``on_change`` (optional) is called after every progress save and state
+change with ``{id, kind, user_id, status, progress, result, error}``.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobFailed(Exception):
+    """Raise from a handler to fail the job without retrying."""
+
+
+class JobLost(Exception):
+    """The lease expired and another worker took the job over."""
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _loads(raw: Optional[str]) -> Dict[str, Any]:
+    try:
+        return json.loads(raw) if raw else {}
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+
+class Job:
+    def __init__(self, queue: "JobQueue", row: sqlite3.Row):
+        self._queue = queue
+        self.id = int(row["id"])
+        self.kind = row["kind"]
+        self.user_id = row["user_id"]
+        self.session_id = row["session_id"]
+        self.lock = row["locked_by"]
+        self.attempts = int(row["attempts"])
+        self.payload = _loads(row["payload"])
+        self.checkpoint = _loads(row["checkpoint"])
+        self.progress = _loads(row["progress"])
+
+    def save(self, checkpoint: Optional[Dict[str, Any]] = None, **progress) -> None:
+        """Persist progress (and the checkpoint, if given); renews the lease."""
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        self.progress.update(progress)
+        self._queue._save(self, with_checkpoint=checkpoint is not None)
+
+
+class JobQueue:
+    def __init__(
+        self,
+        db: Callable[[], ContextManager[sqlite3.Connection]],
+        workers: int = 1,
+        poll_interval: float = 1.0,
+        lease_seconds: float = 300.0,
+        max_attempts: int = 5,
+        retry_delay: float = 30.0,
+        on_change: Optional[Callable[[Dict[str, Any]], None]] = None,
+        keep_seconds: float = 7 * 86400,
+        prune_interval: float = 3600,
+        prune_batch: int = 1000,
+    ):
+        self._db = db
+        self.workers = max(0, int(workers))
+        self.poll_interval = float(poll_interval)
+        self.lease_seconds = float(lease_seconds)
+        self.max_attempts = int(max_attempts)
+        self.retry_delay = float(retry_delay)
+        self.on_change = on_change
+        self.keep_seconds = float(keep_seconds)
+        self.prune_interval = float(prune_interval)
+        self.prune_batch = max(1, int(prune_batch))
+        self._next_prune = 0.0
+        self.handlers: Dict[str, Callable[[Job], Optional[Dict[str, Any]]]] = {}
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._counts = {"claimed": 0, "done": 0, "failed": 0, "retried": 0, "pruned": 0}
+
+    def handler(self, kind: str):
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    # ----- producer side -------------------------------------------------
+    def enqueue(self, kind: str, user_id: int, payload: Optional[Dict[str, Any]] = None,
+                session_id: Optional[str] = None) -> int:
+        ts = _now_iso()
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                INSERT INTO jobs(kind, user_id, session_id, status, payload, checkpoint, progress,
+                                 attempts, run_after, created_at, updated_at)
+                VALUES(?,?,?,?,?,?,?,?,?,?,?)
+            """, (kind, int(user_id), session_id, "queued", json.dumps(payload or {}), "{}", "{}", 0, 0, ts, ts))
+            conn.commit()
+            job_id = cur.lastrowid
+        self._wake.set()
+        return job_id
+
+    def find_active(self, kind: str, user_id: int) -> Optional[int]:
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id FROM jobs
+                WHERE user_id = ? AND kind = ? AND status IN ('queued', 'running')
+                ORDER BY id DESC
+                LIMIT 1
+            """, (int(user_id), kind))
+            row = cur.fetchone()
+        return int(row["id"]) if row else None
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, kind, user_id, status, progress, result, error, attempts,
+                       created_at, updated_at
+                FROM jobs WHERE id = ?
+            """, (int(job_id),))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["progress"] = _loads(job["progress"])
+        job["result"] = _loads(job["result"]) if job["result"] else None
+        return job
+
+    # ----- worker side ---------------------------------------------------
+    def claim(self) -> Optional[Job]:
+        """Claim the oldest runnable job of a kind that has a handler here.
+
+        Kinds without a handler (e.g. ones run by a ``Dispatcher``) are left
+        to whoever runs them.
+        """
+        kinds = list(self.handlers)
+        if not kinds:
+            return None
+        now = time.time()
+        lock = f"{self.worker_id}:{uuid.uuid4().hex[:8]}"
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE jobs
+                SET status = 'running', locked_by = ?, locked_until = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE ((status = 'queued' AND run_after <= ?)
+                        OR (status = 'running' AND locked_until < ?))
+                      AND kind IN ({",".join("?" * len(kinds))})
+                    ORDER BY id
+                    LIMIT 1
+                )
+                RETURNING *
+            """, (lock, now + self.lease_seconds, _now_iso(), now, now, *kinds))
+            row = cur.fetchone()
+            conn.commit()
+        if row is None:
+            return None
+        with self._lock:
+            self._counts["claimed"] += 1
+        return Job(self, row)
+
+    def claim_many(self, kind: str, limit: int, owner: str, per_user: bool = False) -> List[Job]:
+        """Claim up to ``limit`` runnable jobs of ``kind`` for ``owner`` in one statement.
+
+        With ``per_user``, a job is skipped while another owner holds a live
+        lease on a job of the same user, so one account's jobs stay with one
+        process.
+        """
+        now = time.time()
+        lock = f"{owner}:{uuid.uuid4().hex[:8]}"
+        grouped = """
+              AND NOT EXISTS (
+                  SELECT 1 FROM jobs r
+                  WHERE r.user_id = j.user_id AND r.kind = j.kind AND r.status = 'running'
+                    AND r.locked_until >= :now AND r.locked_by NOT LIKE :owner || ':%'
+              )""" if per_user else ""
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
+                UPDATE jobs
+                SET status = 'running', locked_by = :lock, locked_until = :until,
+                    attempts = attempts + 1, updated_at = :ts
+                WHERE id IN (
+                    SELECT j.id FROM jobs j
+                    WHERE j.kind = :kind
+                      AND ((j.status = 'queued' AND j.run_after <= :now)
+                        OR (j.status = 'running' AND j.locked_until < :now)){grouped}
+                    ORDER BY j.id
+                    LIMIT :limit
+                )
+                RETURNING *
+            """, {"lock": lock, "until": now + self.lease_seconds, "ts": _now_iso(), "kind": kind,
+                  "now": now, "owner": owner, "limit": max(0, int(limit))})
+            rows = cur.fetchall()
+            conn.commit()
+        with self._lock:
+            self._counts["claimed"] += len(rows)
+        return sorted((Job(self, row) for row in rows), key=lambda job: job.id)
+
+    def renew(self, jobs: List[Job]) -> List[int]:
+        """Extend the leases of ``jobs`` in one transaction; returns the ids that were lost."""
+        if not jobs:
+            return []
+        lost = []
+        until = time.time() + self.lease_seconds
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            for job in jobs:
+                cur.execute("""
+                    UPDATE jobs SET locked_until = ?
+                    WHERE id = ? AND locked_by = ? AND status = 'running'
+                """, (until, job.id, job.lock))
+                if cur.rowcount == 0:
+                    lost.append(job.id)
+            conn.commit()
+        return lost
+
+    def _save(self, job: Job, with_checkpoint: bool = True) -> None:
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE jobs
+                SET checkpoint = COALESCE(?, checkpoint), progress = ?,
+                    locked_until = ?, updated_at = ?
+                WHERE id = ? AND locked_by = ? AND status = 'running'
+            """, (
+                json.dumps(job.checkpoint) if with_checkpoint else None, json.dumps(job.progress),
+                time.time() + self.lease_seconds, _now_iso(), job.id, job.lock
+            ))
+            conn.commit()
+            if cur.rowcount == 0:
+                raise JobLost(f"job {job.id} lease lost")
+        self._changed(job, "running")
+
+    def _finish(self, job: Job, status: str, result=None, error: str = None, run_after: float = 0) -> bool:
+        """Move ``job`` to ``status``; False if the lease was lost meanwhile."""
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                UPDATE jobs
+                SET status = ?, result = ?, error = ?, progress = ?, run_after = ?,
+                    locked_by = NULL, locked_until = NULL, updated_at = ?
+                WHERE id = ? AND locked_by = ?
+            """, (
+                status, json.dumps(result) if result is not None else None, error,
+                json.dumps(job.progress), run_after, _now_iso(), job.id, job.lock
+            ))
+            conn.commit()
+            if cur.rowcount == 0:
+                logger.warning("Job %s: lease lost before it could be marked %s", job.id, status)
+                return False
+        self._changed(job, status, result, error)
+        return True
+
+    def _changed(self, job: Job, status: str, result=None, error: str = None) -> None:
+        if self.on_change is None:
+            return
+        try:
+            self.on_change({
+                "id": job.id, "kind": job.kind, "user_id": job.user_id, "status": status,
+                "progress": job.progress, "result": result, "error": error,
+            })
+        except Exception:
+            logger.exception("Job %s: on_change failed", job.id)
+
+    def complete(self, job: Job, result: Optional[Dict[str, Any]] = None) -> bool:
+        """Mark ``job`` done; False if the lease was lost and the row left alone."""
+        if not self._finish(job, "done", result=result or {}):
+            return False
+        with self._lock:
+            self._counts["done"] += 1
+        return True
+
+    def fail(self, job: Job, error: str) -> bool:
+        """Fail ``job`` without retrying; False if the lease was lost."""
+        if not self._finish(job, "failed", error=error):
+            return False
+        with self._lock:
+            self._counts["failed"] += 1
+        logger.error("Job %s (%s) failed: %s", job.id, job.kind, error)
+        return True
+
+    def run_one(self) -> bool:
+        """Claim and run a single job; returns False when the queue is empty."""
+        job = self.claim()
+        if job is None:
+            return False
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise JobFailed(f"no handler for job kind {job.kind!r}")
+            result = handler(job)
+        except JobLost:
+            logger.warning("Job %s: lease lost, dropping", job.id)
+            return True
+        except JobFailed as e:
+            self.fail(job, str(e))
+            return True
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                self._finish(job, "failed", error=str(e))
+                with self._lock:
+                    self._counts["failed"] += 1
+                logger.error("Job %s (%s) failed after %s attempts: %s", job.id, job.kind, job.attempts, e)
+            else:
+                delay = self.retry_delay * job.attempts
+                self._finish(job, "queued", error=str(e), run_after=time.time() + delay)
+                with self._lock:
+                    self._counts["retried"] += 1
+                logger.warning("Job %s (%s) will retry in %.0fs: %s", job.id, job.kind, delay, e)
+            return True
+
+        self.complete(job, result)
+        return True
+
+    def prune(self) -> int:
+        """Delete finished jobs older than ``keep_seconds`` in batches; returns how many."""
+        cutoff = datetime.utcfromtimestamp(time.time() - self.keep_seconds).isoformat() + "Z"
+        removed = 0
+        while True:
+            with self._db() as conn:
+                n = conn.execute("""
+                    DELETE FROM jobs WHERE id IN (
+                        SELECT id FROM jobs
+                        WHERE status IN ('done', 'failed') AND updated_at < ?
+                        LIMIT ?
+                    )
+                """, (cutoff, self.prune_batch)).rowcount
+                conn.commit()
+            removed += n
+            if n < self.prune_batch:
+                break
+        if removed:
+            with self._lock:
+                self._counts["pruned"] += removed
+            logger.info("Job queue: pruned %s finished job(s)", removed)
+        return removed
+
+    def _prune_due(self) -> bool:
+        if not self.keep_seconds or not self.prune_interval:
+            return False
+        with self._lock:  # one worker thread takes each sweep
+            now = time.monotonic()
+            if now < self._next_prune:
+                return False
+            self._next_prune = now + self.prune_interval
+            return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._prune_due():
+                    self.prune()
+                if self.run_one():
+                    continue
+            except Exception:
+                logger.exception("Job worker error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if any(t.is_alive() for t in self._threads) or not self.workers:
+            return  # threads inherited through a fork are not alive here
+        self._stop.clear()
+        self._threads = []
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        for i in range(self.workers):
+            t = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Job queue: started %s worker thread(s)", self.workers)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT status, COUNT(*) AS n FROM jobs
+                WHERE status IN ('queued', 'running')
+                GROUP BY status
+            """)
+            depth = {row["status"]: row["n"] for row in cur.fetchall()}
+        with self._lock:
+            counts = dict(self._counts)
+        return {"workers": len(self._threads), "queued": depth.get("queued", 0),
+                "running": depth.get("running", 0), **counts}
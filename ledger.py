@@ -0,0 +1,290 @@
+"""Append-only credit ledger (the ``actions`` table) with daily rollups.
+
+Raw rows are small: ``user_id``, an integer action code, the target and
+an epoch-second ``created_at``, indexed on ``(user_id, created_at)`` so a
+user's history is a range scan however large the table gets.
+
+``rollup`` folds raw rows past a watermark (``ledger_state.rollup_id``)
+into ``actions_daily`` (one row per user, UTC day and action). Usage
+queries read those rollups plus the few raw rows after the watermark.
+``archive`` moves raw rows older than ``retention_days`` that are already
+rolled up into gzip NDJSON files, ``actions-<first id>-<last id>.ndjson.gz``,
+and deletes them. Both run in batches, so several workers can run them
+at once. ``rollup`` folds each batch inside ``BEGIN IMMEDIATE``.
+``archive`` reads a batch and writes and fsyncs its file without the write
+lock. Its short write transaction then checks that the rows are all still
+there, renames the file into place and deletes the id range. Both rely on
+ids never being reused (``actions.id`` is AUTOINCREMENT), so every new row
+lands past the watermark and every archive file name is unique.
+"""
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Stored codes; the "compact actions ledger" migration maps the old strings the same way.
+ACTIONS = {"unfollow": 1, "refund": 2}
+ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+
+DAY = 86400
+# Raw rows may be committed slightly out of created_at order (timestamps are
+# taken before the write lock), so reads past the watermark look back this far.
+_SKEW = 300
+
+
+class ActionLedger:
+    def __init__(
+        self,
+        db: Callable[[], ContextManager[sqlite3.Connection]],
+        archive_dir: Optional[str] = None,
+        retention_days: int = 0,
+        interval: float = 300.0,
+        batch_size: int = 50000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._db = db
+        self.archive_dir = archive_dir
+        self.retention_days = max(0, int(retention_days))
+        self.interval = float(interval)
+        self.batch_size = max(1, int(batch_size))
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- writes --------------------------------------------------------
+
+    def record(self, cur: sqlite3.Cursor, user_id: int, action: str,
+               target_ids: Iterable[Any], delta: int, ts: Optional[int] = None) -> None:
+        """Append one row per target inside the caller's transaction."""
+        ts = int(self._clock()) if ts is None else int(ts)
+        code = ACTIONS[action]
+        cur.executemany(
+            "INSERT INTO actions(user_id, action, target_id, delta_credits, created_at) VALUES(?,?,?,?,?)",
+            [(int(user_id), code, str(t), int(delta), ts) for t in target_ids],
+        )
+
+    # -- reads ---------------------------------------------------------
+
+    @staticmethod
+    def _state(conn: sqlite3.Connection, key: str) -> int:
+        row = conn.execute("SELECT value FROM ledger_state WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def history(self, user_id: int, before: Optional[Tuple[int, int]] = None,
+                limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest raw rows first; pass the last row's ``(created_at, id)`` as ``before`` for the next page."""
+        sql = "SELECT id, action, target_id, delta_credits, created_at FROM actions WHERE user_id = ?"
+        params: List[Any] = [int(user_id)]
+        if before is not None:
+            sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params += [int(before[0]), int(before[0]), int(before[1])]
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(int(limit))
+        with self._db() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self._item(r) for r in rows]
+
+    def export(self, user_id: int, batch_size: int = 5000) -> Iterator[Dict[str, Any]]:
+        """Every raw row of ``user_id``, oldest first (archived rows are not included).
+
+        Read in keyset batches of ``batch_size``, each on a short connection
+        checkout, so a slow download holds neither a pooled connection nor
+        a read snapshot between batches.
+        """
+        after = (-1, 0)
+        while True:
+            with self._db() as conn:
+                rows = conn.execute("""
+                    SELECT id, action, target_id, delta_credits, created_at FROM actions
+                    WHERE user_id = ? AND (created_at, id) > (?, ?)
+                    ORDER BY created_at, id LIMIT ?
+                """, (int(user_id), after[0], after[1], int(batch_size))).fetchall()
+            for r in rows:
+                yield self._item(r)
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][4], rows[-1][0])
+
+    @staticmethod
+    def _item(r: tuple) -> Dict[str, Any]:
+        return {
+            "id": r[0],
+            "action": ACTION_NAMES.get(r[1], str(r[1])),
+            "target_id": str(r[2]),
+            "delta_credits": r[3],
+            "created_at": r[4],
+        }
+
+    def usage(self, user_id: int, days: int = 30) -> List[Dict[str, Any]]:
+        """Per-day, per-action counts and credit deltas for the last ``days`` UTC days, oldest first."""
+        since_day = int(self._clock()) // DAY - max(0, int(days) - 1)
+        totals: Dict[Tuple[int, int], List[int]] = {}
+        with self._db() as conn:
+            rolled_id = self._state(conn, "rollup_id")
+            rolled_ts = self._state(conn, "rollup_ts")
+            rows = conn.execute("""
+                SELECT day, action, count, delta_credits FROM actions_daily
+                WHERE user_id = ? AND day >= ?
+                UNION ALL
+                SELECT created_at / 86400, action, COUNT(*), SUM(delta_credits) FROM actions
+                WHERE user_id = ? AND created_at >= ? AND id > ?
+                GROUP BY 1, 2
+            """, (int(user_id), since_day, int(user_id),
+                  max(since_day * DAY, rolled_ts - _SKEW), rolled_id)).fetchall()
+        for day, action, count, delta in rows:
+            if day < since_day:
+                continue
+            t = totals.setdefault((day, action), [0, 0])
+            t[0] += count
+            t[1] += delta
+        return [{
+            "day": time.strftime("%Y-%m-%d", time.gmtime(day * DAY)),
+            "action": ACTION_NAMES.get(action, str(action)),
+            "count": count,
+            "delta_credits": delta,
+        } for (day, action), (count, delta) in sorted(totals.items())]
+
+    # -- maintenance ---------------------------------------------------
+
+    def rollup(self) -> int:
+        """Fold raw rows past the watermark into ``actions_daily``; returns rows folded."""
+        folded = 0
+        while True:
+            with self._db() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                lo = self._state(conn, "rollup_id")
+                hi, n, max_ts = conn.execute("""
+                    SELECT MAX(id), COUNT(*), MAX(created_at) FROM (
+                        SELECT id, created_at FROM actions WHERE id > ? ORDER BY id LIMIT ?
+                    )
+                """, (lo, self.batch_size)).fetchone()
+                if not n:
+                    conn.rollback()
+                    return folded
+                conn.execute("""
+                    INSERT INTO actions_daily(user_id, day, action, count, delta_credits)
+                    SELECT user_id, created_at / 86400, action, COUNT(*), SUM(delta_credits)
+                    FROM actions WHERE id > ? AND id <= ?
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT(user_id, day, action) DO UPDATE SET
+                        count = count + excluded.count,
+                        delta_credits = delta_credits + excluded.delta_credits
+                """, (lo, hi))
+                conn.executemany("""
+                    INSERT INTO ledger_state(key, value) VALUES(?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+                """, [("rollup_id", hi), ("rollup_ts", max_ts)])
+                conn.commit()
+            folded += n
+            if n < self.batch_size:
+                return folded
+
+    def archive(self) -> int:
+        """Export and delete rolled-up raw rows older than the retention; returns rows archived."""
+        if not self.retention_days or not self.archive_dir:
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cutoff = int(self._clock()) - self.retention_days * DAY
+        archived = 0
+        while True:
+            with self._db() as conn:
+                rolled_id = self._state(conn, "rollup_id")
+                # Oldest rows first by id; stop at the first one still inside the
+                # retention so only a contiguous id range is cut.
+                rows = []
+                for row in conn.execute("""
+                    SELECT id, user_id, action, target_id, delta_credits, created_at
+                    FROM actions WHERE id <= ? ORDER BY id LIMIT ?
+                """, (rolled_id, self.batch_size)):
+                    if row[5] >= cutoff:
+                        break
+                    rows.append(row)
+            if not rows:
+                return archived
+            first, last = rows[0][0], rows[-1][0]
+            path, tmp = self._write_archive(first, last, rows)
+            try:
+                with self._db() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    present = conn.execute("SELECT COUNT(*) FROM actions WHERE id BETWEEN ? AND ?",
+                                           (first, last)).fetchone()[0]
+                    if present != len(rows):  # another worker archived (part of) this range first
+                        conn.rollback()
+                        continue
+                    os.replace(tmp, path)
+                    self._fsync_dir()
+                    conn.execute("DELETE FROM actions WHERE id BETWEEN ? AND ?", (first, last))
+                    conn.commit()
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+            archived += len(rows)
+            logger.info("Ledger: archived actions %s-%s (%s rows)", first, last, len(rows))
+            if len(rows) < self.batch_size:
+                return archived
+
+    def _write_archive(self, first: int, last: int, rows: List[tuple]) -> Tuple[str, str]:
+        """Write ``rows`` to a temporary file and fsync it; returns ``(path, tmp)``."""
+        path = os.path.join(self.archive_dir, f"actions-{first:012d}-{last:012d}.ndjson.gz")
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as raw:
+            with gzip.open(raw, "wt", encoding="utf-8") as fh:
+                for id_, user_id, action, target_id, delta, created_at in rows:
+                    fh.write(json.dumps({
+                        "id": id_,
+                        "user_id": user_id,
+                        "action": ACTION_NAMES.get(action, str(action)),
+                        "target_id": str(target_id),
+                        "delta_credits": delta,
+                        "created_at": created_at,
+                    }, separators=(",", ":")))
+                    fh.write("\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        return path, tmp
+
+    def _fsync_dir(self) -> None:
+        """Make the rename durable before the rows it replaces are deleted."""
+        fd = os.open(self.archive_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def maintain(self) -> Dict[str, int]:
+        return {"rolled_up": self.rollup(), "archived": self.archive()}
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.maintain()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning("Ledger: maintenance failed: %s", e)
+
+    def start(self) -> None:
+        if not self.interval or (self._thread is not None and self._thread.is_alive()):
+            return  # a thread inherited through a fork is not alive here
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="ledger-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db() as conn:
+            return {
+                "rollup_id": self._state(conn, "rollup_id"),
+                "max_id": conn.execute("SELECT MAX(id) FROM actions").fetchone()[0] or 0,
+                "daily_rows": conn.execute("SELECT COUNT(*) FROM actions_daily").fetchone()[0],
+                "retention_days": self.retention_days,
+            }
@@ -0,0 +1,149 @@
+"""Structured logging: JSON lines through a background queue listener.
+
+Loggers hand records to a ``QueueHandler``. The message is formatted only
+for records that pass the level check, and only once. A ``QueueListener``
+thread does the actual writing, so a slow stderr or disk never blocks a
+request thread. Two filters run on the emitting thread before the
+record is queued:
+
+* ``ContextFilter`` stamps the current request ID (see ``set_request_id``).
+* ``MaskingFilter`` masks secrets. It masks values passed as
+  ``extra={"sessionid": ...}`` / ``txid`` / ``session_id``, and also
+  ``sessionid=`` cookies and 32-hex session IDs found in the rendered
+  message. Call sites pass secrets as extras, never inside the message.
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+SENSITIVE_FIELDS = ("sessionid", "txid", "session_id")
+
+# Attributes every LogRecord has; anything else came in through ``extra``.
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_MESSAGE_PATTERNS = (
+    (re.compile(r"(sessionid=)[^;\s\"']+", re.IGNORECASE), r"\1***"),
+    (re.compile(r"\b([0-9a-f]{8})[0-9a-f]{24}\b"), r"\1***"),
+)
+
+
+def mask(value, show: int = 8) -> str:
+    value = str(value or "")
+    if len(value) <= show:
+        return "***"
+    return f"{value[:show]}***"
+
+
+class ContextFilter(logging.Filter):
+    """Adds ``record.request_id`` from the callable given (None outside requests)."""
+
+    def __init__(self, get_request_id: Callable[[], Optional[str]]):
+        super().__init__()
+        self._get_request_id = get_request_id
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "request_id", None) is None:
+            try:
+                record.request_id = self._get_request_id()
+            except RuntimeError:
+                record.request_id = None
+        return True
+
+
+class MaskingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field in SENSITIVE_FIELDS:
+            if field in record.__dict__:
+                setattr(record, field, mask(record.__dict__[field], 10 if field == "txid" else 8))
+        msg = record.getMessage()
+        for pattern, repl in _MESSAGE_PATTERNS:
+            msg = pattern.sub(repl, msg)
+        record.msg, record.args = msg, None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            out["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The old plain format, with the request ID when there is one."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        rid = getattr(record, "request_id", None)
+        return f"{line} [{rid}]" if rid else line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback here (the caller's thread still
+        # owns exc_info) and ship a plain, picklable-friendly record.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+class LogPipeline:
+    def __init__(self):
+        self.queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def configure(self, level: str = "INFO", fmt: str = "json",
+                  get_request_id: Callable[[], Optional[str]] = lambda: None) -> None:
+        handler = _QueueHandler(self.queue)
+        handler.addFilter(ContextFilter(get_request_id))
+        handler.addFilter(MaskingFilter())
+        out = logging.StreamHandler(sys.stderr)
+        out.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, out, respect_handler_level=False)
+
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(handler)
+        root.setLevel(level.upper())
+        self.ensure_started()
+
+    def ensure_started(self) -> None:
+        """Start the listener thread in this process (again, after a fork)."""
+        if self.listener is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.listener._thread = None  # the parent's thread did not survive the fork
+                self.listener.start()
+                self._pid = os.getpid()
+
+    def stop(self) -> None:
+        if self.listener is not None and self._pid == os.getpid():
+            self.listener.stop()
+            self._pid = None
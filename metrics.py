@@ -0,0 +1,238 @@
+"""In-process metric primitives and Prometheus text exposition.
+
+Metrics are registered by name on a ``Registry``. Under gunicorn every
+worker has its own registry; ``MultiProcessCollector`` periodically writes
+each worker's raw state to one JSON file in a shared directory, and a
+scrape sums the files of all workers (live and exited) into one
+exposition. Clear the directory when the server starts.
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the last bucket is +Inf.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram keyed by a tuple of label values."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def raw(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+        """Cumulative bucket counts, total count and sum per label tuple."""
+        out = {}
+        for labels, series in self.raw().items():
+            cumulative, running = [], 0
+            for n in series[:-1]:
+                running += n
+                cumulative.append(running)
+            out[labels] = {
+                "buckets": dict(zip([*map(str, self.buckets), "+Inf"], cumulative)),
+                "count": running,
+                "sum": round(series[-1], 6),
+            }
+        return out
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def raw(self) -> Dict[Tuple[str, ...], float]:
+        return self.snapshot()
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Tuple[str, str, Tuple[str, ...], Any]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, help: str, labelnames: Sequence[str], metric):
+        kind = "histogram" if isinstance(metric, Histogram) else "counter"
+        with self._lock:
+            if name in self._metrics:
+                raise ValueError(f"metric {name!r} already registered")
+            self._metrics[name] = (kind, help, tuple(labelnames), metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(name, help, labelnames, Histogram(buckets))
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(name, help, labelnames, Counter())
+
+    def dump(self) -> Dict[str, Any]:
+        """JSON-serialisable raw state of every metric."""
+        with self._lock:
+            items = list(self._metrics.items())
+        return {
+            name: [[list(labels), value] for labels, value in metric.raw().items()]
+            for name, (_, _, _, metric) in items
+        }
+
+    def render(self, states: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+        """Prometheus text format of ``states`` (default: this process) summed."""
+        states = [self.dump()] if states is None else states
+        merged: Dict[str, Dict[Tuple[str, ...], Any]] = {name: {} for name in self._metrics}
+        for state in states:
+            for name, series in state.items():
+                if name not in merged:
+                    continue
+                acc = merged[name]
+                for labels, value in series:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        cur = acc.get(key)
+                        acc[key] = value if cur is None else [a + b for a, b in zip(cur, value)]
+                    else:
+                        acc[key] = acc.get(key, 0) + value
+
+        lines: List[str] = []
+        with self._lock:
+            items = sorted(self._metrics.items())
+        for name, (kind, help, labelnames, metric) in items:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(merged[name].items()):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_fmt(value)}")
+                    continue
+                running = 0
+                for le, n in zip([*map(str, metric.buckets), "+Inf"], value[:-1]):
+                    running += n
+                    le_label = 'le="%s"' % le
+                    lines.append(f"{name}_bucket{_labels(labelnames, labels, le_label)} {running}")
+                lines.append(f"{name}_sum{_labels(labelnames, labels)} {_fmt(value[-1])}")
+                lines.append(f"{name}_count{_labels(labelnames, labels)} {running}")
+        return "\n".join(lines) + "\n"
+
+
+class MultiProcessCollector:
+    """Shares a registry across worker processes through per-process files.
+
+    ``directory=None`` disables file sharing: ``collect`` renders only the
+    calling process.
+    """
+
+    def __init__(self, registry: Registry, directory: Optional[str], interval: float = 5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = float(interval)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file: Optional[str] = None
+        self._pid: Optional[int] = None
+
+    def _path(self) -> str:
+        # pid + random suffix: a reused pid must not overwrite an exited worker's totals.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        return self._file
+
+    def write(self) -> None:
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.registry.dump(), fh, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def collect(self) -> str:
+        if not self.directory:
+            return self.registry.render()
+        self.write()
+        states = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as fh:
+                    states.append(json.load(fh))
+            except (OSError, ValueError):
+                continue  # being replaced right now
+        return self.registry.render(states)
+
+    def clear(self) -> None:
+        """Drop every worker's file; call once at server start, before workers run."""
+        for path in glob.glob(os.path.join(self.directory or "", "*.json*")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Metrics: could not write %s: %s", self._file, e)
+
+    def start(self) -> None:
+        if not self.directory or (self._thread is not None and self._thread.is_alive()):
+            return  # a thread inherited through a fork is not alive here
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="metrics-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self._thread = None
+        try:
+            self.write()
+        except OSError:
+            pass
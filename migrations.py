@@ -0,0 +1,453 @@
+"""Versioned SQLite schema migrations.
+
+Each migration is ``(version, name, steps)`` where a step is either an SQL
+string or a callable taking the open connection. Pending migrations are
+applied in order, each inside its own ``BEGIN IMMEDIATE`` transaction, and
+recorded in ``schema_version``. A file lock next to the database keeps
+several gunicorn workers from racing each other on a fresh deploy.
+"""
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX hosts
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+MIGRATIONS: List[Tuple[int, str, List[Step]]] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT UNIQUE NOT NULL,
+            ig_user_id TEXT,
+            ig_username TEXT,
+            plan TEXT NOT NULL DEFAULT 'free',
+            credits INTEGER NOT NULL DEFAULT 0,
+            session_data TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            action TEXT NOT NULL,
+            target_id TEXT,
+            delta_credits INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS payment_requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            txid TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            note TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_users_session ON users(session_id)",
+        "CREATE INDEX IF NOT EXISTS idx_actions_session ON actions(session_id)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_txid ON payment_requests(txid)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_session ON payment_requests(session_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_payment_requests_txid_unique ON payment_requests(txid)",
+    ]),
+    (2, "follow graph snapshots", [
+        # ID columns are packed sorted int64 arrays; *_head keep the newest IDs
+        # in upstream order so the next scan knows where it can stop paging.
+        """
+        CREATE TABLE IF NOT EXISTS follow_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ig_user_id TEXT NOT NULL,
+            scanned_at TEXT NOT NULL,
+            follower_count INTEGER NOT NULL,
+            following_count INTEGER NOT NULL,
+            followers BLOB NOT NULL,
+            following BLOB NOT NULL,
+            followers_head BLOB NOT NULL,
+            following_head BLOB NOT NULL,
+            following_meta BLOB NOT NULL,
+            unfollowers BLOB NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_follow_snapshots_user ON follow_snapshots(ig_user_id, id)",
+    ]),
+    (3, "background jobs", [
+        # payload/checkpoint/progress/result are JSON; locked_until and
+        # run_after are epoch seconds so lease checks are plain comparisons.
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            session_id TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            payload TEXT NOT NULL DEFAULT '{}',
+            checkpoint TEXT NOT NULL DEFAULT '{}',
+            progress TEXT NOT NULL DEFAULT '{}',
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_by TEXT,
+            locked_until REAL,
+            run_after REAL NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs(session_id, kind, status)",
+    ]),
+    (4, "profile cache", [
+        # data is the trimmed profile JSON; NULL caches "no such user".
+        # fetched_at/expires_at are epoch seconds.
+        """
+        CREATE TABLE IF NOT EXISTS profile_cache (
+            username TEXT PRIMARY KEY,
+            data TEXT,
+            fetched_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_profile_cache_fetched ON profile_cache(fetched_at)",
+    ]),
+    (5, "compact actions ledger", [
+        # user_id replaces the repeated session string, action is a small
+        # code (1 unfollow, 2 refund; see ledger.ACTIONS) and created_at is
+        # epoch seconds. Rows of sessions that no longer exist are dropped.
+        """
+        CREATE TABLE actions_v5 (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            action INTEGER NOT NULL,
+            target_id INTEGER,
+            delta_credits INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT INTO actions_v5(id, user_id, action, target_id, delta_credits, created_at)
+        SELECT a.id, u.id,
+               CASE a.action WHEN 'unfollow' THEN 1 WHEN 'refund' THEN 2 ELSE 0 END,
+               a.target_id, a.delta_credits,
+               CAST(strftime('%s', substr(a.created_at, 1, 19)) AS INTEGER)
+        FROM actions a JOIN users u ON u.session_id = a.session_id
+        """,
+        "DROP TABLE actions",
+        "ALTER TABLE actions_v5 RENAME TO actions",
+        "CREATE INDEX IF NOT EXISTS idx_actions_user_time ON actions(user_id, created_at)",
+        # day is the UTC day number (created_at / 86400).
+        """
+        CREATE TABLE IF NOT EXISTS actions_daily (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            action INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            delta_credits INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, action)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ledger_state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (6, "payment verification", [
+        # checked_at: epoch seconds of the verifier's last look at a pending request.
+        "ALTER TABLE payment_requests ADD COLUMN checked_at REAL",
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_status ON payment_requests(status, created_at)",
+    ]),
+    (7, "event fan-out", [
+        # Short-lived rows read by other workers' SSE pollers (see events.py).
+        """
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            channel TEXT NOT NULL,
+            event TEXT NOT NULL,
+            data TEXT NOT NULL,
+            origin TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at)",
+    ]),
+    (8, "payment listings", [
+        # Covers the per-session listing (keyset on id) without touching the
+        # table; replaces the plain session_id index.
+        """
+        CREATE INDEX IF NOT EXISTS idx_payment_requests_session_list
+        ON payment_requests(session_id, id, plan, status, txid, created_at, updated_at)
+        """,
+        "DROP INDEX IF EXISTS idx_payment_requests_session",
+        "CREATE INDEX IF NOT EXISTS idx_payment_requests_status_id ON payment_requests(status, id)",
+        # txid is already UNIQUE in the table definition; these duplicated its index.
+        "DROP INDEX IF EXISTS idx_payment_requests_txid",
+        "DROP INDEX IF EXISTS idx_payment_requests_txid_unique",
+    ]),
+    (9, "users per instagram account", [
+        # Every login used to insert a new users row. Rows of the same
+        # ig_user_id collapse onto the lowest id: lifetime wins, credits are
+        # the largest balance (repeat free grants are not added up), and
+        # each old session_id becomes a token in ``sessions``.
+        """
+        CREATE TABLE user_merge AS
+        SELECT u.id AS old_id,
+               COALESCE((SELECT MIN(v.id) FROM users v WHERE v.ig_user_id = u.ig_user_id), u.id) AS new_id
+        FROM users u
+        """,
+        """
+        CREATE TABLE users_v9 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ig_user_id TEXT UNIQUE,
+            ig_username TEXT,
+            plan TEXT NOT NULL DEFAULT 'free',
+            credits INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        """
+        INSERT INTO users_v9(id, ig_user_id, ig_username, plan, credits, created_at, updated_at)
+        SELECT m.new_id,
+               MAX(u.ig_user_id),
+               (SELECT v.ig_username FROM users v JOIN user_merge n ON n.old_id = v.id
+                WHERE n.new_id = m.new_id ORDER BY v.updated_at DESC LIMIT 1),
+               CASE WHEN MAX(u.plan = 'lifetime') THEN 'lifetime' ELSE 'free' END,
+               MAX(u.credits), MIN(u.created_at), MAX(u.updated_at)
+        FROM users u JOIN user_merge m ON m.old_id = u.id
+        GROUP BY m.new_id
+        """,
+        # The Instagram cookie blob, read only when talking to Instagram.
+        """
+        CREATE TABLE user_session_data (
+            user_id INTEGER PRIMARY KEY,
+            session_data TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        """
+        INSERT INTO user_session_data(user_id, session_data, updated_at)
+        SELECT m.new_id, u.session_data, u.updated_at
+        FROM users u JOIN user_merge m ON m.old_id = u.id
+        WHERE u.session_data IS NOT NULL
+        ORDER BY u.updated_at
+        ON CONFLICT(user_id) DO UPDATE SET
+            session_data = excluded.session_data, updated_at = excluded.updated_at
+        """,
+        # created_at/expires_at are epoch seconds; carried-over tokens get 30 days.
+        """
+        CREATE TABLE sessions (
+            token TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO sessions(token, user_id, created_at, expires_at)
+        SELECT u.session_id, m.new_id,
+               COALESCE(CAST(strftime('%s', substr(u.updated_at, 1, 19)) AS REAL), 0),
+               CAST(strftime('%s', 'now') AS REAL) + 30 * 86400
+        FROM users u JOIN user_merge m ON m.old_id = u.id
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expires_at)",
+        """
+        UPDATE actions SET user_id = (SELECT new_id FROM user_merge WHERE old_id = actions.user_id)
+        WHERE user_id IN (SELECT old_id FROM user_merge WHERE old_id != new_id)
+        """,
+        """
+        CREATE TABLE actions_daily_v9 (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            action INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            delta_credits INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, action)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO actions_daily_v9(user_id, day, action, count, delta_credits)
+        SELECT COALESCE(m.new_id, d.user_id), d.day, d.action, SUM(d.count), SUM(d.delta_credits)
+        FROM actions_daily d LEFT JOIN user_merge m ON m.old_id = d.user_id
+        GROUP BY 1, 2, 3
+        """,
+        "DROP TABLE actions_daily",
+        "ALTER TABLE actions_daily_v9 RENAME TO actions_daily",
+        # Payment requests belong to the user; session_id stays as the submitting token.
+        "ALTER TABLE payment_requests ADD COLUMN user_id INTEGER",
+        """
+        UPDATE payment_requests SET user_id = (
+            SELECT m.new_id FROM users u JOIN user_merge m ON m.old_id = u.id
+            WHERE u.session_id = payment_requests.session_id
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_payment_requests_user_list
+        ON payment_requests(user_id, id, plan, status, txid, created_at, updated_at)
+        """,
+        "DROP INDEX IF EXISTS idx_payment_requests_session_list",
+        "DROP TABLE users",
+        "ALTER TABLE users_v9 RENAME TO users",
+        "DROP TABLE user_merge",
+    ]),
+    (10, "jobs per user", [
+        # Jobs belong to the user, so a new login still sees them; session_id
+        # stays as the token that queued the job. Unfollow payloads carry
+        # user_id, older scans only have the token.
+        "ALTER TABLE jobs ADD COLUMN user_id INTEGER",
+        """
+        UPDATE jobs SET user_id = COALESCE(
+            json_extract(payload, '$.user_id'),
+            (SELECT s.user_id FROM sessions s WHERE s.token = jobs.session_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs(user_id, kind, status)",
+        "DROP INDEX IF EXISTS idx_jobs_session",
+        # Finished rows are pruned by age.
+        "CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(updated_at) WHERE status IN ('done', 'failed')",
+    ]),
+    (11, "actions ids never reused", [
+        # Without AUTOINCREMENT SQLite hands out MAX(id) + 1, so once archive()
+        # deleted the newest rows, new rows got ids at or below the rollup
+        # watermark: never rolled up, and archived under an old file name.
+        # The sequence starts past both the table and the watermark.
+        """
+        CREATE TABLE actions_v11 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            action INTEGER NOT NULL,
+            target_id INTEGER,
+            delta_credits INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+        """,
+        """
+        INSERT INTO actions_v11(id, user_id, action, target_id, delta_credits, created_at)
+        SELECT id, user_id, action, target_id, delta_credits, created_at FROM actions ORDER BY id
+        """,
+        "DROP TABLE actions",
+        "ALTER TABLE actions_v11 RENAME TO actions",
+        "CREATE INDEX IF NOT EXISTS idx_actions_user_time ON actions(user_id, created_at)",
+        "DELETE FROM sqlite_sequence WHERE name = 'actions'",
+        """
+        INSERT INTO sqlite_sequence(name, seq)
+        SELECT 'actions', MAX(
+            COALESCE((SELECT MAX(id) FROM actions), 0),
+            COALESCE((SELECT value FROM ledger_state WHERE key = 'rollup_id'), 0)
+        )
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    d = os.path.dirname(db_path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _ensure_version_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'"
+    ).fetchone()
+    if row is None:
+        return 0
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return int(row[0] or 0)
+
+
+@contextmanager
+def _file_lock(path: str):
+    """Exclusive advisory lock so only one process migrates at a time."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as fh:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+def pending(db_path: str) -> List[Tuple[int, str]]:
+    conn = _connect(db_path)
+    try:
+        version = current_version(conn)
+    finally:
+        conn.close()
+    return [(v, name) for v, name, _ in MIGRATIONS if v > version]
+
+
+def upgrade(db_path: str, target: int = None) -> int:
+    """Apply pending migrations up to ``target`` (default: latest).
+
+    Returns the schema version after the upgrade.
+    """
+    target = LATEST_VERSION if target is None else int(target)
+    # The lock file lives next to the database, so its directory must exist first.
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    with _file_lock(db_path + ".migrate.lock"):
+        conn = _connect(db_path)
+        try:
+            _ensure_version_table(conn)
+            for version, name, steps in MIGRATIONS:
+                if version > target:
+                    break
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Re-read under the write lock: another process may have won.
+                    if version <= current_version(conn):
+                        conn.execute("COMMIT")
+                        continue
+                    for step in steps:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    conn.execute(
+                        "INSERT INTO schema_version(version, name, applied_at) VALUES(?,?,?)",
+                        (version, name, _now_iso())
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                logger.info("DB: applied migration %s (%s)", version, name)
+            return current_version(conn)
+        finally:
+            conn.close()
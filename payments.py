@@ -0,0 +1,296 @@
+"""Automatic verification of USDT (TRC20) payment requests.
+
+``PaymentVerifier`` polls pending ``payment_requests`` in batches (the
+``(status, created_at)`` index keeps the poll a range scan), asks a chain
+data provider about each TXID and sorts them into:
+
+* approved: a successful USDT transfer to our address for at least the
+  plan price, with enough confirmations. Handed to ``approve`` in one
+  call, which credits the whole batch in one transaction.
+* rejected: the transaction exists but can never match (failed, another
+  token, another recipient, too little, or mined more than ``max_age``
+  before the request was made, i.e. an old payment dug up again). Users
+  pay first and then paste the TXID, so a transfer is normally somewhat
+  older than its request; a TXID can only be submitted once anyway.
+  Handed to ``reject``.
+* still pending: unknown or unconfirmed TXIDs are checked again after
+  ``recheck`` seconds, and left for manual review after ``max_age``.
+
+Providers implement ``lookup(txids) -> {txid: Transfer or None}``:
+``TronGridProvider`` talks to TronGrid, ``FixtureProvider`` reads a JSON
+file and is meant for tests and local runs.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Dict, List, NamedTuple, Optional, Sequence
+
+if TYPE_CHECKING:
+    import requests
+
+logger = logging.getLogger(__name__)
+
+USDT_TRC20_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+USDT_DECIMALS = 6
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+_B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def tron_hex(address: str) -> str:
+    """20-byte hex form of a base58 ``T...`` address (as it appears in event logs)."""
+    n = 0
+    for ch in address.strip():
+        n = n * 58 + _B58.index(ch)  # ValueError on a non-base58 character
+    try:
+        raw = n.to_bytes(25, "big")
+    except OverflowError:
+        raise ValueError(f"not a Tron address: {address!r}") from None
+    if raw[0] != 0x41 or hashlib.sha256(hashlib.sha256(raw[:21]).digest()).digest()[:4] != raw[21:]:
+        raise ValueError(f"not a Tron address: {address!r}")
+    return raw[1:21].hex()
+
+
+class Transfer(NamedTuple):
+    txid: str
+    success: bool
+    token: str  # contract, 20-byte hex
+    to: str  # recipient, 20-byte hex
+    amount: Decimal  # in token units
+    confirmations: int
+    timestamp: Optional[float] = None  # block time, unix seconds; None when unknown
+
+
+class FixtureProvider:
+    """Transfers from a JSON file: ``{txid: {"to", "amount", "confirmations", "success", "token", "timestamp"}}``.
+
+    Addresses may be base58 or hex; ``token`` defaults to USDT and
+    ``timestamp`` (unix seconds) is optional. The file is
+    re-read on every lookup so tests can edit it while the verifier runs.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def lookup(self, txids: Sequence[str]) -> Dict[str, Optional[Transfer]]:
+        try:
+            with open(self.path) as fh:
+                data = json.load(fh)
+        except FileNotFoundError:
+            data = {}
+        out: Dict[str, Optional[Transfer]] = {}
+        for txid in txids:
+            t = data.get(txid)
+            if t is None:
+                out[txid] = None
+                continue
+            out[txid] = Transfer(
+                txid,
+                bool(t.get("success", True)),
+                _as_hex(t.get("token", USDT_TRC20_CONTRACT)),
+                _as_hex(t["to"]),
+                Decimal(str(t["amount"])),
+                int(t.get("confirmations", 0)),
+                float(t["timestamp"]) if t.get("timestamp") is not None else None,
+            )
+        return out
+
+
+def _as_hex(address: str) -> str:
+    address = address.strip()
+    if address.startswith("T"):
+        return tron_hex(address)
+    address = address.lower()
+    return address[2:] if len(address) == 42 and address.startswith("41") else address
+
+
+class TronGridProvider:
+    """TronGrid full-node API: one ``gettransactioninfobyid`` per TXID plus one ``getnowblock`` per batch.
+
+    A transaction can emit several Transfer logs (swaps, batch payouts), so
+    the one reported is the ``token`` transfer to ``address``; without such
+    a log the first Transfer is reported and the verifier rejects it.
+    """
+
+    def __init__(self, base_url: str = "https://api.trongrid.io", api_key: Optional[str] = None,
+                 timeout: float = 10.0, session: Optional["requests.Session"] = None,
+                 address: Optional[str] = None, token: str = USDT_TRC20_CONTRACT):
+        if session is None:
+            import requests  # only when this provider is configured
+            session = requests.Session()
+        self.address = _as_hex(address) if address else None
+        self.token = _as_hex(token)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.http = session
+        if api_key:
+            self.http.headers["TRON-PRO-API-KEY"] = api_key
+
+    def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        r = self.http.post(f"{self.base_url}{path}", json=body, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json() or {}
+
+    def lookup(self, txids: Sequence[str]) -> Dict[str, Optional[Transfer]]:
+        head = int(self._post("/wallet/getnowblock", {})["block_header"]["raw_data"]["number"])
+        out: Dict[str, Optional[Transfer]] = {}
+        for txid in txids:
+            info = self._post("/wallet/gettransactioninfobyid", {"value": txid})
+            out[txid] = self._parse(txid, info, head, self.token, self.address) if info.get("blockNumber") else None
+        return out
+
+    @staticmethod
+    def _parse(txid: str, info: Dict[str, Any], head: int, token: str, to: Optional[str]) -> Transfer:
+        success = (info.get("receipt") or {}).get("result") == "SUCCESS"
+        confirmations = max(0, head - int(info["blockNumber"]))
+        timestamp = info["blockTimeStamp"] / 1000 if info.get("blockTimeStamp") else None
+        transfers = []
+        for log in info.get("log") or []:
+            topics = log.get("topics") or []
+            if len(topics) == 3 and topics[0] == TRANSFER_TOPIC:
+                amount = Decimal(int(log.get("data") or "0", 16)).scaleb(-USDT_DECIMALS)
+                transfers.append(Transfer(txid, success, _as_hex(log.get("address", "")), topics[2][-40:],
+                                          amount, confirmations, timestamp))
+        for t in transfers:
+            if t.token == token and (to is None or t.to == to):
+                return t
+        if transfers:
+            return transfers[0]
+        return Transfer(txid, False, _as_hex(info.get("contract_address") or ""), "", Decimal(0), confirmations,
+                        timestamp)
+
+
+def _epoch(iso: str) -> float:
+    """Unix time of a ``now_iso()`` timestamp (naive UTC with a trailing ``Z``)."""
+    return datetime.fromisoformat(iso.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+
+class PaymentVerifier:
+    def __init__(
+        self,
+        db: Callable[[], ContextManager],
+        provider,
+        address: str,
+        prices: Dict[str, Decimal],
+        approve: Callable[[List[Dict[str, Any]]], int],
+        reject: Callable[[List[Dict[str, Any]]], int],
+        min_confirmations: int = 19,
+        batch_size: int = 50,
+        interval: float = 60.0,
+        recheck: float = 120.0,
+        max_age: float = 72 * 3600,
+        token: str = USDT_TRC20_CONTRACT,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._db = db
+        self.provider = provider
+        self.address = _as_hex(address)
+        self.token = _as_hex(token)
+        self.prices = prices
+        self._approve = approve
+        self._reject = reject
+        self.min_confirmations = int(min_confirmations)
+        self.batch_size = max(1, int(batch_size))
+        self.interval = float(interval)
+        self.recheck = float(recheck)
+        self.max_age = float(max_age)
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._counts = {"checked": 0, "approved": 0, "rejected": 0, "waiting": 0, "errors": 0}
+
+    def claim(self) -> List[Dict[str, Any]]:
+        """Take the oldest pending requests not checked within ``recheck`` seconds."""
+        now = self._clock()
+        oldest = (datetime.utcfromtimestamp(now) - timedelta(seconds=self.max_age)).isoformat() + "Z"
+        with self._db() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = [dict(r) for r in conn.execute("""
+                SELECT id, user_id, plan, txid, created_at FROM payment_requests
+                WHERE status = 'pending' AND created_at >= ? AND COALESCE(checked_at, 0) <= ?
+                ORDER BY created_at
+                LIMIT ?
+            """, (oldest, now - self.recheck, self.batch_size))]
+            conn.executemany("UPDATE payment_requests SET checked_at = ? WHERE id = ?",
+                             [(now, r["id"]) for r in rows])
+            conn.commit()
+        return rows
+
+    def decide(self, row: Dict[str, Any], t: Optional[Transfer]) -> Optional[str]:
+        """None while undecided, "ok" to approve, or the rejection reason."""
+        if t is None or t.confirmations < self.min_confirmations:
+            return None
+        if not t.success:
+            return "transaction_failed"
+        if t.token != self.token:
+            return "wrong_token"
+        if t.to != self.address:
+            return "wrong_recipient"
+        price = self.prices.get(row["plan"])
+        if price is None:
+            return "invalid_plan"
+        if t.amount < price:
+            return "amount_too_low"
+        if t.timestamp is not None and t.timestamp < _epoch(row["created_at"]) - self.max_age:
+            return "transfer_too_old"
+        return "ok"
+
+    def run_once(self) -> Dict[str, int]:
+        rows = self.claim()
+        if not rows:
+            return {"checked": 0, "approved": 0, "rejected": 0, "waiting": 0}
+        transfers = self.provider.lookup([r["txid"] for r in rows])
+        approve, reject = [], []
+        for row in rows:
+            verdict = self.decide(row, transfers.get(row["txid"]))
+            if verdict == "ok":
+                approve.append(row)
+            elif verdict is not None:
+                reject.append(dict(row, note=f"auto: {verdict}"))
+        approved = self._approve(approve) if approve else 0
+        rejected = self._reject(reject) if reject else 0
+        result = {
+            "checked": len(rows),
+            "approved": approved,
+            "rejected": rejected,
+            "waiting": len(rows) - len(approve) - len(reject),
+        }
+        with self._lock:
+            for k, v in result.items():
+                self._counts[k] += v
+        if approved or rejected:
+            logger.info("Payments: verified %s, approved %s, rejected %s", len(rows), approved, rejected)
+        return result
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                while self.run_once()["checked"] == self.batch_size and not self._stop.is_set():
+                    pass
+            except Exception as e:
+                with self._lock:
+                    self._counts["errors"] += 1
+                logger.warning("Payments: verification failed: %s", e)
+
+    def start(self) -> None:
+        if not self.interval or (self._thread is not None and self._thread.is_alive()):
+            return  # a thread inherited through a fork is not alive here
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="payment-verifier", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counts, running=self._thread is not None)
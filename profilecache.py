@@ -0,0 +1,150 @@
+"""Two-tier cache of public Instagram profiles, keyed by username.
+
+Lookups try an in-process LRU (``TTLCache``) first, then the shared
+``profile_cache`` SQLite table, and only then Instagram. Usernames that
+Instagram reports as missing (404) are cached too, for a shorter
+``negative_ttl``. Concurrent misses for the same username inside one
+process share a single upstream call (``SingleFlight``). Upstream
+errors (throttling, 5xx, network) are never cached.
+
+The table is kept bounded: every ``compact_every`` writes, expired rows
+are deleted and then the oldest rows beyond ``max_rows`` are dropped.
+"""
+import json
+import time
+from typing import Any, Callable, ContextManager, Dict, Optional, Tuple
+
+from cache import SingleFlight, TTLCache
+from metrics import Counter
+
+_MISSING = object()
+_NOT_FOUND = "not-found"  # memory-tier marker for a negative entry
+
+# fetch(sessionid, username) -> (found, data): (True, dict), (False, None)
+# for a missing user, (None, None) for an upstream error.
+Fetch = Callable[[str, str], Tuple[Optional[bool], Optional[dict]]]
+
+RESULTS = ("memory_hit", "db_hit", "negative_hit", "miss", "shared", "error")
+
+
+def normalize(username: str) -> str:
+    return (username or "").strip().lstrip("@").lower()
+
+
+class ProfileCache:
+    def __init__(
+        self,
+        db: Callable[[], ContextManager],
+        fetch: Fetch,
+        memory: TTLCache,
+        ttl: float = 3600,
+        negative_ttl: float = 300,
+        max_rows: int = 50000,
+        compact_every: int = 500,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._db = db
+        self._fetch = fetch
+        self.memory = memory
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.max_rows = max(1, int(max_rows))
+        self.compact_every = max(1, int(compact_every))
+        self._clock = clock
+        self._flight = SingleFlight()
+        self._writes = 0
+        self.requests = Counter()  # labelled by result, see RESULTS
+
+    def get(self, sessionid: str, username: str, refresh: bool = False) -> Optional[dict]:
+        """Profile dict for ``username``, or None if missing or unavailable.
+
+        ``refresh=True`` skips both tiers but still stores the fresh answer.
+        """
+        key = normalize(username)
+        if not key:
+            return None
+        if not refresh:
+            hit = self.memory.get(key, _MISSING)
+            if hit is not _MISSING:
+                self.requests.inc("negative_hit" if hit is _NOT_FOUND else "memory_hit")
+                return None if hit is _NOT_FOUND else hit
+            row = self._load_row(key)
+            if row is not None:
+                data, expires_at = row
+                self.memory.set(key, _NOT_FOUND if data is None else data,
+                                ttl=min(self.memory.ttl, expires_at - self._clock()))
+                self.requests.inc("db_hit" if data is not None else "negative_hit")
+                return data
+        value, shared = self._flight.do(key, lambda: self._refresh(sessionid, key))
+        if shared:
+            self.requests.inc("shared")
+        return value
+
+    def _refresh(self, sessionid: str, key: str) -> Optional[dict]:
+        found, data = self._fetch(sessionid, key)
+        if found is None:
+            self.requests.inc("error")
+            return None
+        self.requests.inc("miss")
+        ttl = self.ttl if found else self.negative_ttl
+        self.memory.set(key, data if found else _NOT_FOUND, ttl=min(self.memory.ttl, ttl))
+        self._store_row(key, data if found else None, ttl)
+        return data if found else None
+
+    def _load_row(self, key: str) -> Optional[Tuple[Optional[dict], float]]:
+        with self._db() as conn:
+            row = conn.execute(
+                "SELECT data, expires_at FROM profile_cache WHERE username = ? AND expires_at > ?",
+                (key, self._clock()),
+            ).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row[0]) if row[0] is not None else None), float(row[1])
+
+    def _store_row(self, key: str, data: Optional[dict], ttl: float) -> None:
+        now = self._clock()
+        with self._db() as conn:
+            conn.execute("""
+                INSERT INTO profile_cache(username, data, fetched_at, expires_at) VALUES(?,?,?,?)
+                ON CONFLICT(username) DO UPDATE SET
+                    data = excluded.data, fetched_at = excluded.fetched_at, expires_at = excluded.expires_at
+            """, (key, json.dumps(data, separators=(",", ":")) if data is not None else None, now, now + ttl))
+            conn.commit()
+        self._writes += 1
+        if self._writes % self.compact_every == 0:
+            self.compact()
+
+    def invalidate(self, username: str) -> None:
+        key = normalize(username)
+        self.memory.invalidate(key)
+        with self._db() as conn:
+            conn.execute("DELETE FROM profile_cache WHERE username = ?", (key,))
+            conn.commit()
+
+    def compact(self) -> int:
+        """Drop expired rows, then the oldest beyond ``max_rows``; returns rows removed."""
+        with self._db() as conn:
+            removed = conn.execute("DELETE FROM profile_cache WHERE expires_at <= ?", (self._clock(),)).rowcount
+            removed += conn.execute("""
+                DELETE FROM profile_cache WHERE username IN (
+                    SELECT username FROM profile_cache ORDER BY fetched_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_rows,)).rowcount
+            conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        counts = {r: 0 for r in RESULTS}
+        for (result,), n in self.requests.snapshot().items():
+            counts[result] = int(n)
+        hits = counts["memory_hit"] + counts["db_hit"] + counts["negative_hit"] + counts["shared"]
+        total = hits + counts["miss"] + counts["error"]
+        with self._db() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM profile_cache").fetchone()[0]
+        return {
+            **counts,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory": self.memory.stats(),
+            "db_rows": rows,
+            "db_max_rows": self.max_rows,
+        }
@@ -0,0 +1,91 @@
+"""Sampled cProfile profiling of live requests.
+
+A sampled (or explicitly requested) request runs under ``cProfile`` and
+its stats are dumped to ``<directory>/<endpoint>/<time>-<pid>-<rand>.prof``.
+Only the newest ``keep`` dumps per endpoint are kept. ``summary`` merges
+the dumps with ``pstats`` into a top-N table. Requests that are not
+sampled cost one comparison.
+"""
+import cProfile
+import glob
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name or "unmatched")
+
+
+class RequestProfiler:
+    def __init__(self, directory: str, sample_rate: float = 0.0, keep: int = 50):
+        self.directory = directory
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.keep = max(1, int(keep))
+
+    def sampled(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def start() -> cProfile.Profile:
+        prof = cProfile.Profile()
+        prof.enable()
+        return prof
+
+    def finish(self, prof: cProfile.Profile, endpoint: str) -> str:
+        """Stop ``prof``, write its dump and rotate old ones; returns the path."""
+        prof.disable()
+        d = os.path.join(self.directory, _safe(endpoint))
+        os.makedirs(d, exist_ok=True)
+        path = os.path.join(d, f"{time.time():.6f}-{os.getpid()}-{uuid.uuid4().hex[:6]}.prof")
+        prof.dump_stats(path)
+        for old in sorted(glob.glob(os.path.join(d, "*.prof")))[:-self.keep]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+        return path
+
+    def endpoints(self) -> Dict[str, int]:
+        out = {}
+        for d in sorted(glob.glob(os.path.join(self.directory, "*"))):
+            if os.path.isdir(d):
+                out[os.path.basename(d)] = len(glob.glob(os.path.join(d, "*.prof")))
+        return out
+
+    def summary(self, endpoint: Optional[str] = None, top: int = 20, sort: str = "cumulative") -> Dict[str, Any]:
+        """Top ``top`` functions over all dumps (of ``endpoint``, if given)."""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {SORT_KEYS}")
+        pattern = os.path.join(self.directory, _safe(endpoint) if endpoint else "*", "*.prof")
+        files = sorted(glob.glob(pattern))
+        stats = None
+        for path in files:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(path)
+                else:
+                    stats.add(path)
+            except (OSError, EOFError, TypeError, ValueError):
+                continue  # rotated away or half-written
+        if stats is None:
+            return {"profiles": 0, "total_seconds": 0.0, "functions": []}
+
+        col = {"calls": 1, "tottime": 2, "cumulative": 3}[sort]
+        rows: List[Dict[str, Any]] = []
+        for (filename, line, func), (cc, nc, tt, ct, _) in sorted(
+            stats.stats.items(), key=lambda kv: kv[1][col], reverse=True
+        )[:top]:
+            rows.append({
+                "function": f"{filename}:{line}({func})",
+                "calls": nc,
+                "tottime": round(tt, 6),
+                "cumtime": round(ct, 6),
+            })
+        return {"profiles": len(files), "total_seconds": round(stats.total_tt, 6), "functions": rows}
@@ -0,0 +1,124 @@
+"""SQLite storage backend for Flask-Limiter / ``limits``.
+
+``memory://`` keeps counters per process, so every gunicorn worker enforces
+its own copy of each limit and a restart forgets them. This backend keeps
+the fixed-window counters in one small SQLite file shared by all workers
+on the host:
+
+    Limiter(..., storage_uri="sqlite:///data/ratelimit.db")
+
+An increment is a single ``INSERT ... ON CONFLICT DO UPDATE ... RETURNING``
+statement, so it is atomic across processes without an explicit
+transaction. Expired windows are deleted every ``compact_every``
+increments; together with a bounded page cache this keeps the file and
+memory footprint proportional to the keys active in the current windows.
+Only the fixed-window strategy (Flask-Limiter's default) is supported.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from limits.storage import Storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratelimit (
+    key TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID
+"""
+
+
+class SQLiteStorage(Storage):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(
+        self,
+        uri: str = "sqlite:///data/ratelimit.db",
+        wrap_exceptions: bool = False,
+        compact_every: int = 1000,
+        busy_timeout: float = 5.0,
+        cache_size_kib: int = 1024,
+        **options,
+    ):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # sqlite:///relative/path or sqlite:////absolute/path
+        self.path = uri.split("://", 1)[1][1:] if "://" in uri else uri
+        self.compact_every = max(1, int(compact_every))
+        self.busy_timeout = float(busy_timeout)
+        self.cache_size_kib = int(cache_size_kib)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._incrs = 0
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._conn().execute(SCHEMA)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread, reopened after a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{self.cache_size_kib}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        row = self._conn().execute("""
+            INSERT INTO ratelimit(key, count, expires_at) VALUES(?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                count = CASE WHEN expires_at <= ? THEN excluded.count ELSE count + excluded.count END,
+                expires_at = CASE
+                    WHEN expires_at <= ? OR ? THEN excluded.expires_at
+                    ELSE expires_at
+                END
+            RETURNING count
+        """, (key, int(amount), now + expiry, now, now, bool(elastic_expiry))).fetchone()
+        with self._lock:
+            self._incrs += 1
+            compact = self._incrs % self.compact_every == 0
+        if compact:
+            self.compact()
+        return int(row[0])
+
+    def get(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT count FROM ratelimit WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT expires_at FROM ratelimit WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return float(row[0]) if row else now
+
+    def check(self) -> bool:
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        return self._conn().execute("DELETE FROM ratelimit").rowcount
+
+    def clear(self, key: str) -> None:
+        self._conn().execute("DELETE FROM ratelimit WHERE key = ?", (key,))
+
+    def compact(self) -> int:
+        """Drop expired windows; returns the number of rows removed."""
+        return self._conn().execute("DELETE FROM ratelimit WHERE expires_at <= ?", (time.time(),)).rowcount
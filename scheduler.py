@@ -0,0 +1,516 @@
+"""Fair, plan-weighted scheduling of per-account work (queued unfollows).
+
+Work is queued per account (one Instagram account = one ``users`` row) and
+``FairScheduler.next()`` hands out one item at a time:
+
+- Pacing: every account has a token bucket (``rate`` items per second, up
+  to ``burst``) and at most one item in flight. A failed item backs the
+  account off for ``backoff`` seconds, doubling per consecutive failure up
+  to ``max_backoff``, so an account that upstream is refusing goes quiet.
+- Fairness: weighted round robin (stride scheduling). Each account has a
+  pass value that grows by ``1 / weight`` per dispatched item; the ready
+  account with the lowest pass goes next, ties by arrival. An account that
+  (re)joins starts at the current pass, so idle time earns no credit. A
+  lifetime account with 5,000 items therefore interleaves with a free
+  account with 10 instead of running first, and under contention gets
+  ``weight`` times the free account's share, never more than its pacing.
+
+Per account the state is a few numbers plus a deque of job segments
+``[job_id, items, position]`` that reference the job's own
+target list, so a decision is a scan of the active accounts in memory with
+no database access. Time is read only through ``clock``, which makes the
+order deterministic under a fake clock.
+
+``Dispatcher`` is the threaded side: it claims jobs of one kind from the
+``JobQueue``, feeds their items to the scheduler, runs them on a small pool
+and checkpoints each job after every item.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from jobs import Job, JobFailed, JobLost, JobQueue
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {"free": 1, "starter": 2, "lifetime": 4}
+
+# Seconds an account was ready (paced and idle) before it got its turn.
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+class _Account:
+    __slots__ = ("key", "plan", "weight", "segments", "pending", "busy", "tokens", "stamp",
+                 "blocked_until", "failures", "ready_since", "pass_", "seq")
+
+    def __init__(self, key: Any, burst: float, now: float):
+        self.key = key
+        self.plan = "free"
+        self.weight = 1.0
+        self.segments: Deque[list] = deque()
+        self.pending = 0
+        self.busy = False
+        self.tokens = float(burst)  # tokens at ``stamp``
+        self.stamp = now
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.ready_since = now
+        self.pass_ = 0.0
+        self.seq = 0
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        rate: float = 0.5,
+        burst: float = 1,
+        weights: Optional[Dict[str, float]] = None,
+        backoff: float = 30.0,
+        max_backoff: float = 900.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = float(rate)  # <= 0: no pacing beyond one item in flight
+        self.burst = max(1.0, float(burst))
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._accounts: Dict[Any, _Account] = {}
+        self._active: Dict[Any, _Account] = {}  # accounts with queued items
+        self._vtime = 0.0
+        self._seq = 0
+        self.wait = Histogram(WAIT_BUCKETS)  # labels: plan
+        self.items = Counter()  # labels: plan, event (queued, dispatched, dropped)
+
+    # -- pacing --------------------------------------------------------
+
+    def _tokens(self, acct: _Account, now: float) -> float:
+        if self.rate <= 0:
+            return self.burst
+        return min(self.burst, acct.tokens + (now - acct.stamp) * self.rate)
+
+    def _ready_at(self, acct: _Account) -> float:
+        """Earliest time ``acct`` may dispatch, ignoring ``busy``."""
+        paced = acct.stamp if self.rate <= 0 else acct.stamp + max(0.0, 1 - acct.tokens) / self.rate
+        return max(acct.ready_since, acct.blocked_until, paced)
+
+    # -- queueing ------------------------------------------------------
+
+    def add(self, key: Any, plan: str, job_id: int, items: Sequence[Any]) -> None:
+        """Queue ``items`` of job ``job_id`` for account ``key`` on ``plan``."""
+        if not items:
+            return
+        now = self._clock()
+        with self._lock:
+            acct = self._accounts.get(key)
+            if acct is None:
+                acct = self._accounts[key] = _Account(key, self.burst, now)
+            acct.plan = plan
+            acct.weight = max(float(self.weights.get(plan, 1)), 1e-6)
+            if key not in self._active:
+                self._seq += 1
+                acct.seq = self._seq
+                acct.pass_ = max(acct.pass_, self._vtime)
+                if not acct.busy:
+                    acct.ready_since = now
+                self._active[key] = acct
+            acct.segments.append([job_id, items, 0])
+            acct.pending += len(items)
+        self.items.inc(plan, "queued", amount=len(items))
+
+    def drop(self, key: Any, job_id: int) -> int:
+        """Forget the queued items of one job; returns how many were dropped."""
+        with self._lock:
+            acct = self._active.get(key)
+            if acct is None:
+                return 0
+            dropped = sum(len(s[1]) - s[2] for s in acct.segments if s[0] == job_id)
+            acct.segments = deque(s for s in acct.segments if s[0] != job_id)
+            acct.pending -= dropped
+            if not acct.pending:
+                del self._active[key]
+            plan = acct.plan
+        if dropped:
+            self.items.inc(plan, "dropped", amount=dropped)
+        return dropped
+
+    # -- dispatching ---------------------------------------------------
+
+    def next(self) -> Optional[Tuple[Any, int, Any]]:
+        """``(account, job_id, item)`` to run now, or None if no account is ready.
+
+        Call ``done`` for the account once the item has finished.
+        """
+        now = self._clock()
+        with self._lock:
+            best = None
+            for acct in self._active.values():
+                if acct.busy or now < acct.blocked_until or self._tokens(acct, now) < 1:
+                    continue
+                if best is None or (acct.pass_, acct.seq) < (best.pass_, best.seq):
+                    best = acct
+            if best is None:
+                return None
+            waited = max(0.0, now - self._ready_at(best))
+            best.tokens = self._tokens(best, now) - 1
+            best.stamp = now
+            best.busy = True
+            self._vtime = max(self._vtime, best.pass_)
+            best.pass_ += 1 / best.weight
+            seg = best.segments[0]
+            job_id, item = seg[0], seg[1][seg[2]]
+            seg[2] += 1
+            if seg[2] >= len(seg[1]):
+                best.segments.popleft()
+            best.pending -= 1
+            if not best.pending:
+                del self._active[best.key]
+            plan = best.plan
+        self.wait.observe(waited, plan)
+        self.items.inc(plan, "dispatched")
+        return best.key, job_id, item
+
+    def done(self, key: Any, ok: bool = True) -> None:
+        """The in-flight item of ``key`` finished; a failure backs the account off."""
+        now = self._clock()
+        with self._lock:
+            acct = self._accounts.get(key)
+            if acct is None:
+                return
+            acct.busy = False
+            acct.ready_since = now
+            if ok:
+                acct.failures = 0
+            else:
+                acct.failures += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (acct.failures - 1))
+                acct.blocked_until = max(acct.blocked_until, now + delay)
+            if key not in self._active and self._forgettable(acct, now):
+                del self._accounts[key]
+
+    def _forgettable(self, acct: _Account, now: float) -> bool:
+        # Nothing left to remember once the bucket is full again and no backoff is running.
+        return (not acct.busy and not acct.pending and acct.blocked_until <= now
+                and self._tokens(acct, now) >= self.burst)
+
+    def reset(self) -> None:
+        """Forget every account, e.g. state inherited from the parent through a fork."""
+        self._lock = threading.Lock()
+        self._accounts = {}
+        self._active = {}
+        self._vtime = 0.0
+
+    def prune(self) -> int:
+        """Drop the pacing state of idle accounts that no longer need it."""
+        now = self._clock()
+        with self._lock:
+            idle = [k for k, a in self._accounts.items() if k not in self._active and self._forgettable(a, now)]
+            for k in idle:
+                del self._accounts[k]
+        return len(idle)
+
+    def next_ready_in(self) -> Optional[float]:
+        """Seconds until some account with queued items may dispatch (0 = now)."""
+        now = self._clock()
+        with self._lock:
+            times = [self._ready_at(a) for a in self._active.values() if not a.busy]
+        return max(0.0, min(times) - now) if times else None
+
+    def depth(self) -> Dict[str, int]:
+        """Queued items per plan."""
+        with self._lock:
+            out: Dict[str, int] = {}
+            for acct in self._active.values():
+                out[acct.plan] = out.get(acct.plan, 0) + acct.pending
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        with self._lock:
+            active = list(self._active.values())
+            in_flight = sum(1 for a in self._accounts.values() if a.busy)
+            blocked = sum(1 for a in self._accounts.values() if a.blocked_until > now)
+        waits = {labels[0]: {"count": s["count"], "avg": round(s["sum"] / s["count"], 3) if s["count"] else 0}
+                 for labels, s in self.wait.snapshot().items()}
+        return {
+            "accounts": len(active),
+            "queued": sum(a.pending for a in active),
+            "depth": self.depth(),
+            "in_flight": in_flight,
+            "backed_off": blocked,
+            "rate": self.rate,
+            "burst": self.burst,
+            "weights": self.weights,
+            "wait": waits,
+        }
+
+
+class _Held:
+    __slots__ = ("job", "key", "ctx", "total", "next", "done", "failed")
+
+    def __init__(self, job: Job, key: Any, ctx: Any, total: int):
+        self.job = job
+        self.key = key
+        self.ctx = ctx
+        self.total = total
+        self.next = int(job.checkpoint.get("next", 0))
+        self.done: List[Any] = list(job.checkpoint.get("done", []))
+        self.failed: List[Any] = list(job.checkpoint.get("failed", []))
+
+
+# open_job(job) -> (account key, plan, items, ctx); raise JobFailed to fail the job.
+OpenFn = Callable[[Job], Tuple[Any, str, Sequence[Any], Any]]
+# run_item(ctx, item) -> True on success.
+RunFn = Callable[[Any, Any], bool]
+# close_job(job, ctx, done, failed) -> result stored on the job; no side effects.
+CloseFn = Callable[[Job, Any, List[Any], List[Any]], Dict[str, Any]]
+# release(job): give back what was reserved for the items that did not succeed,
+# i.e. the checkpoint's ``failed`` plus every item from ``next`` on.
+ReleaseFn = Callable[[Job], None]
+
+
+class Dispatcher:
+    """Runs jobs of ``kind`` item by item in ``scheduler`` order.
+
+    Up to ``max_jobs`` jobs are claimed at once (one claim query per
+    ``refill_interval``); all jobs of one account are held by one process,
+    so its pacing holds across gunicorn workers. Each job's checkpoint is
+    ``{"next", "done", "failed"}``; a job taken over after a crash resumes
+    at ``next``. Leases of jobs still waiting for their turn are renewed in
+    one transaction every third of the lease.
+
+    A job ends exactly once: ``complete`` after its last item, or ``fail``
+    when ``open_job`` raises JobFailed, ``close_job`` raises, or it has
+    been claimed more than ``queue.max_attempts`` times. ``release`` runs
+    after either, and only if this process still held the lease, so a job
+    taken over by another process is not released twice.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        scheduler: FairScheduler,
+        kind: str,
+        open_job: OpenFn,
+        run_item: RunFn,
+        close_job: CloseFn,
+        release: Optional[ReleaseFn] = None,
+        concurrency: int = 4,
+        max_jobs: int = 200,
+        refill_interval: float = 1.0,
+    ):
+        self.queue = queue
+        self.scheduler = scheduler
+        self.kind = kind
+        self._open = open_job
+        self._run = run_item
+        self._close = close_job
+        self._release = release
+        self.concurrency = max(0, int(concurrency))
+        self.max_jobs = max(1, int(max_jobs))
+        self.refill_interval = float(refill_interval)
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._pid = os.getpid()
+        self._held: Dict[int, _Held] = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._counts = {"jobs_done": 0, "jobs_failed": 0, "jobs_lost": 0, "items_ok": 0, "items_failed": 0}
+
+    # -- jobs ----------------------------------------------------------
+
+    def refill(self) -> int:
+        """Claim runnable jobs up to ``max_jobs`` and queue their items."""
+        with self._lock:
+            room = self.max_jobs - len(self._held)
+        if room <= 0:
+            return 0
+        jobs = self.queue.claim_many(self.kind, room, self.owner, per_user=True)
+        for job in jobs:
+            if job.attempts > self.queue.max_attempts:
+                self._fail(job, f"gave up after {job.attempts - 1} attempts")
+                continue
+            try:
+                key, plan, items, ctx = self._open(job)
+            except JobFailed as e:
+                self._fail(job, str(e))
+                continue
+            held = _Held(job, key, ctx, len(items))
+            with self._lock:
+                self._held[job.id] = held
+            if held.next >= held.total:
+                self._finish(held)
+            else:
+                self.scheduler.add(key, plan, job.id, items[held.next:])
+        return len(jobs)
+
+    def renew(self) -> None:
+        with self._lock:
+            jobs = [h.job for h in self._held.values()]
+        for job_id in self.queue.renew(jobs):
+            self._lose(job_id)
+
+    def _lose(self, job_id: int) -> None:
+        with self._lock:
+            held = self._held.pop(job_id, None)
+        if held is not None:
+            self.scheduler.drop(held.key, job_id)
+            self._count("jobs_lost")
+            logger.warning("Job %s: lease lost, dropping", job_id)
+
+    def _finish(self, held: _Held) -> None:
+        with self._lock:
+            self._held.pop(held.job.id, None)
+        try:
+            result = self._close(held.job, held.ctx, held.done, held.failed)
+        except Exception as e:
+            logger.exception("Job %s (%s): close failed", held.job.id, self.kind)
+            self._fail(held.job, str(e))
+            return
+        if self.queue.complete(held.job, result):
+            self._count("jobs_done")
+            self._settle(held.job)
+
+    def _fail(self, job: Job, error: str) -> None:
+        if self.queue.fail(job, error):
+            self._count("jobs_failed")
+            self._settle(job)
+
+    def _settle(self, job: Job) -> None:
+        if self._release is None:
+            return
+        try:
+            self._release(job)
+        except Exception:
+            logger.exception("Job %s (%s): release failed", job.id, self.kind)
+
+    # -- items ---------------------------------------------------------
+
+    def _execute(self, key: Any, job_id: int, item: Any) -> None:
+        with self._lock:
+            held = self._held.get(job_id)
+        ok = False
+        try:
+            if held is not None:
+                try:
+                    ok = bool(self._run(held.ctx, item))
+                except Exception:
+                    logger.exception("Job %s (%s): item failed", job_id, self.kind)
+                (held.done if ok else held.failed).append(item)
+                held.next += 1
+                self._count("items_ok" if ok else "items_failed")
+                try:
+                    held.job.save({"next": held.next, "done": held.done, "failed": held.failed},
+                                  processed=held.next, total=held.total)
+                except JobLost:
+                    self._lose(job_id)
+                else:
+                    if held.next >= held.total:
+                        self._finish(held)
+        finally:
+            self.scheduler.done(key, ok or held is None)
+            with self._lock:
+                self._in_flight -= 1
+            self._wake.set()
+
+    def run_ready(self) -> int:
+        """Run every ready item in the calling thread, without the pool; returns how many."""
+        ran = 0
+        while True:
+            picked = self.scheduler.next()
+            if picked is None:
+                return ran
+            with self._lock:
+                self._in_flight += 1
+            self._execute(*picked)
+            ran += 1
+
+    def dispatch(self) -> int:
+        """Start as many ready items as there are free slots; returns how many."""
+        started = 0
+        while not self._stop.is_set():
+            with self._lock:
+                if self._in_flight >= self.concurrency:
+                    break
+            picked = self.scheduler.next()
+            if picked is None:
+                break
+            with self._lock:
+                self._in_flight += 1
+            self._pool.submit(self._execute, *picked)
+            started += 1
+        return started
+
+    # -- lifecycle -----------------------------------------------------
+
+    def _loop(self) -> None:
+        next_refill = next_renew = 0.0
+        renew_every = max(1.0, self.queue.lease_seconds / 3)
+        while not self._stop.is_set():
+            now = time.monotonic()
+            try:
+                if now >= next_renew:
+                    next_renew = now + renew_every
+                    self.renew()
+                    self.scheduler.prune()
+                if now >= next_refill:
+                    next_refill = now + self.refill_interval
+                    self.refill()
+                self.dispatch()
+            except Exception:
+                logger.exception("Dispatcher (%s) error", self.kind)
+            ready_in = self.scheduler.next_ready_in()
+            timeout = max(0.0, next_refill - time.monotonic())
+            if ready_in is not None:
+                timeout = min(timeout, ready_in)
+            self._wake.wait(max(timeout, 0.01))
+            self._wake.clear()
+
+    def start(self) -> None:
+        if not self.concurrency or (self._thread is not None and self._thread.is_alive()):
+            return  # a thread inherited through a fork is not alive here
+        if self._pid != os.getpid():
+            # Forked: the parent's jobs, in-flight items and pacing are the parent's.
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._held = {}
+            self._in_flight = 0
+            self.scheduler.reset()
+        self._stop.clear()
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix=f"{self.kind}-item")
+        self._thread = threading.Thread(target=self._loop, name=f"{self.kind}-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("Dispatcher (%s): started, %s item slot(s)", self.kind, self.concurrency)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            held, in_flight = len(self._held), self._in_flight
+        return {"running": self._thread is not None, "concurrency": self.concurrency,
+                "held_jobs": held, "in_flight": in_flight, **counts,
+                "scheduler": self.scheduler.stats()}
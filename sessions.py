@@ -0,0 +1,106 @@
+"""App sessions: opaque tokens mapped to a ``users`` row, with expiry.
+
+A login creates a random 32-hex token in ``sessions`` (token -> user_id,
+expires_at). Lookups join the compact ``users`` row only; the Instagram
+cookie blob lives in ``user_session_data`` and is read by the code that
+talks to Instagram. Tokens slide: a lookup in the second half of the
+lifetime pushes ``expires_at`` out by another ``ttl``, so that costs at
+most one write per half-lifetime. Expired tokens are refused at lookup
+and deleted by ``sweep``, which runs every ``sweep_interval`` seconds.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    def __init__(
+        self,
+        db: Callable[[], ContextManager[sqlite3.Connection]],
+        ttl: float = 30 * 86400,
+        sweep_interval: float = 3600,
+        sweep_batch: int = 5000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._db = db
+        self.ttl = float(ttl)
+        self.sweep_interval = float(sweep_interval)
+        self.sweep_batch = max(1, int(sweep_batch))
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def create(self, cur: sqlite3.Cursor, user_id: int) -> str:
+        """New token for ``user_id``, written inside the caller's transaction."""
+        token = os.urandom(16).hex()
+        now = self._clock()
+        cur.execute("INSERT INTO sessions(token, user_id, created_at, expires_at) VALUES(?,?,?,?)",
+                    (token, int(user_id), now, now + self.ttl))
+        return token
+
+    def lookup(self, token: str) -> Optional[sqlite3.Row]:
+        """``users`` row plus ``expires_at`` for a live token, else None."""
+        now = self._clock()
+        with self._db() as conn:
+            row = conn.execute("""
+                SELECT u.*, s.expires_at FROM sessions s JOIN users u ON u.id = s.user_id
+                WHERE s.token = ? AND s.expires_at > ?
+            """, (token, now)).fetchone()
+            if row is not None and row["expires_at"] - now < self.ttl / 2:
+                conn.execute("UPDATE sessions SET expires_at = ? WHERE token = ?", (now + self.ttl, token))
+                conn.commit()
+        return row
+
+    def revoke(self, token: str) -> None:
+        with self._db() as conn:
+            conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+            conn.commit()
+
+    def sweep(self) -> int:
+        """Delete expired tokens in batches; returns how many were removed."""
+        removed = 0
+        while True:
+            with self._db() as conn:
+                n = conn.execute("""
+                    DELETE FROM sessions WHERE token IN (
+                        SELECT token FROM sessions WHERE expires_at <= ? LIMIT ?
+                    )
+                """, (self._clock(), self.sweep_batch)).rowcount
+                conn.commit()
+            removed += n
+            if n < self.sweep_batch:
+                if removed:
+                    logger.info("Sessions: swept %s expired", removed)
+                return removed
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except sqlite3.Error as e:
+                logger.warning("Sessions: sweep failed: %s", e)
+
+    def start(self) -> None:
+        if not self.sweep_interval or (self._thread is not None and self._thread.is_alive()):
+            return  # a thread inherited through a fork is not alive here
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="session-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db() as conn:
+            live, users = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT user_id) FROM sessions WHERE expires_at > ?", (self._clock(),)
+            ).fetchone()
+        return {"live": live, "users": users, "ttl": self.ttl, "running": self._thread is not None}
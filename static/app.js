@@ -0,0 +1 @@
+let currentSessionId='';let selectedPlan="starter";const csrfToken=document.querySelector('meta[name="csrf-token"]').getAttribute('content');const modal=document.getElementById("paymentModal");const addr=document.querySelector('meta[name="pay-address"]').getAttribute('content');function setPill(id,text){const el=document.getElementById(id);if(el)el.textContent=text}function addLog(msg){const logs=document.getElementById('logs');const time=new Date().toLocaleTimeString();logs.innerHTML+=`<div><span style="opacity:0.6">[${time}]</span> ${msg}</div>`;logs.scrollTop=logs.scrollHeight}async function refreshMe(){if(!currentSessionId)return;try{const res=await fetch('/api/me',{headers:{'X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken}});const data=await res.json();if(data.ok){setPill('quotaState',`Plan: ${data.plan} • Credits: ${data.credits}`)}}catch(e){console.error('Failed to refresh user data:',e)}}async function login(){const s=document.getElementById('sessionid').value.trim();if(!s){addLog('❌ Error: Please paste sessionid');return}const btn=document.getElementById('loginBtn');btn.disabled=true;btn.textContent='VERIFYING...';try{const res=await fetch('/login',{method:'POST',headers:{'Content-Type':'application/json','X-CSRF-Token':csrfToken},body:JSON.stringify({cookies:s})});const data=await res.json();if(!data.success){addLog('❌ Login failed: '+(data.error||'unknown'));return}currentSessionId=data.session_id;setPill('authState','Signed in: @'+data.username);document.getElementById('loginBox').classList.add('hidden');document.getElementById('appBox').classList.remove('hidden');addLog('✅ Login OK: @'+data.username);await refreshMe();startEvents()}catch(e){addLog('❌ Network error during login');console.error(e)}finally{btn.disabled=false;btn.textContent='LOGIN'}}let events=null;const jobWaiters={},lastJob={};function startEvents(){if(!window.EventSource||events||!currentSessionId)return;events=new EventSource('/api/events');events.addEventListener('me',e=>{const d=JSON.parse(e.data);setPill('quotaState',`Plan: ${d.plan} • Credits: ${d.credits}`)});events.addEventListener('payment',()=>loadMyRequests());events.addEventListener('job',e=>{const j=JSON.parse(e.data);lastJob[j.id]=j;if(jobWaiters[j.id])jobWaiters[j.id](j)});events.onerror=()=>{if(events&&events.readyState===EventSource.CLOSED)events=null}}function stopEvents(){if(events){events.close();events=null}}let nextOffset=null;async function waitJob(id,onProgress){for(;;){const c=lastJob[id];if(c&&(c.status==='done'||c.status==='failed')){delete lastJob[id];if(onProgress)onProgress(c);return c}let j=await new Promise(r=>{const t=setTimeout(()=>{delete jobWaiters[id];r(null)},events?15000:1500);jobWaiters[id]=p=>{clearTimeout(t);delete jobWaiters[id];r(p)}});if(!j){const res=await fetch('/api/jobs/'+id,{headers:{'X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken}});j=await res.json();if(!j.ok)throw new Error(j.error||res.status)}if(onProgress)onProgress(j);if(j.status==='done'||j.status==='failed'){delete lastJob[id];return j}}}async function scan(){const btn=document.getElementById('scanBtn');btn.disabled=true;btn.textContent='SCANNING...';document.getElementById('results').innerHTML='';addLog('🔍 Scanning followers/following...');try{const res=await fetch('/scan',{method:'POST',headers:{'Content-Type':'application/json','X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken},body:'{}'});const data=await res.json();if(!data.success){addLog('❌ Scan failed: '+(data.error||res.status));return}const job=await waitJob(data.job_id,j=>{document.getElementById('scanInfo').textContent=`Scanning… ${j.progress.pages||0} pages • ${j.progress.items||0} accounts`});if(job.status!=='done'){addLog('❌ Scan failed: '+(job.error||'unknown'));return}const r=job.result;document.getElementById('scanInfo').textContent=`Followers: ${r.followers} • Following: ${r.following} • Not following back: ${r.count}`;addLog('✅ Scan complete: '+r.count+' not following back');nextOffset=0;await loadMore()}catch(e){addLog('❌ Network error during scan');console.error(e)}finally{btn.disabled=false;btn.textContent='Scan non-followers'}}async function loadMore(){if(nextOffset===null)return;try{const res=await fetch('/api/scan/results?offset='+nextOffset+'&limit=50',{headers:{'X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken}});const data=await res.json();if(!data.success){addLog('❌ '+(data.error||res.status));return}renderList(data)}catch(e){console.error('Failed to load results:',e)}}function renderList(data){const box=document.getElementById('results');const more=document.getElementById('moreBtn');if(more)more.remove();for(const u of data.users){const row=document.createElement('div');row.className='user-row';const meta=document.createElement('div');meta.className='user-meta';const name=document.createElement('strong');name.textContent='@'+u.username;const sub=document.createElement('div');sub.className='sub';sub.textContent=(u.full_name||'')+(u.is_private?' • private':'')+(u.is_verified?' • verified':'');meta.appendChild(name);meta.appendChild(sub);row.appendChild(meta);const ub=document.createElement('button');ub.className='btn-danger';ub.textContent='Unfollow';ub.onclick=()=>unfollow(u.pk,ub);row.appendChild(ub);box.appendChild(row)}nextOffset=data.next_offset;if(nextOffset!==null){const b=document.createElement('button');b.id='moreBtn';b.className='action-btn secondary';b.style.marginTop='10px';b.textContent='Load more';b.onclick=loadMore;box.appendChild(b)}}async function unfollow(userId,btn){btn.disabled=true;btn.textContent='...';try{const res=await fetch('/unfollow',{method:'POST',headers:{'Content-Type':'application/json','X-Session-ID':currentSessionId,'X-CSRF-Token':csrfToken},body:JSON.stringify({user_id:String(userId)})});const data=await res.json();if(!data.success){addLog('❌ Unfollow failed: '+(data.error||res.status));btn.disabled=false;btn.textContent='Unfollow';return}const job=await waitJob(data.job_id);if(job.status==='done'&&job.result.unfollowed.length){btn.textContent='Done';addLog('✅ Unfollowed '+userId);await refreshMe()}else{btn.disabled=false;btn.textContent='Unfollow';addLog('❌ Unfollow failed: '+(job.error||(job.result&&job.result.stopped)||'upstream error'))}}catch(e){btn.disabled=false;btn.textContent='Unfollow';addLog('❌ Network error during unfollow');console.error(e)}}function logoutLocal(){stopEvents();currentSessionId='';document.getElementById('sessionid').value='';document.getElementById('appBox').classList.add('hidden');document.getElementById('loginBox').classList.remove('hidden');setPill('authState','Not signed in');setPill('quotaState','Plan: — • Credits: —');document.getElementById('results').innerHTML='';document.getElementById('scanInfo').textContent='';addLog('👋 Signed out (local).')}function openModal(){modal.classList.add("active");document.getElementById("payStatus").textContent="";document.getElementById("myReq").textContent="";loadMyRequests()}function closeModal(){modal.classList.remove("active")}modal.addEventListener("click",(e)=>{if(e.target===modal)closeModal()});function copyAddress(){if(!addr){alert("Payment address not configured on server.");return}navigator.clipboard.writeText(addr).then(()=>{document.getElementById("payStatus").textContent="✅ Address copied.";setTimeout(()=>document.getElementById("payStatus").textContent="",1200)}).catch(()=>prompt("Copy address:",addr))}function selectPlan(p){selectedPlan=p;const hint=document.getElementById("planHint");if(p==="starter")hint.innerHTML="Selected: STARTER — expected amount: <b>5 USDT</b> (TRC20)";else hint.innerHTML="Selected: LIFETIME — expected amount: <b>9 USDT</b> (TRC20)"}function openTronScan(){const txid=document.getElementById("txid").value.trim();if(txid){window.open("https://tronscan.org/#/transaction/"+txid,"_blank")}else{window.open("https://tronscan.org/","_blank")}}async function submitTxid(){if(!currentSessionId){alert("Login first");return}if(!addr){document.getElementById("payStatus").textContent="❌ Server missing PAYMENT_ADDRESS_TRC20 env.";return}const txid=document.getElementById("txid").value.trim();if(!txid){document.getElementById("payStatus").textContent="❌ Paste TXID first.";return}document.getElementById("payStatus").textContent="⏳ Submitting…";try{const res=await fetch("/api/payment/submit-txid",{method:"POST",headers:{"Content-Type":"application/json","X-CSRF-Token":csrfToken,"X-Session-ID":currentSessionId},body:JSON.stringify({plan:selectedPlan,txid})});const j=await res.json();if(!j.ok){document.getElementById("payStatus").textContent="❌ Error: "+(j.error||res.status);return}document.getElementById("payStatus").textContent="✅ Submitted. Status: pending (manual review).";document.getElementById("txid").value="";await loadMyRequests()}catch(e){document.getElementById("payStatus").textContent="❌ Network error";console.error(e)}}async function loadMyRequests(){if(!currentSessionId)return;try{const res=await fetch("/api/payment/my-requests",{headers:{"X-Session-ID":currentSessionId,"X-CSRF-Token":csrfToken}});const j=await res.json();if(!j.ok){document.getElementById("myReq").textContent="";return}const items=j.items||[];if(!items.length){document.getElementById("myReq").textContent="No payment requests yet.";return}const top=items[0];let statusEmoji=top.status==='approved'?'✅':top.status==='rejected'?'❌':'⏳';document.getElementById("myReq").textContent=`${statusEmoji} Latest: ${top.plan.toUpperCase()} • ${top.status} • TXID: ${top.txid.slice(0,10)}…`;if(top.status==="approved"){await refreshMe()}}catch(e){console.error('Failed to load payment requests:',e)}}selectPlan("starter");
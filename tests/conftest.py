@@ -0,0 +1,52 @@
+"""Shared fixtures. The app module reads its settings at import, so the
+environment below is set before the first ``import app``; every test
+that needs the app shares one temporary database and logs in with its
+own Instagram account.
+"""
+import itertools
+import logging
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.update({
+    "DB_PATH": os.path.join(tempfile.mkdtemp(prefix="tests-"), "app.db"),
+    "RATELIMIT_STORAGE_URI": "memory://",
+    "METRICS_DIR": "",
+    "JOB_WORKERS": "0",
+    "UNFOLLOW_CONCURRENCY": "0",
+    "LEDGER_MAINTENANCE_INTERVAL": "0",
+    "PAYMENT_VERIFY_PROVIDER": "",
+})
+
+_ig_ids = itertools.count(10 ** 9)
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    logging.disable(logging.WARNING)
+    import app
+
+    app.create_app()
+    app.app.config["WTF_CSRF_ENABLED"] = False
+    app.limiter.enabled = False
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def login(app_module):
+    """``login(sessionid="...") -> (user_id, token)`` for a fresh account."""
+    def _login(sessionid: str = "ig-session"):
+        ig_id = next(_ig_ids)
+        return app_module.upsert_user_on_login(str(ig_id), f"user{ig_id}", {"sessionid": sessionid})
+    return _login
@@ -0,0 +1,22 @@
+from dbpool import ConnectionPool, query_label
+
+
+def test_every_statement_is_timed(tmp_path):
+    seen = []
+    pool = ConnectionPool(str(tmp_path / "pool.db"), max_size=1,
+                          on_query=lambda sql, seconds: seen.append(query_label(sql)))
+    with pool.connection() as conn:
+        seen.clear()
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.executemany("INSERT INTO t(x) VALUES(?)", [(1,), (2,)])
+        conn.cursor().execute("UPDATE t SET x = x + 1")
+        rows = conn.execute("SELECT x FROM t ORDER BY x").fetchall()
+
+    assert [r[0] for r in rows] == [2, 3]
+    assert seen == ["create", "insert t", "update t", "select t"]
+
+
+def test_untimed_pool_uses_plain_connections(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "plain.db"), max_size=1)
+    with pool.connection() as conn:
+        assert conn.execute("SELECT 1").fetchone()[0] == 1
@@ -0,0 +1,45 @@
+import threading
+
+from diffengine import NonFollowerDiff
+
+
+def _diff(n):
+    diff = NonFollowerDiff()
+    diff.add_follower_ids([])
+    diff.seal_followers()
+    diff.add_following({"pk": pk, "username": f"u{pk:05d}"} for pk in range(1, n + 1))
+    return diff.finish()
+
+
+def test_discard_drops_the_account_everywhere():
+    diff = _diff(5)
+
+    diff.discard(3)
+    diff.discard(3)  # already gone
+    diff.discard(99)  # never followed
+
+    assert list(diff.order) == [1, 2, 4, 5] and list(diff.following) == [1, 2, 4, 5]
+    assert [u["pk"] for u in diff.page(1, 2)] == [2, 4]
+    assert 3 not in diff.records
+
+
+def test_pages_stay_consistent_while_discarding():
+    diff = _diff(1000)
+    errors = []
+
+    def read():
+        try:
+            while len(diff) > 100:
+                diff.page(0, 200)
+        except Exception as e:  # KeyError when order and records disagree
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for t in readers:
+        t.start()
+    for pk in range(1, 901):
+        diff.discard(pk)
+    for t in readers:
+        t.join()
+
+    assert errors == [] and len(diff) == 100
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+import pytest
+
+import migrations
+from events import EventBus
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "events.db")
+    migrations.upgrade(path)
+    return path
+
+
+def test_idle_poller_does_not_replay_old_events(path):
+    local = EventBus(path, poll_interval=0.01, max_subscribers=4)
+    remote = EventBus(path, poll_interval=0.01)  # another worker
+    local.subscribe("warmup").close()  # starts the poller, then nobody listens
+    time.sleep(0.1)  # let it read its starting id
+
+    for n in range(3):
+        remote.publish("7", "me", {"n": n})
+    time.sleep(0.2)
+
+    sub = local.subscribe("7")
+    remote.publish("7", "me", {"n": 3})
+
+    assert sub.get(timeout=2) == ("me", {"n": 3})
+    assert sub.get(timeout=0.1) is None
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_workers_deliver_to_each_other(path):
+    bus = EventBus(path, poll_interval=0.01, max_subscribers=4)  # built before the fork, like --preload
+    ready_r, ready_w = os.pipe()
+    out_r, out_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # worker holding the stream
+        try:
+            os.close(ready_r)
+            os.close(out_r)
+            sub = bus.subscribe("7")
+            time.sleep(0.1)  # let the poller read its starting id
+            os.write(ready_w, b"1")
+            os.write(out_w, json.dumps([bus.origin, sub.get(timeout=3)]).encode())
+        finally:
+            os._exit(0)
+    os.close(ready_w)  # so a worker that died reads as EOF
+    os.close(out_w)
+    try:
+        assert os.read(ready_r, 1), "worker died before subscribing"
+        bus.publish("7", "me", {"credits": 5})  # worker that handled the request
+        origin, item = json.loads(os.read(out_r, 4096) or "[null, null]")
+    finally:
+        os.close(ready_r)
+        os.close(out_r)
+        os.waitpid(pid, 0)
+
+    assert origin != bus.origin
+    assert item == ["me", {"credits": 5}]
+
+
+def _first_event(resp):
+    try:
+        return next(iter(resp.response))
+    finally:
+        resp.close()
+
+
+def test_login_sets_an_httponly_cookie_scoped_to_events(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "get_user_info", lambda sessionid: {"username": "cookie_user", "pk": 424242})
+
+    resp = client.post("/login", json={"cookies": "ig-session-value"})
+
+    assert resp.get_json()["success"]
+    cookie = resp.headers["Set-Cookie"]
+    assert cookie.startswith(f"{app_module.SSE_COOKIE}={resp.get_json()['session_id']};")
+    assert "HttpOnly" in cookie and "Path=/api/events" in cookie and "SameSite=Strict" in cookie
+
+
+def test_event_stream_authenticates_with_the_cookie_only(app_module, client, login):
+    _, token = login()
+
+    assert client.get(f"/api/events?session={token}").status_code == 401
+
+    client.set_cookie(app_module.SSE_COOKIE, token, path="/api/events")
+    resp = client.get("/api/events")
+    assert resp.status_code == 200 and resp.mimetype == "text/event-stream"
+    assert b"event: me" in _first_event(resp)
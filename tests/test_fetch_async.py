@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+from fetch_async import AsyncFetchEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+from fake_instagram import ME_PK, serve  # noqa: E402
+
+
+@pytest.fixture
+def stub(app_module, monkeypatch):
+    """The local Instagram stub, with the app pointed at it."""
+    started = []
+
+    def start(**config):
+        server, fake = serve(**config)
+        started.append(server)
+        monkeypatch.setattr(app_module, "INSTAGRAM_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+        monkeypatch.setattr(app_module, "SCAN_PAGE_DELAY", 0)
+        return fake
+
+    yield start
+    for server in started:
+        server.shutdown()
+
+
+def test_paginate_walks_every_page_and_waits_out_429(app_module, stub):
+    stub(followers=250, following=0, latency=0.01, throttle_every=3, retry_after=0.05)
+    engine = AsyncFetchEngine(app_module._fetch_page_json, global_limit=4, per_account_limit=2)
+
+    async def walk():
+        pages = engine.paginate(
+            "acct", engine.account_semaphore(), "s1",
+            make_url=lambda cursor: app_module.friendship_url(ME_PK, "followers", cursor, page_size=50),
+            next_cursor=lambda data: data.get("next_max_id"),
+        )
+        return [data async for _, data in pages]
+
+    pages = engine.run_sync(walk())
+
+    assert all(data is not None for data in pages)
+    assert [u["pk"] for data in pages for u in data["users"]] == list(range(250, 0, -1))
+    stats = engine.stats()
+    assert stats["throttled"] >= 1 and stats["requests"] == len(pages) + stats["throttled"]
+
+
+def test_account_limit_caps_requests_in_flight(app_module, stub):
+    fake = stub(latency=0.05)
+    engine = AsyncFetchEngine(app_module._fetch_page_json, global_limit=8, per_account_limit=2)
+    url = app_module.friendship_url(ME_PK, "followers", None)
+
+    async def burst():
+        sem = engine.account_semaphore()
+        return await asyncio.gather(*(engine.get_json("acct", sem, url, "s1") for _ in range(6)))
+
+    assert all(engine.run_sync(burst()))
+    assert fake.max_in_flight == 2
+
+
+def test_concurrent_scan_matches_sequential(app_module, stub):
+    stub(followers=300, following=400, overlap=150, latency=0.005)
+
+    results = {}
+    for concurrent in (False, True):
+        diff, heads, stats = app_module.collect_friendships("s1", str(ME_PK), None, None, concurrent=concurrent)
+        results[concurrent] = (sorted(diff.order), len(diff.followers), len(diff.following), stats["pages"])
+
+    assert results[True] == results[False]
+    assert len(results[True][0]) == 400 - 150
+
+
+def test_expired_blocks_are_forgotten(app_module):
+    engine = AsyncFetchEngine(app_module._fetch_page_json)
+    for n in range(100):
+        engine._throttle(f"acct{n}", 0)
+
+    engine._throttle("busy", 60)
+    engine.run_sync(engine._wait_unblocked("acct99"))
+
+    assert list(engine._blocked_until) == ["busy"]
+    assert engine.stats()["blocked_accounts"] == 1
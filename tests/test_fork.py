@@ -0,0 +1,74 @@
+"""gunicorn --preload: create_app() runs in the master, start_background() in each forked worker."""
+import json
+import os
+import time
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+
+def _wait_job(app_module, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = app_module.job_queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    return job
+
+
+def test_worker_forked_after_create_app_runs_its_own_background(app_module):
+    a = app_module
+    a.create_app()
+    with a.db() as conn:  # nothing else may be claimed by the forked worker
+        conn.execute("DELETE FROM jobs")
+        conn.commit()
+    a.job_queue.handler("fork_probe")(lambda job: {"pid": os.getpid()})
+    # Per-process state the master may have built before forking.
+    a.event_bus.publish("0", "me", {})
+    assert a.fetch_engine.executor.submit(os.getpid).result() == os.getpid()
+    parent = {"origin": a.event_bus.origin, "owner": a.unfollow_dispatcher.owner}
+
+    ready_r, ready_w = os.pipe()
+    stop_r, stop_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(ready_r)
+            os.close(stop_w)
+            a.job_queue.workers = 1
+            a.job_queue.poll_interval = 0.05
+            a.unfollow_dispatcher.concurrency = 1
+            a.start_background()
+            a.event_bus.publish("0", "me", {})
+            state = {
+                "origin": a.event_bus.origin,
+                "owner": a.unfollow_dispatcher.owner,
+                "worker_id": a.job_queue.worker_id,
+                "threads": [t.is_alive() for t in a.job_queue._threads + [a.unfollow_dispatcher._thread]],
+                "fetch": a.fetch_engine.executor.submit(os.getpid).result(timeout=5),
+            }
+            os.write(ready_w, json.dumps(state).encode())
+            os.read(stop_r, 1)
+        finally:
+            os._exit(0)
+    os.close(ready_w)  # so a worker that died reads as EOF
+    os.close(stop_r)
+    try:
+        child = json.loads(os.read(ready_r, 4096) or "null")
+        assert child is not None, "worker died before reporting"
+        job_id = a.job_queue.enqueue("fork_probe", 1)
+        job = _wait_job(a, job_id)
+    finally:
+        os.close(stop_w)  # EOF tells the worker to exit
+        os.close(ready_r)
+        os.waitpid(pid, 0)
+        a.job_queue.handlers.pop("fork_probe", None)
+
+    assert child["origin"] != parent["origin"]
+    assert child["owner"] != parent["owner"] and child["owner"].startswith(f"{pid}-")
+    assert child["worker_id"].startswith(f"{pid}-")
+    assert child["threads"] == [True, True]
+    assert child["fetch"] == pid
+    assert job["status"] == "done" and job["result"] == {"pid": pid}
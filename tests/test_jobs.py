@@ -0,0 +1,96 @@
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import migrations
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    migrations.upgrade(path)
+
+    @contextmanager
+    def db():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    return JobQueue(db, workers=0, keep_seconds=3600)
+
+
+def test_job_belongs_to_the_user_across_logins(app_module, client, login):
+    user_id, token = login()
+    resp = client.post("/unfollow", json={"user_id": "5"}, headers={"X-Session-ID": token})
+    job_id = resp.get_json()["job_id"]
+
+    _, new_token = app_module.upsert_user_on_login(
+        app_module.get_current_user(token)["ig_user_id"], "again", {"sessionid": "fresh"})
+    assert new_token != token
+
+    resp = client.get(f"/api/jobs/{job_id}", headers={"X-Session-ID": new_token})
+    assert resp.status_code == 200 and resp.get_json()["status"] == "queued"
+    assert app_module.job_queue.find_active("unfollow", user_id) == job_id
+
+    _, other = login()
+    assert client.get(f"/api/jobs/{job_id}", headers={"X-Session-ID": other}).status_code == 404
+
+
+def test_migration_backfills_job_owner(tmp_path):
+    path = str(tmp_path / "old.db")
+    migrations.upgrade(path, target=9)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users(id, ig_user_id, created_at, updated_at) VALUES(7, '70', '', '')")
+    conn.execute("INSERT INTO sessions(token, user_id, created_at, expires_at) VALUES('tok', 7, 0, 9e9)")
+    for kind, session_id, payload in (("scan", "tok", "{}"), ("unfollow", "gone", '{"user_id": 7}'),
+                                      ("scan", "gone", "{}")):
+        conn.execute("INSERT INTO jobs(kind, session_id, payload, created_at, updated_at) VALUES(?,?,?,'','')",
+                     (kind, session_id, payload))
+    conn.commit()
+    conn.close()
+
+    migrations.upgrade(path)
+
+    conn = sqlite3.connect(path)
+    assert [r[0] for r in conn.execute("SELECT user_id FROM jobs ORDER BY id")] == [7, 7, None]
+
+
+def test_prune_removes_only_old_finished_jobs(queue):
+    ids = [queue.enqueue("scan", 1) for _ in range(4)]
+    old = "2000-01-01T00:00:00Z"
+    with queue._db() as conn:
+        conn.execute("UPDATE jobs SET status = 'done', updated_at = ? WHERE id = ?", (old, ids[0]))
+        conn.execute("UPDATE jobs SET status = 'failed', updated_at = ? WHERE id = ?", (old, ids[1]))
+        conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (old, ids[2]))  # still queued
+        conn.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (ids[3],))  # recent
+        conn.commit()
+
+    assert queue.prune() == 2
+    assert [queue.get(i) is not None for i in ids] == [False, False, True, True]
+    assert queue.stats()["pruned"] == 2
+
+
+def test_workers_only_claim_kinds_with_a_handler(queue):
+    queue.handler("scan")(lambda job: {"ok": True})
+    unfollow = queue.enqueue("unfollow", 1)
+    scan = queue.enqueue("scan", 1)
+
+    assert queue.run_one()
+    assert queue.get(scan)["status"] == "done"
+    assert queue.get(unfollow)["status"] == "queued"
+    assert not queue.run_one()
+
+
+def test_claim_many_keeps_one_users_jobs_with_one_owner(queue):
+    a1 = queue.enqueue("unfollow", 1)
+    a2 = queue.enqueue("unfollow", 1)
+    b = queue.enqueue("unfollow", 2)
+
+    assert [j.id for j in queue.claim_many("unfollow", 1, "proc-a", per_user=True)] == [a1]
+    assert [j.id for j in queue.claim_many("unfollow", 5, "proc-b", per_user=True)] == [b]
+    assert [j.id for j in queue.claim_many("unfollow", 5, "proc-a", per_user=True)] == [a2]
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import migrations
+from ledger import DAY, ActionLedger
+
+
+class Clock:
+    def __init__(self, t: float):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    migrations.upgrade(path)
+
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    with connect() as conn:
+        conn.execute("INSERT INTO users(id, ig_user_id, created_at, updated_at) VALUES(1, '1', '', '')")
+        conn.commit()
+    return connect
+
+
+def _record(ledger, db, targets, ts):
+    with db() as conn:
+        ledger.record(conn.cursor(), 1, "unfollow", targets, -1, ts=ts)
+        conn.commit()
+
+
+def test_ids_are_not_reused_after_archiving_the_newest_rows(db, tmp_path):
+    clock = Clock(100 * DAY)
+    ledger = ActionLedger(db, archive_dir=str(tmp_path / "archive"), retention_days=1, clock=clock)
+    _record(ledger, db, [1, 2, 3], ts=int(clock.t))
+    ledger.rollup()
+    clock.t += 2 * DAY
+    assert ledger.archive() == 3  # the table is empty now
+
+    _record(ledger, db, [4], ts=int(clock.t))
+    with db() as conn:
+        assert conn.execute("SELECT id FROM actions").fetchall() == [(4,)]
+    assert ledger.rollup() == 1
+    with db() as conn:
+        assert conn.execute("SELECT SUM(count) FROM actions_daily").fetchone()[0] == 4
+
+    clock.t += 2 * DAY
+    assert ledger.archive() == 1
+    assert sorted(os.listdir(tmp_path / "archive")) == [
+        "actions-000000000001-000000000003.ndjson.gz",
+        "actions-000000000004-000000000004.ndjson.gz",
+    ]
+
+
+def test_archive_writes_the_file_outside_the_write_lock(db, tmp_path):
+    clock = Clock(100 * DAY)
+    archive_dir = str(tmp_path / "archive")
+    ledger = ActionLedger(db, archive_dir=archive_dir, retention_days=1, clock=clock)
+    other = ActionLedger(db, archive_dir=archive_dir, retention_days=1, clock=clock)  # another worker
+    _record(ledger, db, [1, 2, 3], ts=int(clock.t))
+    ledger.rollup()
+    clock.t += 2 * DAY
+    write = ledger._write_archive
+    raced = []
+
+    def write_and_race(first, last, rows):
+        written = write(first, last, rows)
+        with db() as conn:
+            conn.execute("PRAGMA busy_timeout = 0")
+            conn.execute("BEGIN IMMEDIATE")  # raises "database is locked" if archive() held it
+            conn.rollback()
+        if not raced:
+            raced.append(other.archive())
+        return written
+
+    ledger._write_archive = write_and_race
+
+    assert ledger.archive() == 0 and raced == [3]  # the other worker won; nothing is archived twice
+    assert os.listdir(archive_dir) == ["actions-000000000001-000000000003.ndjson.gz"]
+
+
+def test_migration_starts_the_sequence_past_the_watermark(tmp_path):
+    path = str(tmp_path / "old.db")
+    migrations.upgrade(path, target=10)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users(id, ig_user_id, created_at, updated_at) VALUES(1, '1', '', '')")
+    conn.execute("INSERT INTO actions(id, user_id, action, target_id, delta_credits, created_at) "
+                 "VALUES(5, 1, 1, 9, -1, 0)")
+    conn.execute("INSERT INTO ledger_state(key, value) VALUES('rollup_id', 8)")
+    conn.commit()
+    conn.close()
+
+    migrations.upgrade(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO actions(user_id, action, target_id, delta_credits, created_at) VALUES(1, 1, 10, -1, 0)")
+    assert [r[0] for r in conn.execute("SELECT id FROM actions ORDER BY id")] == [5, 9]
@@ -0,0 +1,15 @@
+import sqlite3
+
+import migrations
+
+
+def test_upgrade_creates_the_database_directory(tmp_path):
+    path = str(tmp_path / "data" / "nested" / "app.db")
+
+    assert migrations.upgrade(path) == migrations.LATEST_VERSION
+
+    conn = sqlite3.connect(path)
+    try:
+        assert migrations.current_version(conn) == migrations.LATEST_VERSION
+    finally:
+        conn.close()
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from payments import (TRANSFER_TOPIC, USDT_TRC20_CONTRACT, FixtureProvider, PaymentVerifier, Transfer,
+                      TronGridProvider, tron_hex)
+
+_B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+
+def _address(seed: int) -> str:
+    """A valid base58 Tron address for the 20 bytes ``seed`` repeated."""
+    raw = b"\x41" + bytes([seed]) * 20
+    raw += hashlib.sha256(hashlib.sha256(raw).digest()).digest()[:4]
+    n, out = int.from_bytes(raw, "big"), ""
+    while n:
+        n, r = divmod(n, 58)
+        out = _B58[r] + out
+    return out
+
+
+WALLET = _address(1)
+OTHER = _address(2)
+OTHER_TOKEN = _address(3)
+PRICES = {"starter": Decimal("10"), "lifetime": Decimal("50")}
+
+
+def _iso(ts: float) -> str:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z"
+
+
+def _verifier(provider=None, **kw) -> PaymentVerifier:
+    return PaymentVerifier(None, provider, WALLET, PRICES, approve=list, reject=list,
+                           min_confirmations=19, **kw)
+
+
+def _transfer(**kw) -> Transfer:
+    fields = dict(txid="t1", success=True, token=tron_hex(USDT_TRC20_CONTRACT), to=tron_hex(WALLET),
+                  amount=Decimal("10"), confirmations=19, timestamp=None)
+    fields.update(kw)
+    return Transfer(**fields)
+
+
+ROW = {"plan": "starter", "created_at": _iso(1_700_000_000)}
+
+
+@pytest.mark.parametrize("transfer, verdict", [
+    (_transfer(), "ok"),
+    (None, None),
+    (_transfer(confirmations=18), None),
+    (_transfer(success=False), "transaction_failed"),
+    (_transfer(token=tron_hex(OTHER_TOKEN)), "wrong_token"),
+    (_transfer(to=tron_hex(OTHER)), "wrong_recipient"),
+    (_transfer(amount=Decimal("9.999999")), "amount_too_low"),
+    (_transfer(timestamp=1_700_000_000 - 600), "ok"),  # paid first, TXID pasted afterwards
+    (_transfer(timestamp=1_700_000_000 - 72 * 3600 + 60), "ok"),
+    (_transfer(timestamp=1_700_000_000 - 72 * 3600 - 1), "transfer_too_old"),
+])
+def test_decide(transfer, verdict):
+    assert _verifier().decide(ROW, transfer) == verdict
+
+
+def test_decide_unknown_plan():
+    assert _verifier().decide(dict(ROW, plan="gold"), _transfer()) == "invalid_plan"
+
+
+def _log(token: str, to: str, amount: int) -> dict:
+    return {"address": tron_hex(token), "data": f"{amount:064x}",
+            "topics": [TRANSFER_TOPIC, "0" * 64, "0" * 24 + tron_hex(to)]}
+
+
+def test_trongrid_picks_the_usdt_transfer_to_our_wallet():
+    info = {
+        "blockNumber": 100,
+        "blockTimeStamp": 1_700_000_123_000,
+        "receipt": {"result": "SUCCESS"},
+        "log": [
+            _log(OTHER_TOKEN, WALLET, 99_000_000),
+            _log(USDT_TRC20_CONTRACT, OTHER, 98_000_000),
+            _log(USDT_TRC20_CONTRACT, WALLET, 10_000_000),
+        ],
+    }
+    provider = TronGridProvider(session=object(), address=WALLET)
+    t = provider._parse("t1", info, 120, provider.token, provider.address)
+    assert (t.token, t.to, t.amount) == (tron_hex(USDT_TRC20_CONTRACT), tron_hex(WALLET), Decimal("10"))
+    assert t.confirmations == 20 and t.timestamp == 1_700_000_123
+
+    info["log"] = info["log"][:2]
+    t = provider._parse("t1", info, 120, provider.token, provider.address)
+    assert _verifier().decide(ROW, t) == "wrong_token"
+
+
+@pytest.fixture
+def verifier(app_module, tmp_path):
+    path = tmp_path / "transfers.json"
+    path.write_text("{}")
+    v = PaymentVerifier(app_module.db, FixtureProvider(str(path)), WALLET, PRICES,
+                        approve=app_module.approve_payment_requests, reject=app_module.reject_payment_requests,
+                        min_confirmations=19, recheck=0)
+    v.fixture = path
+    return v
+
+
+def _submit(client, token, txid, plan="starter"):
+    return client.post("/api/payment/submit-txid", json={"plan": plan, "txid": txid},
+                       headers={"X-Session-ID": token})
+
+
+def _request(app_module, txid):
+    with app_module.db() as conn:
+        return conn.execute("""
+            SELECT p.status, p.note, u.credits FROM payment_requests p JOIN users u ON u.id = p.user_id
+            WHERE p.txid = ?
+        """, (txid,)).fetchone()
+
+
+def test_verifier_approves_rejects_and_waits(app_module, client, login, verifier):
+    now = time.time()
+    txids = {name: f"{name}{int(now * 1000)}".ljust(24, "0") for name in
+             ("paid", "wrongtoken", "short", "unconfirmed", "stale")}
+    for txid in txids.values():
+        _, token = login()
+        assert _submit(client, token, txid).status_code == 200
+    # The usual order: the transfer is mined, then the user submits its TXID.
+    ok = {"to": WALLET, "amount": "10", "confirmations": 20, "timestamp": now - 600}
+    verifier.fixture.write_text(json.dumps({
+        txids["paid"]: ok,
+        txids["wrongtoken"]: dict(ok, token=OTHER_TOKEN),
+        txids["short"]: dict(ok, amount="9.5"),
+        txids["unconfirmed"]: dict(ok, confirmations=3),
+        txids["stale"]: dict(ok, timestamp=now - 4 * 86400),
+    }))
+    credits = _request(app_module, txids["paid"])["credits"]
+
+    verifier.run_once()
+
+    paid = _request(app_module, txids["paid"])
+    assert paid["status"] == "approved" and paid["credits"] == credits + app_module.STARTER_PACK_CREDITS
+    for name, reason in (("wrongtoken", "wrong_token"), ("short", "amount_too_low"),
+                         ("stale", "transfer_too_old")):
+        row = _request(app_module, txids[name])
+        assert (row["status"], row["note"]) == ("rejected", f"auto: {reason}")
+    assert _request(app_module, txids["unconfirmed"])["status"] == "pending"
+
+
+def test_duplicate_txid_is_credited_once(app_module, client, login, verifier):
+    txid = f"dup{int(time.time() * 1000)}".ljust(24, "0")
+    _, token = login()
+    _, other = login()
+    assert _submit(client, token, txid).status_code == 200
+    resp = _submit(client, other, txid)
+    assert resp.status_code == 409 and resp.get_json()["error"] == "txid_already_submitted"
+
+    verifier.fixture.write_text(json.dumps(
+        {txid: {"to": WALLET, "amount": "10", "confirmations": 20, "timestamp": time.time() - 300}}))
+    credits = _request(app_module, txid)["credits"]
+    with app_module.db() as conn:
+        row = dict(conn.execute("SELECT id, user_id, plan, txid FROM payment_requests WHERE txid = ?",
+                                (txid,)).fetchone())
+
+    verifier.run_once()
+    assert app_module.approve_payment_requests([row]) == 0
+    verifier.run_once()
+
+    assert _request(app_module, txid)["credits"] == credits + app_module.STARTER_PACK_CREDITS
+
+
+def test_admin_key_is_required(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "ADMIN_GRANT_KEY", "s3cret")
+
+    assert client.get("/api/admin/payments").status_code == 403
+    assert client.get("/api/admin/payments", headers={"X-Admin-Key": "s3cre"}).status_code == 403
+    assert client.get("/api/admin/payments", headers={"X-Admin-Key": "sécret"}).status_code == 403
+    assert client.get("/api/admin/payments", headers={"Authorization": "Bearer s3cret"}).status_code == 200
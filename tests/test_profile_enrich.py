@@ -0,0 +1,46 @@
+from array import array
+
+from diffengine import UserRecord
+
+
+def _snapshot(app_module, ig_user_id, unfollowers, meta):
+    empty = app_module.pack_ids(array("q"))
+    with app_module.db() as conn:
+        conn.execute("""
+            INSERT INTO follow_snapshots(
+                ig_user_id, scanned_at, follower_count, following_count,
+                followers, following, followers_head, following_head,
+                following_meta, unfollowers
+            )
+            VALUES(?,?,0,0,?,?,?,?,?,?)
+        """, (ig_user_id, app_module.now_iso(), empty, empty, empty, empty,
+              app_module._pack_meta(meta), app_module.pack_ids(array("q", unfollowers))))
+        conn.commit()
+
+
+def test_unfollowers_are_enriched_through_the_profile_cache(app_module, client, login, monkeypatch):
+    user_id, token = login(sessionid="ig-cookie")
+    with app_module.db() as conn:
+        ig_user_id = conn.execute("SELECT ig_user_id FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+    name = f"gone{user_id}"
+    _snapshot(app_module, ig_user_id, [11, 12], [UserRecord(11, name, "Old Name")])
+
+    calls = []
+
+    def fetch(sessionid, username):
+        calls.append((sessionid, username))
+        return True, {"username": username, "full_name": "New Name",
+                      "edge_followed_by": {"count": 7}, "edge_follow": {"count": 3}}
+
+    monkeypatch.setattr(app_module.profile_cache, "_fetch", fetch)
+
+    for _ in range(2):
+        resp = client.get("/api/scan/unfollowers", headers={"X-Session-ID": token})
+        assert resp.status_code == 200
+        users = resp.get_json()["users"]
+        assert users[0] == {"pk": 11, "username": name, "full_name": "New Name", "is_private": False,
+                            "is_verified": False, "profile_pic_url": None,
+                            "follower_count": 7, "following_count": 3}
+        assert users[1] == {"pk": 12}
+
+    assert calls == [("ig-cookie", name)]
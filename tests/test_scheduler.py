@@ -0,0 +1,131 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import migrations
+from jobs import JobQueue
+from scheduler import Dispatcher, FairScheduler
+
+
+class Clock:
+    def __init__(self, t: float = 1000.0):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+
+def _run(sched, n):
+    """Dispatch and finish up to ``n`` items; returns the accounts in order."""
+    order = []
+    for _ in range(n):
+        picked = sched.next()
+        if picked is None:
+            break
+        sched.done(picked[0])
+        order.append(picked[0])
+    return order
+
+
+def test_stride_order_follows_plan_weights():
+    sched = FairScheduler(rate=0, weights={"free": 1, "lifetime": 4}, clock=Clock())
+    sched.add("big", "lifetime", 1, list(range(100)))
+    sched.add("small", "free", 2, list(range(10)))
+
+    order = _run(sched, 15)
+
+    assert order[:6] == ["big", "small", "big", "big", "big", "big"]
+    assert order.count("big") == 12 and order.count("small") == 3
+
+
+def test_idle_time_earns_no_credit():
+    sched = FairScheduler(rate=0, weights={"free": 1}, clock=Clock())
+    sched.add("a", "free", 1, list(range(20)))
+    assert _run(sched, 8) == ["a"] * 8
+
+    sched.add("b", "free", 2, list(range(20)))
+
+    assert _run(sched, 6) == ["b", "a", "b", "a", "b", "a"]
+
+
+def test_token_bucket_paces_each_account():
+    clock = Clock()
+    sched = FairScheduler(rate=0.5, burst=2, clock=clock)
+    sched.add("a", "free", 1, list(range(10)))
+
+    assert _run(sched, 10) == ["a", "a"]  # the burst, then the bucket is empty
+    assert sched.next() is None
+    assert sched.next_ready_in() == pytest.approx(2.0)
+
+    clock.t += 1.9
+    assert sched.next() is None
+    clock.t += 0.1
+    assert _run(sched, 10) == ["a"]
+
+    clock.t += 10  # refills to ``burst``, not beyond
+    assert _run(sched, 10) == ["a", "a"]
+
+
+def test_failures_back_off_doubling_up_to_the_cap():
+    clock = Clock()
+    sched = FairScheduler(rate=0, backoff=10, max_backoff=25, clock=clock)
+    sched.add("a", "free", 1, list(range(10)))
+
+    for delay in (10, 20, 25, 25):
+        assert sched.next() is not None
+        sched.done("a", ok=False)
+        assert sched.next_ready_in() == pytest.approx(delay)
+        clock.t += delay - 0.01
+        assert sched.next() is None
+        clock.t += 0.01
+
+    assert sched.next() is not None
+    sched.done("a", ok=True)
+    assert sched.next() is not None
+    sched.done("a", ok=False)
+    assert sched.next_ready_in() == pytest.approx(10)  # a success resets the streak
+
+
+@pytest.fixture
+def queue(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    migrations.upgrade(path)
+
+    @contextmanager
+    def db():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    return JobQueue(db, workers=0)
+
+
+def test_dispatcher_resumes_from_the_checkpoint(queue):
+    job_id = queue.enqueue("unfollow", 1, {"targets": ["a", "b", "c", "d"]})
+    with queue._db() as conn:  # a previous worker got through two targets, then died
+        conn.execute("UPDATE jobs SET checkpoint = ? WHERE id = ?",
+                     (json.dumps({"next": 2, "done": ["a"], "failed": ["b"]}), job_id))
+        conn.commit()
+
+    ran, released = [], []
+    dispatcher = Dispatcher(
+        queue, FairScheduler(rate=0, clock=Clock()), "unfollow",
+        open_job=lambda job: (job.user_id, "free", job.payload["targets"], None),
+        run_item=lambda ctx, item: ran.append(item) or True,
+        close_job=lambda job, ctx, done, failed: {"done": done, "failed": failed},
+        release=lambda job: released.append(dict(job.checkpoint)),
+    )
+
+    assert dispatcher.refill() == 1
+    assert dispatcher.run_ready() == 2
+
+    assert ran == ["c", "d"]
+    job = queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"done": ["a", "c", "d"], "failed": ["b"]}
+    assert released == [{"next": 4, "done": ["a", "c", "d"], "failed": ["b"]}]
@@ -0,0 +1,132 @@
+from array import array
+
+import pytest
+
+from scheduler import Dispatcher, FairScheduler
+
+
+@pytest.fixture
+def dispatcher(app_module):
+    with app_module.db() as conn:
+        conn.execute("DELETE FROM jobs")
+        conn.commit()
+    a = app_module
+    return Dispatcher(
+        a.job_queue, FairScheduler(rate=0, backoff=0), "unfollow",
+        a._open_unfollow_job, a._unfollow_target, a._close_unfollow_job, a._release_unfollow_job,
+    )
+
+
+def _enqueue(client, token, targets):
+    resp = client.post("/unfollow/batch", json={"user_ids": targets}, headers={"X-Session-ID": token})
+    assert resp.status_code == 202, resp.get_json()
+    return resp.get_json()["job_id"]
+
+
+def _balance(app_module, user_id):
+    with app_module.db() as conn:
+        credits = conn.execute("SELECT credits FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+        net = conn.execute("SELECT COALESCE(SUM(delta_credits), 0) FROM actions WHERE user_id = ?",
+                           (user_id,)).fetchone()[0]
+    return credits, net
+
+
+def test_failed_targets_are_refunded(app_module, client, login, dispatcher, monkeypatch):
+    monkeypatch.setattr(app_module, "unfollow_user", lambda sessionid, target: target != "2")
+    user_id, token = login()
+    credits, _ = _balance(app_module, user_id)
+    job_id = _enqueue(client, token, ["1", "2", "3"])
+
+    dispatcher.refill()
+    assert dispatcher.run_ready() == 3
+
+    job = app_module.job_queue.get(job_id)
+    assert job["status"] == "done"
+    assert job["result"] == {"unfollowed": ["1", "3"], "failed": ["2"], "refunded": 1}
+    assert _balance(app_module, user_id) == (credits - 2, -2)
+
+
+def test_job_runs_after_the_session_is_gone(app_module, client, login, dispatcher, monkeypatch):
+    monkeypatch.setattr(app_module, "unfollow_user", lambda sessionid, target: True)
+    user_id, token = login()
+    job_id = _enqueue(client, token, ["1", "2"])
+    app_module.sessions.revoke(token)
+    app_module.session_cache.invalidate(token)
+
+    dispatcher.refill()
+    dispatcher.run_ready()
+
+    assert app_module.job_queue.get(job_id)["status"] == "done"
+
+
+def test_terminal_failure_refunds_every_reserved_target(app_module, client, login, dispatcher):
+    user_id, token = login()
+    credits, _ = _balance(app_module, user_id)
+    job_id = _enqueue(client, token, ["1", "2", "3"])
+    with app_module.db() as conn:
+        conn.execute("DELETE FROM user_session_data WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+    dispatcher.refill()
+
+    job = app_module.job_queue.get(job_id)
+    assert (job["status"], job["error"]) == ("failed", "instagram_session_missing")
+    assert _balance(app_module, user_id) == (credits, 0)
+
+
+def test_exhausted_attempts_refund_the_unprocessed_rest(app_module, client, login, dispatcher, monkeypatch):
+    monkeypatch.setattr(app_module, "unfollow_user", lambda sessionid, target: True)
+    user_id, token = login()
+    credits, _ = _balance(app_module, user_id)
+    job_id = _enqueue(client, token, ["1", "2", "3"])
+    with app_module.db() as conn:  # one target done, then the worker kept crashing
+        conn.execute("UPDATE jobs SET checkpoint = ?, attempts = ? WHERE id = ?",
+                     ('{"next": 1, "done": ["1"], "failed": []}', app_module.job_queue.max_attempts, job_id))
+        conn.commit()
+
+    dispatcher.refill()
+
+    assert app_module.job_queue.get(job_id)["status"] == "failed"
+    assert _balance(app_module, user_id) == (credits - 1, -1)
+
+
+def test_lost_lease_is_not_released_twice(app_module, client, login, dispatcher):
+    user_id, token = login()
+    credits, _ = _balance(app_module, user_id)
+    job_id = _enqueue(client, token, ["1"])
+    with app_module.db() as conn:
+        conn.execute("DELETE FROM user_session_data WHERE user_id = ?", (user_id,))
+        conn.commit()
+    job = app_module.job_queue.claim_many("unfollow", 1, "other-process")[0]
+    with app_module.db() as conn:  # taken over by yet another worker
+        conn.execute("UPDATE jobs SET locked_by = 'someone-else:1' WHERE id = ?", (job_id,))
+        conn.commit()
+
+    assert not app_module.job_queue.fail(job, "boom")
+    dispatcher._fail(job, "boom")
+    assert _balance(app_module, user_id) == (credits - 1, -1)
+
+
+def test_unfollowed_accounts_stay_gone_after_a_rebuild(app_module, client, login, dispatcher, monkeypatch):
+    monkeypatch.setattr(app_module, "unfollow_user", lambda sessionid, target: True)
+    user_id, token = login()
+    with app_module.db() as conn:
+        ig_user_id = conn.execute("SELECT ig_user_id FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+    diff = app_module.NonFollowerDiff()
+    diff.add_follower_ids([3])
+    diff.seal_followers()
+    diff.add_following({"pk": pk, "username": f"u{pk}"} for pk in (1, 2, 3))
+    diff.finish()
+    heads = {"followers": array("q"), "following": array("q")}
+    app_module.save_snapshot(ig_user_id, diff, heads, None)
+    app_module.scan_results.set(user_id, diff)
+
+    _enqueue(client, token, ["2"])
+    dispatcher.refill()
+    dispatcher.run_ready()
+
+    assert list(diff.order) == [1] and list(diff.following) == [1, 3]
+    app_module.scan_results.invalidate(user_id)  # e.g. the next request lands on another worker
+    resp = client.get("/api/scan/results", headers={"X-Session-ID": token})
+    body = resp.get_json()
+    assert [u["pk"] for u in body["users"]] == [1]
@@ -0,0 +1,61 @@
+def _credits(app_module, user_id):
+    with app_module.db() as conn:
+        return conn.execute("SELECT credits FROM users WHERE id = ?", (user_id,)).fetchone()[0]
+
+
+def test_unfollow_enqueues_job(app_module, client, login):
+    user_id, token = login()
+    before = _credits(app_module, user_id)
+
+    resp = client.post("/unfollow", json={"user_id": "12345"}, headers={"X-Session-ID": token})
+
+    assert resp.status_code == 202, resp.get_json()
+    body = resp.get_json()
+    assert body["success"] and body["reserved"] == 1
+    job = app_module.job_queue.get(body["job_id"])
+    assert job["kind"] == "unfollow" and job["status"] == "queued"
+    assert _credits(app_module, user_id) == before - 1
+
+
+def test_unfollow_batch_reserves_what_the_balance_covers(app_module, client, login):
+    user_id, token = login()
+    with app_module.db() as conn:
+        conn.execute("UPDATE users SET credits = 2 WHERE id = ?", (user_id,))
+        conn.commit()
+    app_module.invalidate_user(user_id)
+
+    resp = client.post("/unfollow/batch", json={"user_ids": ["1", "2", "3"]}, headers={"X-Session-ID": token})
+
+    assert resp.status_code == 202, resp.get_json()
+    body = resp.get_json()
+    assert body["reserved"] == 2 and body["skipped"] == ["3"]
+    assert app_module.job_queue.get(body["job_id"])["status"] == "queued"
+    assert _credits(app_module, user_id) == 0
+
+
+def test_unfollow_without_credits_is_refused(app_module, client, login):
+    user_id, token = login()
+    with app_module.db() as conn:
+        conn.execute("UPDATE users SET credits = 0 WHERE id = ?", (user_id,))
+        conn.commit()
+    app_module.invalidate_user(user_id)
+
+    resp = client.post("/unfollow", json={"user_id": "12345"}, headers={"X-Session-ID": token})
+
+    assert resp.status_code == 402
+    assert resp.get_json()["error"] == "no_credits"
+
+
+def test_unfollow_refunds_when_the_job_cannot_be_enqueued(app_module, client, login, monkeypatch):
+    user_id, token = login()
+    before = _credits(app_module, user_id)
+
+    def fail(*args, **kwargs):
+        raise app_module.sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(app_module.job_queue, "enqueue", fail)
+    resp = client.post("/unfollow/batch", json={"user_ids": ["1", "2"]}, headers={"X-Session-ID": token})
+
+    assert resp.status_code == 500
+    assert resp.get_json()["error"] == "server_error"
+    assert _credits(app_module, user_id) == before